@@ -0,0 +1,8 @@
+"""
+Speed/accuracy report scripts, run from the repository root:
+
+    python -m benchmarks.bench_precision --precision int8
+
+Shared fixtures, box matching and the model/sample options live in benchmarks.common.
+The assertion-based parity checks are in tests/.
+"""
@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import argparse
+from functools import partial
+
+import numpy as np
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+# Ensure we can import the project modules (also when run as a script)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.GroundingDINO.backbone.swin_transformer import WindowAttention
+from models.GroundingDINO.fuse_modules import BiMultiHeadAttention
+
+# swin_B_384_22k: window 12, (dim, heads) per stage at strides 4/8/16/32
+SWIN_STAGES = ((128, 4), (256, 8), (512, 16), (1024, 32))
+WINDOW = 12
+# Feature fusion layer of the encoder: d_model 256, embed dim_feedforward // 2, nheads // 2
+FUSION = dict(v_dim=256, l_dim=256, embed_dim=1024, num_heads=4)
+
+
+def _ceil(value, multiple):
+    return -(-value // multiple) * multiple
+
+
+def _configured(cls, config, **kwargs):
+    module = cls(**kwargs)
+    for name, value in config.items():
+        setattr(module, name, value)
+    return module
+
+
+def cases(size, max_size, text_lens, fusion_memory_mb=()):
+    """
+    (name, build_before(), build_after(), inputs()) for every Swin stage and the fusion layer at
+    a size/max_size input (manual attention vs SDPA), plus the fusion layer streamed in blocks
+    for each fusion_memory_mb budget (SDPA on all image tokens vs blocks).
+    """
+    manual, sdpa = {"use_sdpa": False}, {"use_sdpa": True}
+    # 4:3 landscape image resized like FusedPreprocessor
+    h, w = size, min(max_size, int(round(size * 4 / 3)))
+    out = []
+    for stage, (dim, heads) in enumerate(SWIN_STAGES):
+        stride = 4 * 2 ** stage
+        hp, wp = _ceil(_ceil(h, stride) // stride, WINDOW), _ceil(_ceil(w, stride) // stride, WINDOW)
+        windows = (hp // WINDOW) * (wp // WINDOW)
+        n = WINDOW * WINDOW
+        build = partial(_configured, WindowAttention, dim=dim, window_size=(WINDOW, WINDOW), num_heads=heads)
+
+        def inputs(dim=dim, windows=windows, n=n):
+            # Shifted-window blocks: 0/-100 mask per window
+            mask = torch.zeros(windows, n, n)
+            mask[windows // 2:, :, : n // 2] = -100.0
+            return torch.randn(windows, n, dim), mask
+
+        out.append((f"swin stage {stage + 1} ({windows} windows)", partial(build, manual), partial(build, sdpa), inputs))
+
+    n_img = sum(_ceil(h, 8 * 2 ** lvl) // (8 * 2 ** lvl) * (_ceil(w, 8 * 2 ** lvl) // (8 * 2 ** lvl)) for lvl in range(4))
+    build = partial(_configured, BiMultiHeadAttention, dropout=0.0, **FUSION)
+    for text_len in text_lens:
+        def inputs(text_len=text_len):
+            mask_l = torch.zeros(1, text_len, dtype=torch.bool)
+            mask_l[:, text_len - text_len // 4:] = True  # padded caption
+            return (torch.randn(1, n_img, FUSION["v_dim"]), torch.randn(1, text_len, FUSION["l_dim"]),
+                    torch.zeros(1, n_img, dtype=torch.bool), mask_l)
+
+        out.append((f"fusion {n_img} img x {text_len} text", partial(build, manual), partial(build, sdpa), inputs))
+        for budget in fusion_memory_mb:
+            out.append((f"  sdpa -> blocks of {budget:g} MB", partial(build, sdpa),
+                        partial(build, {"max_memory_mb": budget}), inputs))
+    return out
+
+
+def _forward(build, inputs):
+    torch.manual_seed(0)
+    module = build().eval()
+    return module, inputs()
+
+
+def peak_mb(build, inputs):
+    """Peak of live CPU tensor memory allocated during one forward, from the profiler's allocation events."""
+    module, args = _forward(build, inputs)
+    with torch.no_grad(), profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        module(*args)
+    live = peak = 0
+    for event in sorted(prof.events(), key=lambda e: e.time_range.start):
+        live += event.self_cpu_memory_usage
+        peak = max(peak, live)
+    return peak / 1e6
+
+
+def time_ms(build, inputs, repeats):
+    module, args = _forward(build, inputs)
+    times = []
+    with torch.no_grad():
+        reference = module(*args)  # warm-up
+        for _ in range(repeats):
+            start = time.perf_counter()
+            module(*args)
+            times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000, reference
+
+
+def run(args):
+    print(f"\nattention variants | {torch.get_num_threads()} threads | input {args.size}/{args.max_size} (4:3)\n")
+    print(f"{'layer':<34}{'before ms':>10}{'after ms':>9}{'speedup':>9}{'before MB':>11}{'after MB':>9}{'max|diff|':>11}")
+    max_diff = 0.0
+    for name, build_before, build_after, inputs in cases(args.size, args.max_size, args.text_len, args.fusion_memory_mb):
+        before_ms, before_out = time_ms(build_before, inputs, args.repeats)
+        after_ms, after_out = time_ms(build_after, inputs, args.repeats)
+        before_out = before_out if isinstance(before_out, tuple) else (before_out,)
+        after_out = after_out if isinstance(after_out, tuple) else (after_out,)
+        diff = max((a - b).abs().max().item() for a, b in zip(before_out, after_out))
+        max_diff = max(max_diff, diff)
+        before_mb, after_mb = peak_mb(build_before, inputs), peak_mb(build_after, inputs)
+        print(f"{name:<34}{before_ms:>10.1f}{after_ms:>9.1f}{before_ms / after_ms:>8.2f}x{before_mb:>11.0f}"
+              f"{after_mb:>9.0f}{diff:>11.1e}")
+    print(f"\nmax output difference: {max_diff:.1e} (peak MB = live tensor memory during one forward)")
+    return max_diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Swin window attention and vision-language fusion: manual attention vs SDPA vs streamed blocks, time and peak memory")
+    parser.add_argument("--size", type=int, default=800)
+    parser.add_argument("--max-size", type=int, default=1333)
+    parser.add_argument("--text-len", type=int, nargs="*", default=[32, 256], help="Caption token lengths for the fusion layer")
+    parser.add_argument("--fusion-memory-mb", type=float, nargs="*", default=[32, 128],
+                        help="Working-memory budgets for the streamed fusion layer")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--atol", type=float, default=1e-4, help="Parity check: exit with an error above this difference")
+    args = parser.parse_args()
+
+    torch.set_num_threads(max(1, os.cpu_count() or 1))
+    if run(args) > args.atol:
+        print(f"FAILED: outputs differ by more than {args.atol}")
+        sys.exit(1)
@@ -0,0 +1,81 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+import torch
+
+# Ensure we can import the project modules (also when run as a script)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import detector_logic
+import preprocess
+import compiled_inference
+from benchmarks.common import compare, time_model, add_model_arguments, fixture_paths
+
+
+def run(args, paths):
+    model, _, _ = detector_logic.load_detector_model(
+        args.config, args.checkpoint, "cpu", precision=args.precision, text_encoder_type=args.text_encoder,
+        cache_dir=args.cache_dir,
+    )
+    compiled = compiled_inference.CompiledCountGD(model, sizes=[(args.size, args.max_size)],
+                                                  backend=args.backend, mode=args.mode)
+    transform = preprocess.FusedPreprocessor(size=args.size, max_size=args.max_size)
+
+    print(f"\neager vs torch.compile ({args.backend}{', ' + args.mode if args.mode else ''}) | {args.precision} | "
+          f"prompt '{args.prompt}' | {torch.get_num_threads()} threads | input {args.size}/{args.max_size}")
+    print(f"shape buckets: {', '.join(f'{h}x{w}' for h, w in compiled.buckets)}\n")
+    print(f"{'image':<32}{'input':>11}{'bucket':>11}{'eager ms':>10}{'compiled':>10}{'speedup':>9}"
+          f"{'n':>5}{'F1@.5':>8}{'mIoU':>7}")
+
+    rows = []
+    for path in paths:
+        input_image, _, _ = detector_logic.prepare_detector_input(transform, path)
+        h, w = input_image.shape[-2:]
+        bucket = compiled.bucket_for(h, w)
+        model.compiled_inference = None
+        eager_ms, eager_boxes = time_model(model, input_image, args.prompt, args.threshold, args.repeats)
+        model.compiled_inference = compiled
+        compiled_ms, compiled_boxes = time_model(model, input_image, args.prompt, args.threshold, args.repeats)
+        metrics = compare(eager_boxes, compiled_boxes)
+        rows.append((eager_ms, compiled_ms, metrics))
+        print(f"{os.path.basename(path)[:31]:<32}{f'{h}x{w}':>11}{f'{bucket[0]}x{bucket[1]}' if bucket else '-':>11}"
+              f"{eager_ms:>10.0f}{compiled_ms:>10.0f}{eager_ms / compiled_ms:>8.2f}x{len(compiled_boxes):>5}"
+              f"{metrics['f1']:>8.3f}{metrics['mean_iou']:>7.3f}")
+
+    if compiled.failed:
+        print(f"\nCompilation failed, every image ran eager: {compiled.failed}")
+    print("\ncompile time (first call per bucket):")
+    for (bucket, tokens, budget), seconds in sorted(compiled.compile_times.items()):
+        print(f"  {bucket[0]}x{bucket[1]}, {tokens} tokens, queries {budget or 'default'}: {seconds:.1f}s")
+    eager_total = sum(r[0] for r in rows)
+    compiled_total = sum(r[1] for r in rows)
+    mean_f1 = float(np.mean([r[2]["f1"] for r in rows]))
+    print(f"\nsteady-state latency: eager {eager_total / len(rows):.0f} ms, compiled {compiled_total / len(rows):.0f} ms "
+          f"({eager_total / compiled_total:.2f}x), total compile {sum(compiled.compile_times.values()):.1f}s")
+    print(f"mean F1@0.5 vs eager: {mean_f1:.3f} (padding to a bucket moves the image border the model sees)")
+    return mean_f1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CountGD torch.compile report: compile time per shape bucket and steady-state speedup")
+    parser.add_argument("--precision", choices=detector_logic.PRECISIONS, default="fp32")
+    parser.add_argument("--backend", default="inductor")
+    parser.add_argument("--mode", help="torch.compile mode, e.g. max-autotune")
+    parser.add_argument("--images", nargs="*", help="Fixture images (default: synthetic JPEGs)")
+    parser.add_argument("--prompt", default="object")
+    parser.add_argument("--threshold", type=float, default=0.23)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--size", type=int, default=800)
+    parser.add_argument("--max-size", type=int, default=1333)
+    add_model_arguments(parser)
+    parser.add_argument("--min-f1", type=float, help="Parity check: exit with an error below this mean F1")
+    args = parser.parse_args()
+
+    torch.set_num_threads(max(1, os.cpu_count() or 1))
+    with fixture_paths(args) as paths:
+        mean_f1 = run(args, paths)
+    if args.min_f1 is not None and mean_f1 < args.min_f1:
+        print(f"FAILED: compiled parity F1 {mean_f1:.3f} < {args.min_f1}")
+        sys.exit(1)
@@ -0,0 +1,60 @@
+import os
+import sys
+import argparse
+
+import torch
+
+# Ensure we can import the project modules (also when run as a script)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import detector_logic
+import preprocess
+from benchmarks.common import add_model_arguments, add_sample_arguments, samples, sweep
+
+
+def run(args, samples):
+    """samples: (image path, prompt, ground-truth count or None)."""
+    model, _, _ = detector_logic.load_detector_model(
+        args.config, args.checkpoint, "cpu", precision=args.precision, text_encoder_type=args.text_encoder,
+        cache_dir=args.cache_dir,
+    )
+    decoder = model.transformer.decoder
+    decoder.exit_topk, decoder.min_layers = args.exit_topk, args.min_layers
+    transform = preprocess.FusedPreprocessor(size=args.size, max_size=args.max_size)
+    inputs = [detector_logic.prepare_detector_input(transform, path)[0] for path, _, _ in samples]
+
+    def tolerance(tol):
+        return lambda: setattr(decoder, "exit_tol", tol)
+
+    # The full decoder is the reference
+    variants = [("off", tolerance(None))] + [(f"tol {tol:g}", tolerance(tol)) for tol in args.exit_tols]
+    print(f"\ndecoder early exit | {args.precision} | {len(samples)} images | top {args.exit_topk} queries | "
+          f"min {args.min_layers} layers | threshold {args.threshold} | {torch.get_num_threads()} threads | "
+          f"input {args.size}/{args.max_size}\n")
+    f1 = sweep(model, inputs, samples, variants, args, detail_name="exit layer",
+               detail=lambda stats: stats["decoder_layers"][0])
+    decoder.exit_tol = None
+    return min(f1.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CountGD decoder early-exit report: layers run, speed and accuracy per tolerance")
+    parser.add_argument("--exit-tols", type=float, nargs="*", default=[0.005, 0.01, 0.02, 0.05])
+    parser.add_argument("--exit-topk", type=int, default=100, help="Highest-scoring queries checked for convergence")
+    parser.add_argument("--min-layers", type=int, default=2)
+    add_sample_arguments(parser)
+    parser.add_argument("--precision", choices=detector_logic.PRECISIONS, default="fp32")
+    parser.add_argument("--threshold", type=float, default=0.23)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--size", type=int, default=800)
+    parser.add_argument("--max-size", type=int, default=1333)
+    add_model_arguments(parser)
+    parser.add_argument("--min-f1", type=float, help="Parity check: exit with an error if any tolerance falls below this F1")
+    args = parser.parse_args()
+
+    torch.set_num_threads(max(1, os.cpu_count() or 1))
+    with samples(args) as image_samples:
+        min_f1 = run(args, image_samples)
+    if args.min_f1 is not None and min_f1 < args.min_f1:
+        print(f"FAILED: early-exit F1 {min_f1:.3f} < {args.min_f1}")
+        sys.exit(1)
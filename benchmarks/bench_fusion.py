@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+# Ensure we can import the project modules (also when run as a script)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import detector_logic
+import preprocess
+import inference_fusion
+from benchmarks.common import compare, time_model, add_model_arguments, fixture_paths
+
+
+def raw_outputs(model, input_image, prompt):
+    """(pred_logits, pred_boxes, encoder memory); the memory is compared before any top-k selection."""
+    captured = {}
+    handle = model.transformer.encoder.register_forward_hook(lambda m, i, out: captured.update(memory=out[0]))
+    try:
+        with torch.no_grad():
+            output = model(input_image.unsqueeze(0), [torch.tensor([])], [torch.tensor([0])],
+                           captions=[prompt + " ."])
+    finally:
+        handle.remove()
+    return output["pred_logits"][0], output["pred_boxes"][0], captured["memory"]
+
+
+def output_diff(reference, candidate, query_tol=1e-3):
+    """
+    Largest change of the encoder memory, plus the number of decoder queries without a
+    reference query within query_tol in (box, max logit), L1: near-tied proposals can swap in the
+    top-k from float-level differences, so the queries are matched rather than compared in order.
+    """
+    dmemory = (candidate[2] - reference[2]).abs().max().item()
+    ref = torch.cat([reference[1], reference[0].max(dim=-1, keepdim=True).values], dim=-1)
+    cand = torch.cat([candidate[1], candidate[0].max(dim=-1, keepdim=True).values], dim=-1)
+    dist = torch.cdist(cand.double(), ref.double(), p=1).min(dim=1).values
+    return dmemory, int((dist > query_tol).sum())
+
+
+def run(args, paths):
+    # One model, measured before and after the pass, so both runs share the exact weights
+    model, _, _ = detector_logic.load_detector_model(
+        args.config, args.checkpoint, "cpu", precision=args.precision, text_encoder_type=args.text_encoder,
+        cache_dir=args.cache_dir, fuse=False,
+    )
+    transform = preprocess.FusedPreprocessor(size=args.size, max_size=args.max_size)
+    inputs = [detector_logic.prepare_detector_input(transform, path)[0] for path in paths]
+
+    reference = []
+    for input_image in inputs:
+        ms, boxes = time_model(model, input_image, args.prompt, args.threshold, args.repeats)
+        reference.append((ms, boxes, raw_outputs(model, input_image, args.prompt)))
+    start = time.perf_counter()
+    fused = inference_fusion.freeze_for_inference(model)
+    fuse_s = time.perf_counter() - start
+
+    print(f"\nunfused vs freeze_for_inference | {args.precision} | prompt '{args.prompt}' | "
+          f"{torch.get_num_threads()} threads | input {args.size}/{args.max_size}")
+    print(f"fused in {fuse_s * 1000:.0f} ms: {', '.join(f'{n} {name}' for name, n in sorted(fused.items()))}\n")
+    print(f"{'image':<32}{'unfused ms':>11}{'fused ms':>10}{'speedup':>9}{'n':>5}{'F1@.5':>8}"
+          f"{'max|dmemory|':>14}{'swapped':>9}")
+
+    rows = []
+    for path, input_image, (ref_ms, ref_boxes, ref_outputs) in zip(paths, inputs, reference):
+        ms, boxes = time_model(model, input_image, args.prompt, args.threshold, args.repeats)
+        metrics = compare(ref_boxes, boxes)
+        diff, swapped = output_diff(ref_outputs, raw_outputs(model, input_image, args.prompt))
+        rows.append((ref_ms, ms, metrics, diff, swapped))
+        print(f"{os.path.basename(path)[:31]:<32}{ref_ms:>11.0f}{ms:>10.0f}{ref_ms / ms:>8.2f}x{len(boxes):>5}"
+              f"{metrics['f1']:>8.3f}{diff:>14.1e}{swapped:>9}")
+
+    ref_total = sum(r[0] for r in rows)
+    total = sum(r[1] for r in rows)
+    max_diff = max(r[3] for r in rows)
+    swapped = max(r[4] for r in rows)
+    print(f"\nmean latency: unfused {ref_total / len(rows):.0f} ms, fused {total / len(rows):.0f} ms "
+          f"({ref_total / total:.2f}x)")
+    print(f"mean F1@0.5 vs unfused: {np.mean([r[2]['f1'] for r in rows]):.3f}, "
+          f"max encoder memory difference {max_diff:.1e}, at most {swapped} top-k queries swapped per image")
+    return max_diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CountGD freeze-for-inference report: output parity and latency of the fused model")
+    parser.add_argument("--precision", choices=detector_logic.PRECISIONS, default="fp32")
+    parser.add_argument("--images", nargs="*", help="Fixture images (default: synthetic JPEGs)")
+    parser.add_argument("--prompt", default="object")
+    parser.add_argument("--threshold", type=float, default=0.23)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--size", type=int, default=800)
+    parser.add_argument("--max-size", type=int, default=1333)
+    add_model_arguments(parser)
+    parser.add_argument("--atol", type=float, default=1e-4,
+                        help="Parity check: exit with an error if the encoder memory moves more than this")
+    args = parser.parse_args()
+
+    torch.set_num_threads(max(1, os.cpu_count() or 1))
+    with fixture_paths(args) as paths:
+        max_diff = run(args, paths)
+    if max_diff > args.atol:
+        print(f"FAILED: fused encoder memory differs by {max_diff:.1e} > {args.atol}")
+        sys.exit(1)
@@ -0,0 +1,74 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+import torch
+
+# Ensure we can import the project modules (also when run as a script)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import detector_logic
+import preprocess
+import onnx_inference
+from benchmarks.common import BASE_DIR, compare, time_model, add_model_arguments, fixture_paths
+
+
+def run(args, paths):
+    model, _, _ = detector_logic.load_detector_model(
+        args.config, args.checkpoint, "cpu", text_encoder_type=args.text_encoder, cache_dir=args.cache_dir,
+    )
+    onnx_model = onnx_inference.OnnxCountGD(args.export_dir, num_threads=torch.get_num_threads())
+    transform = preprocess.FusedPreprocessor(size=onnx_model.size, max_size=onnx_model.max_size)
+
+    print(f"\nPyTorch vs ONNX Runtime (CPU) | prompt '{args.prompt}' | threshold {args.threshold} | "
+          f"{torch.get_num_threads()} threads | input {onnx_model.size}/{onnx_model.max_size}")
+    print(f"exported shapes: {', '.join(f'{h}x{w}' for h, w in onnx_model.buckets)}\n")
+    print(f"{'image':<32}{'input':>11}{'torch ms':>10}{'ort ms':>9}{'speedup':>9}{'torch n':>9}{'n':>5}"
+          f"{'F1@.5':>8}{'mIoU':>7}{'|dconf|':>9}")
+
+    rows = []
+    for path in paths:
+        input_image, _, _ = detector_logic.prepare_detector_input(transform, path)
+        h, w = input_image.shape[-2:]
+        if onnx_model.bucket_for(h, w) is None:
+            print(f"{os.path.basename(path)[:31]:<32}{f'{h}x{w}':>11}  skipped, no exported shape fits")
+            continue
+        torch_ms, torch_boxes = time_model(model, input_image, args.prompt, args.threshold, args.repeats)
+        ort_ms, ort_boxes = time_model(onnx_model, input_image, args.prompt, args.threshold, args.repeats)
+        metrics = compare(torch_boxes, ort_boxes)
+        rows.append((torch_ms, ort_ms, metrics))
+        print(f"{os.path.basename(path)[:31]:<32}{f'{h}x{w}':>11}{torch_ms:>10.0f}{ort_ms:>9.0f}"
+              f"{torch_ms / ort_ms:>8.2f}x{len(torch_boxes):>9}{len(ort_boxes):>5}{metrics['f1']:>8.3f}"
+              f"{metrics['mean_iou']:>7.3f}{metrics['conf_diff']:>9.4f}")
+
+    if not rows:
+        print("\nNo image fit an exported shape, nothing compared")
+        return 0.0
+    torch_total = sum(r[0] for r in rows)
+    ort_total = sum(r[1] for r in rows)
+    mean_f1 = float(np.mean([r[2]["f1"] for r in rows]))
+    print(f"\nmean latency: PyTorch {torch_total / len(rows):.0f} ms, ONNX Runtime {ort_total / len(rows):.0f} ms "
+          f"({torch_total / ort_total:.2f}x)")
+    print(f"mean F1@0.5 vs PyTorch: {mean_f1:.3f} (ONNX pads to the exported shape, PyTorch runs unpadded)")
+    return mean_f1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CountGD ONNX Runtime report: parity and latency against the PyTorch model")
+    parser.add_argument("--export-dir", default=os.path.join(BASE_DIR, "data", "model_cache", "countgd_onnx"),
+                        help="export_onnx.py output directory")
+    parser.add_argument("--images", nargs="*", help="Fixture images (default: synthetic JPEGs)")
+    parser.add_argument("--prompt", default="object")
+    parser.add_argument("--threshold", type=float, default=0.23)
+    parser.add_argument("--repeats", type=int, default=3)
+    add_model_arguments(parser)
+    parser.add_argument("--min-f1", type=float, help="Parity check: exit with an error below this mean F1")
+    args = parser.parse_args()
+
+    torch.set_num_threads(max(1, os.cpu_count() or 1))
+    with fixture_paths(args) as paths:
+        mean_f1 = run(args, paths)
+    if args.min_f1 is not None and mean_f1 < args.min_f1:
+        print(f"FAILED: ONNX parity F1 {mean_f1:.3f} < {args.min_f1}")
+        sys.exit(1)
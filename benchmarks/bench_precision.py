@@ -0,0 +1,69 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+import torch
+
+# Ensure we can import the project modules (also when run as a script)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import detector_logic
+import preprocess
+from benchmarks.common import compare, model_size_mb, time_model, add_model_arguments, fixture_paths
+
+
+def run(args, paths):
+    load = dict(text_encoder_type=args.text_encoder, cache_dir=args.cache_dir,
+                quantize_backbone=args.quantize_backbone)
+    reference = detector_logic.load_detector_model(args.config, args.checkpoint, "cpu", precision="fp32", **load)
+    candidate = detector_logic.load_detector_model(args.config, args.checkpoint, "cpu", precision=args.precision, **load)
+    transform = preprocess.FusedPreprocessor(size=args.size, max_size=args.max_size)
+
+    print(f"\nfp32 vs {args.precision} | prompt '{args.prompt}' | threshold {args.threshold} | "
+          f"{torch.get_num_threads()} threads | input {args.size}/{args.max_size}")
+    print(f"model size: fp32 {model_size_mb(reference[0]):.0f} MB, {args.precision} {model_size_mb(candidate[0]):.0f} MB\n")
+    print(f"{'image':<32}{'fp32 ms':>10}{args.precision + ' ms':>10}{'speedup':>9}{'fp32 n':>8}{'n':>6}"
+          f"{'F1@.5':>8}{'mIoU':>7}{'|dconf|':>9}")
+
+    rows = []
+    for path in paths:
+        input_image, exemplars, _ = detector_logic.prepare_detector_input(transform, path)
+        ref_ms, ref_boxes = time_model(reference[0], input_image, args.prompt, args.threshold, args.repeats)
+        cand_ms, cand_boxes = time_model(candidate[0], input_image, args.prompt, args.threshold, args.repeats)
+        metrics = compare(ref_boxes, cand_boxes)
+        rows.append((ref_ms, cand_ms, len(ref_boxes), len(cand_boxes), metrics))
+        print(f"{os.path.basename(path)[:31]:<32}{ref_ms:>10.0f}{cand_ms:>10.0f}{ref_ms / cand_ms:>8.2f}x"
+              f"{len(ref_boxes):>8}{len(cand_boxes):>6}{metrics['f1']:>8.3f}{metrics['mean_iou']:>7.3f}"
+              f"{metrics['conf_diff']:>9.4f}")
+
+    ref_total = sum(r[0] for r in rows)
+    cand_total = sum(r[1] for r in rows)
+    count_err = np.mean([abs(r[2] - r[3]) / max(r[2], 1) for r in rows])
+    print(f"\nmean latency: fp32 {ref_total / len(rows):.0f} ms, {args.precision} {cand_total / len(rows):.0f} ms "
+          f"({ref_total / cand_total:.2f}x)")
+    mean_f1 = float(np.mean([r[4]["f1"] for r in rows]))
+    print(f"mean F1@0.5 vs fp32: {mean_f1:.3f}, mean relative count error: {count_err * 100:.1f}%")
+    return mean_f1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CountGD accuracy-vs-speed report: fp32 against a reduced precision mode")
+    parser.add_argument("--precision", choices=[p for p in detector_logic.PRECISIONS if p != "fp32"], default="int8")
+    parser.add_argument("--images", nargs="*", help="Fixture images (default: synthetic JPEGs)")
+    parser.add_argument("--prompt", default="object")
+    parser.add_argument("--threshold", type=float, default=0.23)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--size", type=int, default=800)
+    parser.add_argument("--max-size", type=int, default=1333)
+    add_model_arguments(parser)
+    parser.add_argument("--quantize-backbone", action="store_true", help="int8: also quantize the Swin blocks")
+    parser.add_argument("--min-f1", type=float, help="Parity check: exit with an error below this mean F1")
+    args = parser.parse_args()
+
+    torch.set_num_threads(max(1, os.cpu_count() or 1))
+    with fixture_paths(args) as paths:
+        mean_f1 = run(args, paths)
+    if args.min_f1 is not None and mean_f1 < args.min_f1:
+        print(f"FAILED: {args.precision} parity F1 {mean_f1:.3f} < {args.min_f1}")
+        sys.exit(1)
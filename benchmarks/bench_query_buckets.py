@@ -0,0 +1,62 @@
+import os
+import sys
+import argparse
+
+import torch
+
+# Ensure we can import the project modules (also when run as a script)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import detector_logic
+import preprocess
+from benchmarks.common import add_model_arguments, add_sample_arguments, samples, sweep
+
+
+def run(args, samples):
+    """samples: (image path, prompt, ground-truth count or None)."""
+    model, _, _ = detector_logic.load_detector_model(
+        args.config, args.checkpoint, "cpu", precision=args.precision, text_encoder_type=args.text_encoder,
+        cache_dir=args.cache_dir,
+    )
+    transformer = model.transformer
+    transformer.bucket_margin = args.bucket_margin
+    transform = preprocess.FusedPreprocessor(size=args.size, max_size=args.max_size)
+    inputs = [detector_logic.prepare_detector_input(transform, path)[0] for path, _, _ in samples]
+
+    def buckets(sizes):
+        return lambda: setattr(transformer, "query_buckets", tuple(sorted(sizes)) if sizes else None)
+
+    # The config's query count is the reference; a single bucket is a fixed budget
+    variants = [(f"fixed {transformer.num_queries}", buckets(None))]
+    variants += [(f"fixed {n}", buckets((n,))) for n in args.query_buckets if n != transformer.num_queries]
+    variants.append(("adaptive", buckets(args.query_buckets)))
+    print(f"\nadaptive query budget | {args.precision} | {len(samples)} images | buckets "
+          f"{','.join(str(n) for n in sorted(args.query_buckets))} | proposals and detections > "
+          f"{args.threshold} | margin {args.bucket_margin} | {torch.get_num_threads()} threads | "
+          f"input {args.size}/{args.max_size}\n")
+    f1 = sweep(model, inputs, samples, variants, args, detail_name="queries",
+               detail=lambda stats: stats["num_queries"][0])
+    transformer.query_buckets = None
+    return f1["adaptive"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CountGD adaptive query budget report: queries chosen, speed and accuracy against fixed budgets")
+    parser.add_argument("--query-buckets", type=int, nargs="+", default=[100, 300, 900])
+    parser.add_argument("--bucket-margin", type=float, default=0.5, help="Grow past a bucket once the estimate exceeds this share of it")
+    add_sample_arguments(parser)
+    parser.add_argument("--precision", choices=detector_logic.PRECISIONS, default="fp32")
+    parser.add_argument("--threshold", type=float, default=0.23, help="Detection threshold, also the proposal score counted towards the estimate")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--size", type=int, default=800)
+    parser.add_argument("--max-size", type=int, default=1333)
+    add_model_arguments(parser)
+    parser.add_argument("--min-f1", type=float, help="Parity check: exit with an error if the adaptive mode falls below this F1")
+    args = parser.parse_args()
+
+    torch.set_num_threads(max(1, os.cpu_count() or 1))
+    with samples(args) as image_samples:
+        min_f1 = run(args, image_samples)
+    if args.min_f1 is not None and min_f1 < args.min_f1:
+        print(f"FAILED: adaptive query budget F1 {min_f1:.3f} < {args.min_f1}")
+        sys.exit(1)
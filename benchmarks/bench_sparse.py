@@ -0,0 +1,57 @@
+import os
+import sys
+import argparse
+
+import torch
+
+# Ensure we can import the project modules (also when run as a script)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import detector_logic
+import preprocess
+from benchmarks.common import add_model_arguments, add_sample_arguments, samples, sweep
+
+
+def run(args, samples):
+    """samples: (image path, prompt, ground-truth count or None)."""
+    model, _, _ = detector_logic.load_detector_model(
+        args.config, args.checkpoint, "cpu", precision=args.precision, text_encoder_type=args.text_encoder,
+        cache_dir=args.cache_dir,
+    )
+    encoder = model.transformer.encoder
+    encoder.dense_layers = args.dense_layers
+    transform = preprocess.FusedPreprocessor(size=args.size, max_size=args.max_size)
+    inputs = [detector_logic.prepare_detector_input(transform, path)[0] for path, _, _ in samples]
+
+    def keep(ratio):
+        return lambda: setattr(encoder, "keep_ratio", ratio)
+
+    # 1.0 (the dense encoder) is the reference
+    variants = [("keep 1.00", keep(None))] + [(f"keep {r:.2f}", keep(r)) for r in args.keep_ratios if r != 1.0]
+    print(f"\nsparse encoder | {args.precision} | {len(samples)} images | {args.dense_layers} dense layer(s) | "
+          f"threshold {args.threshold} | {torch.get_num_threads()} threads | input {args.size}/{args.max_size}\n")
+    f1 = sweep(model, inputs, samples, variants, args)
+    encoder.keep_ratio = None
+    return min(f1.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CountGD sparse encoder report: speed and accuracy per token keep ratio")
+    parser.add_argument("--keep-ratios", type=float, nargs="*", default=[0.5, 0.3, 0.1])
+    parser.add_argument("--dense-layers", type=int, default=1, help="Encoder layers run on every token before selection")
+    add_sample_arguments(parser)
+    parser.add_argument("--precision", choices=detector_logic.PRECISIONS, default="fp32")
+    parser.add_argument("--threshold", type=float, default=0.23)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--size", type=int, default=800)
+    parser.add_argument("--max-size", type=int, default=1333)
+    add_model_arguments(parser)
+    parser.add_argument("--min-f1", type=float, help="Parity check: exit with an error if any keep ratio falls below this F1")
+    args = parser.parse_args()
+
+    torch.set_num_threads(max(1, os.cpu_count() or 1))
+    with samples(args) as image_samples:
+        min_f1 = run(args, image_samples)
+    if args.min_f1 is not None and min_f1 < args.min_f1:
+        print(f"FAILED: sparse encoder F1 {min_f1:.3f} < {args.min_f1}")
+        sys.exit(1)
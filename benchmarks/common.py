@@ -0,0 +1,196 @@
+import io
+import os
+import json
+import sys
+import time
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+from PIL import Image
+
+# Repository root: project modules and the default config/checkpoint paths
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+import detector_logic
+
+
+def add_model_arguments(parser):
+    """--config/--checkpoint/--text-encoder/--cache-dir for scripts that load CountGD."""
+    parser.add_argument("--config", default=os.path.join(BASE_DIR, "config", "cfg_fsc147_vit_b.py"))
+    parser.add_argument("--checkpoint", default=os.path.join(BASE_DIR, "checkpoint_fsc147_best.pth"))
+    parser.add_argument("--text-encoder", default="bert-base-uncased")
+    parser.add_argument("--cache-dir", default=os.path.join(BASE_DIR, "data", "model_cache"))
+
+
+def add_sample_arguments(parser):
+    """Where the images come from: an FSC147 download, --images, or synthetic fixtures."""
+    parser.add_argument("--fsc147-root", help="FSC147 download: prompts and counts come from its class list and annotations")
+    parser.add_argument("--split", default="test")
+    parser.add_argument("--limit", type=int, default=50, help="FSC147 images to evaluate")
+    parser.add_argument("--images", nargs="*", help="Fixture images (default: synthetic JPEGs)")
+    parser.add_argument("--prompt", default="object", help="Prompt for --images / synthetic fixtures")
+
+
+def make_fixtures(out_dir, count=4):
+    """Smooth synthetic photos; use --images with real data for meaningful accuracy numbers."""
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        w, h = [(1280, 720), (1024, 768), (1920, 1080), (800, 800)][i % 4]
+        small = rng.integers(0, 255, (h // 16, w // 16, 3), dtype=np.uint8)
+        path = os.path.join(out_dir, f"fixture_{i}_{w}x{h}.jpg")
+        Image.fromarray(small).resize((w, h), Image.BILINEAR).save(path, "JPEG", quality=90)
+        paths.append(path)
+    return paths
+
+
+@contextmanager
+def fixture_paths(args):
+    """--images, or synthetic fixtures that live for the duration of the block."""
+    if args.images:
+        yield args.images
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        yield make_fixtures(tmp)
+
+
+@contextmanager
+def samples(args):
+    """(image path, prompt, ground-truth count or None) per add_sample_arguments."""
+    if args.fsc147_root:
+        yield fsc147_samples(args.fsc147_root, args.split, args.limit)
+        return
+    with fixture_paths(args) as paths:
+        yield [(path, args.prompt, None) for path in paths]
+
+
+def fsc147_samples(root, split="test", limit=None):
+    """
+    (image path, class name, ground-truth count) from an FSC147 download: annotation_FSC147_384.json,
+    ImageClasses_FSC147.txt, Train_Test_Val_FSC_147.json and images_384_VarV2/.
+    """
+    with open(os.path.join(root, "annotation_FSC147_384.json"), "r") as f:
+        annotations = json.load(f)
+    with open(os.path.join(root, "Train_Test_Val_FSC_147.json"), "r") as f:
+        names = json.load(f)[split]
+    classes = {}
+    with open(os.path.join(root, "ImageClasses_FSC147.txt"), "r") as f:
+        for line in f:
+            if line.strip():
+                name, cls = line.rstrip("\n").split("\t", 1)
+                classes[name] = cls
+    return [(os.path.join(root, "images_384_VarV2", name), classes[name], len(annotations[name]["points"]))
+            for name in names[:limit]]
+
+
+def model_size_mb(model):
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell() / 1e6
+
+
+def xyxy(boxes):
+    """[class, xc, yc, w, h, conf] (normalized) -> (N, 4) xyxy and (N,) conf arrays."""
+    if not boxes:
+        return np.zeros((0, 4)), np.zeros(0)
+    arr = np.array([b[1:6] for b in boxes], dtype=np.float64)
+    xc, yc, w, h, conf = arr.T
+    return np.stack([xc - w / 2, yc - h / 2, xc + w / 2, yc + h / 2], axis=1), conf
+
+
+def box_iou(a, b):
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(br - tl, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-12)
+
+
+def compare(reference, candidate, iou_thresh=0.5):
+    """Greedy IoU matching of candidate boxes against reference boxes (highest confidence first)."""
+    ref_boxes, ref_conf = xyxy(reference)
+    cand_boxes, cand_conf = xyxy(candidate)
+    if len(ref_boxes) == 0 or len(cand_boxes) == 0:
+        f1 = 1.0 if len(ref_boxes) == len(cand_boxes) else 0.0
+        return {"f1": f1, "mean_iou": float("nan"), "conf_diff": float("nan")}
+    ious = box_iou(cand_boxes, ref_boxes)
+    used, matched_iou, conf_diff = set(), [], []
+    for i in np.argsort(-cand_conf):
+        for j in np.argsort(-ious[i]):
+            if ious[i, j] < iou_thresh:
+                break
+            if j not in used:
+                used.add(j)
+                matched_iou.append(ious[i, j])
+                conf_diff.append(abs(cand_conf[i] - ref_conf[j]))
+                break
+    tp = len(matched_iou)
+    precision, recall = tp / len(cand_boxes), tp / len(ref_boxes)
+    f1 = 2 * precision * recall / (precision + recall) if tp else 0.0
+    return {
+        "f1": f1,
+        "mean_iou": float(np.mean(matched_iou)) if matched_iou else float("nan"),
+        "conf_diff": float(np.mean(conf_diff)) if conf_diff else float("nan"),
+    }
+
+
+def time_model(model, input_image, prompt, threshold, repeats, stats=None):
+    """Median ms of run_detector_on_tensor after a warm-up, and its boxes. stats gets the warm-up's."""
+    exemplars = torch.tensor([])
+    boxes = detector_logic.run_detector_on_tensor(model, input_image, exemplars, prompt, "cpu", threshold,
+                                                  stats=stats)  # warm-up
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        boxes = detector_logic.run_detector_on_tensor(model, input_image, exemplars, prompt, "cpu", threshold)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000, boxes
+
+
+def sweep(model, inputs, samples, variants, args, detail=None, detail_name=""):
+    """
+    Runs every (input, sample) under each (label, apply) variant; apply() configures the
+    model and the first variant is the reference. Prints mean latency, speedup, count, F1@0.5
+    and count drift against the reference, MAE/RMSE against annotated counts when every sample
+    has one, and detail(stats) per image (stats: that image's run_detector_on_tensor stats).
+    Returns {label: mean F1 against the reference}.
+    """
+    results = {}
+    for label, apply in variants:
+        apply()
+        rows = []
+        for input_image, (_, prompt, _) in zip(inputs, samples):
+            stats = {}
+            ms, boxes = time_model(model, input_image, prompt, args.threshold, args.repeats, stats=stats)
+            rows.append((ms, boxes, detail(stats) if detail else None))
+        results[label] = rows
+
+    has_gt = all(gt is not None for _, _, gt in samples)
+    print(f"{'':<12}{'ms':>9}{'speedup':>9}{'count':>8}{'F1@.5':>8}{'|dcount|':>10}"
+          + (f"{'MAE':>8}{'RMSE':>8}" if has_gt else "") + (f"  {detail_name} per image" if detail else ""))
+    reference = results[variants[0][0]]
+    ref_ms = np.mean([r[0] for r in reference])
+    ref_counts = np.array([len(r[1]) for r in reference])
+    f1_by_label = {}
+    for label, rows in results.items():
+        ms = np.mean([r[0] for r in rows])
+        counts = np.array([len(r[1]) for r in rows])
+        f1 = float(np.mean([compare(ref[1], r[1])["f1"] for ref, r in zip(reference, rows)]))
+        f1_by_label[label] = f1
+        line = (f"{label:<12}{ms:>9.0f}{ref_ms / ms:>8.2f}x{counts.mean():>8.1f}{f1:>8.3f}"
+                f"{np.abs(counts - ref_counts).mean():>10.1f}")
+        if has_gt:
+            errors = counts - np.array([gt for _, _, gt in samples])
+            line += f"{np.abs(errors).mean():>8.1f}{np.sqrt((errors ** 2).mean()):>8.1f}"
+        if detail:
+            shown = [str(r[2]) for r in rows[:12]]
+            line += "  " + ",".join(shown) + ("..." if len(rows) > 12 else "")
+        print(line)
+    print(f"\nF1@0.5 and |dcount| are against '{variants[0][0]}'"
+          + (", MAE/RMSE against the annotated counts" if has_gt else ""))
+    return f1_by_label
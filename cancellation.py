@@ -0,0 +1,78 @@
+import threading
+from contextlib import contextmanager
+
+import torch
+
+
+class OperationCancelled(Exception):
+    """Raised at a cancellation point once the owning request or job gave up on the work."""
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation flag. Wraps a threading.Event so a job's own cancel event can be
+    shared instead of copied; nothing is interrupted, the work stops at its next check().
+    """
+
+    def __init__(self, event: threading.Event = None):
+        self._event = event or threading.Event()
+        self.reason = "cancelled"
+
+    def cancel(self, reason: str = "cancelled"):
+        self.reason = reason
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise OperationCancelled(self.reason)
+
+
+# Token of the inference running on this thread; model hooks and tile loops look it up here so
+# the token does not have to be threaded through every call signature
+_local = threading.local()
+
+
+@contextmanager
+def active(token: CancellationToken = None):
+    previous = getattr(_local, "token", None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def current() -> CancellationToken:
+    return getattr(_local, "token", None)
+
+
+def check_current():
+    token = getattr(_local, "token", None)
+    if token is not None:
+        token.check()
+
+
+def _stage_pre_hook(module, args):
+    # Not traced into torch.compile graphs: a compiled forward is checked before and after instead
+    if torch.compiler.is_compiling():
+        return
+    check_current()
+
+
+def install_stage_checks(modules):
+    """
+    Adds a cancellation point in front of each module's forward (a pre-hook, so the model code
+    is untouched). Modules shared between layers are hooked once.
+    """
+    seen = set()
+    for module in modules:
+        if module is None or id(module) in seen or getattr(module, "_cancellation_hooked", False):
+            continue
+        seen.add(id(module))
+        module.register_forward_pre_hook(_stage_pre_hook)
+        module._cancellation_hooked = True
+    return len(seen)
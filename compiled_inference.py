@@ -0,0 +1,221 @@
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from groundingdino.util.misc import NestedTensor, inverse_sigmoid
+from models.GroundingDINO.bertwarper import generate_masks_with_special_tokens_and_transfer_map
+
+# Token lengths captions are padded to (then capped at the model's max_text_len). Padding tokens
+# are masked out of BERT, the fusion layers and the logits, so they do not change the result
+TEXT_BUCKETS = (16, 32, 64, 128, 256)
+# Swin patch size x largest downsampling, bucket sides are multiples of it
+SHAPE_STRIDE = 32
+
+
+def _round_up(value, multiple=SHAPE_STRIDE):
+    return -(-int(value) // multiple) * multiple
+
+
+def shape_buckets(size: int = 800, max_size: int = 1333):
+    """
+    Padded (h, w) input shapes for a FusedPreprocessor(size, max_size): square, 4:3 and the
+    longest allowed side, landscape and portrait. Every resized image fits in one of them.
+    """
+    short = _round_up(size)
+    buckets = set()
+    for long in (short, _round_up(size * 4 / 3), _round_up(max_size)):
+        buckets.add((short, long))
+        buckets.add((long, short))
+    return sorted(buckets, key=lambda hw: (hw[0] * hw[1], hw))
+
+
+def text_bucket(num_tokens: int, max_text_len: int = 256):
+    """Padded caption length. Longer captions are cut to max_text_len after the masks, like the eager path."""
+    if num_tokens >= max_text_len:
+        return num_tokens
+    return next((b for b in TEXT_BUCKETS if num_tokens <= b <= max_text_len), max_text_len)
+
+
+def tokenize(tokenizer, special_tokens, max_text_len: int, caption: str, device="cpu"):
+    """
+    Host-side half of the text path (tokenizer + sub-sentence masks), padded to a text bucket.
+    Returns (input_ids, attention_mask, token_type_ids, position_ids, text_self_attention_masks).
+    """
+    num_tokens = len(tokenizer(caption)["input_ids"])
+    length = text_bucket(num_tokens, max_text_len)
+    tokenized = tokenizer([caption], padding="max_length", max_length=length, return_tensors="pt")
+    text_self_attention_masks, position_ids, _ = generate_masks_with_special_tokens_and_transfer_map(
+        tokenized, special_tokens, tokenizer
+    )
+    n = max_text_len
+    return (
+        tokenized["input_ids"][:, :n].to(device),
+        tokenized["attention_mask"][:, :n].to(device),
+        tokenized["token_type_ids"][:, :n].to(device),
+        position_ids[:, :n].to(device),
+        text_self_attention_masks[:, :n, :n].to(device),
+    )
+
+
+def pad_to_bucket(image: torch.Tensor, bucket):
+    """(3, h, w) image -> zero-padded (1, 3, H, W) batch and its padding mask (True = padding)."""
+    h, w = image.shape[-2:]
+    images = F.pad(image, (0, bucket[1] - w, 0, bucket[0] - h)).unsqueeze(0)
+    image_mask = torch.ones((1,) + tuple(bucket), dtype=torch.bool, device=image.device)
+    image_mask[:, :h, :w] = False
+    return images, image_mask
+
+
+class CountGDTextEncoder(nn.Module):
+    """BERT + feat_map: tokenized caption -> encoded_text (1, tokens, d_model). Cacheable per caption."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids, position_ids, text_self_attention_masks):
+        m = self.model
+        if m.sub_sentence_present:
+            bert_output = m.bert(input_ids=input_ids, attention_mask=text_self_attention_masks,
+                                 token_type_ids=token_type_ids, position_ids=position_ids)
+        else:
+            bert_output = m.bert(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
+        return m.feat_map(bert_output["last_hidden_state"])
+
+
+class CountGDDetector(nn.Module):
+    """
+    Image half of the text-prompt forward: backbone, encoder/decoder and the last-layer heads,
+    from an already encoded caption. No NestedTensor lists, no exemplar branch and no training
+    outputs, so tracing sees one graph per input shape.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images, image_mask, encoded_text, text_token_mask, position_ids, text_self_attention_masks):
+        m = self.model
+        text_dict = {
+            "encoded_text": encoded_text,
+            "text_token_mask": text_token_mask,
+            "position_ids": position_ids,
+            "text_self_attention_masks": text_self_attention_masks,
+        }
+
+        samples = NestedTensor(images, image_mask)
+        features, poss = m.backbone(samples)
+        srcs = []
+        masks = []
+        for l, feat in enumerate(features):
+            src, mask = feat.decompose()
+            srcs.append(m.input_proj[l](src))
+            masks.append(mask)
+        for l in range(len(srcs), m.num_feature_levels):
+            src = m.input_proj[l](features[-1].tensors if l == len(features) else srcs[-1])
+            mask = F.interpolate(image_mask[None].float(), size=src.shape[-2:]).to(torch.bool)[0]
+            poss.append(m.backbone[1](NestedTensor(src, mask)).to(src.dtype))
+            srcs.append(src)
+            masks.append(mask)
+
+        hs, reference, _, _, _, _ = m.transformer(srcs, masks, None, poss, None, None, text_dict)
+        # Last decoder layer only, that is all inference reads
+        pred_boxes = (m.bbox_embed[-1](hs[-1]) + inverse_sigmoid(reference[-2])).sigmoid()
+        pred_logits = m.class_embed[-1](hs[-1], text_dict)
+        return pred_logits, pred_boxes
+
+
+class CountGDInference(nn.Module):
+    """
+    Text-prompt CountGD forward with tensors in and tensors out (text encoder + detector), so
+    torch.compile sees a single graph per input shape. Shares the weights of the wrapped model.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.text_encoder = CountGDTextEncoder(model)
+        self.detector = CountGDDetector(model)
+
+    def forward(self, images, image_mask, input_ids, attention_mask, token_type_ids, position_ids,
+                text_self_attention_masks):
+        encoded_text = self.text_encoder(input_ids, attention_mask, token_type_ids, position_ids,
+                                         text_self_attention_masks)
+        return self.detector(images, image_mask, encoded_text, attention_mask.bool(), position_ids,
+                             text_self_attention_masks)
+
+
+class CompiledCountGD:
+    """
+    torch.compile'd CountGDInference with static shapes. Images are zero-padded (and masked)
+    into the smallest shape bucket of `sizes`, captions into a text bucket, so the number of
+    compiled graphs is bounded by buckets x text buckets x query budgets instead of growing with
+    every aspect ratio. The first call per key pays the compile; compile_times records it.
+    """
+
+    def __init__(self, model, sizes=((800, 1333),), backend: str = "inductor", mode: str = None):
+        self.model = model
+        self.module = CountGDInference(model).eval()
+        self.buckets = sorted({b for size, max_size in sizes for b in shape_buckets(size, max_size)},
+                              key=lambda hw: (hw[0] * hw[1], hw))
+        # One graph per bucket/text length/query budget, well past dynamo's default recompile limit
+        limit = 2 * len(self.buckets) * len(TEXT_BUCKETS) * 4
+        for name in ("recompile_limit", "cache_size_limit"):
+            if hasattr(torch._dynamo.config, name):
+                setattr(torch._dynamo.config, name, max(getattr(torch._dynamo.config, name), limit))
+        self.compiled = torch.compile(self.module, dynamic=False, backend=backend, mode=mode)
+        self.compile_times = {}
+        self.failed = None
+        self._text_cache = {}
+
+    def bucket_for(self, h: int, w: int):
+        for bh, bw in self.buckets:
+            if h <= bh and w <= bw:
+                return bh, bw
+        return None
+
+    def text_inputs(self, caption: str, device):
+        key = (caption, str(device))
+        if key not in self._text_cache:
+            if len(self._text_cache) >= 64:
+                self._text_cache.clear()
+            model = self.model
+            self._text_cache[key] = tokenize(model.tokenizer, model.specical_tokens, model.max_text_len,
+                                             caption, device)
+        return self._text_cache[key]
+
+    def __call__(self, image: torch.Tensor, caption: str):
+        """
+        image: (3, h, w) preprocessed tensor. Returns (pred_logits, pred_boxes) for a batch of one,
+        boxes normalized to the unpadded image, or None when the image fits no bucket (or
+        compilation failed once), in which case the caller runs the eager model.
+        """
+        bucket = self.bucket_for(*image.shape[-2:])
+        if bucket is None or self.failed is not None:
+            return None
+        images, image_mask = pad_to_bucket(image, bucket)
+        text = self.text_inputs(caption, image.device)
+
+        key = (bucket, text[0].shape[1], self.model.transformer.query_budget)
+        start = time.perf_counter()
+        try:
+            outputs = self.compiled(images, image_mask, *text)
+        except Exception as e:
+            # Unsupported op/backend on this install: stay on the eager model from now on
+            print(f"Warning: Compiled CountGD failed ({e}). Falling back to eager inference.")
+            self.failed = str(e)
+            return None
+        if key not in self.compile_times:
+            self.compile_times[key] = time.perf_counter() - start
+            print(f"Compiled CountGD for input {bucket[0]}x{bucket[1]}, {key[1]} tokens "
+                  f"in {self.compile_times[key]:.1f}s")
+        return outputs
+
+    def stats(self):
+        return {
+            "buckets": [f"{h}x{w}" for h, w in self.buckets],
+            "compiled": len(self.compile_times),
+            "compile_s": round(sum(self.compile_times.values()), 1),
+            "failed": self.failed,
+        }
@@ -3,30 +3,72 @@ from PIL import Image
 import numpy as np
 import random
 from types import SimpleNamespace
+from contextlib import contextmanager, nullcontext
 
 # All original imports
 from util.slconfig import SLConfig
-import datasets_inference.transforms as T
 from models.registry import MODULE_BUILD_FUNCS
+import preprocess
+import cancellation
+import quantization
+import compiled_inference
+import inference_fusion
+
+# fp32: reference. int8: dynamic int8 Linear layers (CPU only, see quantization.py).
+# bf16: fp32 weights, matmuls/convs under bfloat16 autocast; box refinement and softmax stay fp32
+PRECISIONS = ("fp32", "int8", "bf16")
 
 # This function is a modified version of your script's build_model_and_transforms
-def load_detector_model(config_path, model_path, device_str="cuda"):
+def load_detector_model(config_path, model_path, device_str="cuda", precision="fp32", cache_dir=None,
+                        quantize_backbone=False, text_encoder_type="bert-base-uncased", compile_sizes=None,
+                        fuse=True, fusion_memory_mb=None, encoder_keep_ratio=None, decoder_exit_tol=None,
+                        query_buckets=None):
     """
     Loads the detection model and transforms once.
+
+    precision="int8" gives the dynamic int8 variant (CPU only), cached in cache_dir after the
+    first conversion; quantize_backbone also converts the Swin blocks. precision="bf16" runs
+    every forward under bfloat16 autocast (CPU or CUDA). compile_sizes, a list of
+    (size, max_size) preprocessor settings, attaches a torch.compile'd text-prompt forward with
+    shape buckets for those inputs (see compiled_inference.py). fuse runs the load-time
+    freeze-for-inference pass (inference_fusion.py); the model is not trainable afterwards.
+    fusion_memory_mb caps the working memory of each vision-language fusion layer, which then
+    streams image tokens in blocks (same result, lower peak memory on large inputs).
+    encoder_keep_ratio (0-1] runs the encoder layers after the first on only that share of
+    image tokens, the ones the proposal head scores highest for the prompt.
+    decoder_exit_tol stops the decoder once its top queries' boxes and scores move by at most
+    that much between layers (run_detector_on_tensor reports the layers each image needed).
+    query_buckets, e.g. (100, 300, 900), sizes the decoder per image: the smallest bucket that
+    fits the object count estimated from the encoder proposals above the detection threshold
+    of the call (query_budget still caps it).
     """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown CountGD precision: {precision}")
+    if encoder_keep_ratio is not None and not 0 < encoder_keep_ratio <= 1:
+        raise ValueError(f"encoder_keep_ratio must be in (0, 1], got {encoder_keep_ratio}")
+    if query_buckets is not None and not all(int(n) == n and n > 0 for n in query_buckets):
+        raise ValueError(f"query_buckets must be positive integers, got {query_buckets}")
+    if precision == "int8" and device_str != "cpu":
+        print(f"Warning: int8 CountGD runs on CPU only, using fp32 on {device_str}.")
+        precision = "fp32"
+    if precision == "bf16" and device_str not in ("cpu", "cuda"):
+        print(f"Warning: bf16 CountGD needs CPU or CUDA autocast, using fp32 on {device_str}.")
+        precision = "fp32"
     # We create a 'fake' args object to pass to the model builder
     args = SimpleNamespace()
     args.config = config_path
     args.pretrain_model_path = model_path
     args.device = device_str
     
+    # Same output as Compose([RandomResize([800], max_size=1333), ToTensor(), Normalize(...)]),
+    # but resizes uint8 data and normalizes in one step into a reused buffer
+    data_transform = preprocess.FusedPreprocessor(size=800, max_size=1333)
+    
     # --- This block is from your original script ---
-    normalize = T.Compose([T.ToTensor(), T.Normalize([0.485,0.456,0.406],[0.229,0.224,0.225])])
-    data_transform = T.Compose([T.RandomResize([800], max_size=1333), normalize])
     cfg = SLConfig.fromfile(args.config)
     # Use standard HF model ID instead of local path if possible, or make it configurable
     # If the user has it locally, we could check, but 'bert-base-uncased' is safer for general use
-    cfg.merge_from_dict({"text_encoder_type": "bert-base-uncased"})
+    cfg.merge_from_dict({"text_encoder_type": text_encoder_type})
     cfg_dict = cfg._cfg_dict.to_dict()
     args_vars = vars(args)
     for k, v in cfg_dict.items():
@@ -41,20 +83,118 @@ def load_detector_model(config_path, model_path, device_str="cuda"):
 
     assert args.modelname in MODULE_BUILD_FUNCS._module_dict
     build_func = MODULE_BUILD_FUNCS.get(args.modelname)
-    model, _, _ = build_func(args)
-    model.to(device)
 
-    checkpoint = torch.load(args.pretrain_model_path, map_location="cpu", weights_only=False)["model"]
-    model.load_state_dict(checkpoint, strict=False)
+    def build_model():
+        model, _, _ = build_func(args)
+        return model
+
+    def load_weights(model):
+        checkpoint = torch.load(args.pretrain_model_path, map_location="cpu", weights_only=False)["model"]
+        model.load_state_dict(checkpoint, strict=False)
+
+    if precision == "int8":
+        model = quantization.load_int8(build_model, args.pretrain_model_path, load_weights,
+                                       cache_dir=cache_dir, quantize_backbone=quantize_backbone)
+    else:
+        model = build_model()
+        model.to(device)
+        load_weights(model)
     model.eval()
+    if fuse:
+        fused = inference_fusion.freeze_for_inference(model)
+        print(f"Fused for inference: {', '.join(f'{n} {name}' for name, n in sorted(fused.items()))}.")
+    set_fusion_memory(model, fusion_memory_mb)
+    model.transformer.encoder.keep_ratio = encoder_keep_ratio
+    model.transformer.decoder.exit_tol = decoder_exit_tol
+    model.transformer.query_buckets = tuple(sorted(int(n) for n in query_buckets)) if query_buckets else None
+    # Read by run_detector_on_tensor
+    model.autocast_dtype = torch.bfloat16 if precision == "bf16" else None
     # --- End of original block ---
+
+    # Abandoned requests stop between stages instead of finishing the whole forward
+    hooked = cancellation.install_stage_checks(cancellation_stages(model))
+    print(f"Cancellation checks installed on {hooked} model stages.")
+
+    # Read by run_detector_on_tensor; graphs are compiled lazily, on the first image per bucket
+    model.compiled_inference = None
+    if compile_sizes:
+        model.compiled_inference = compiled_inference.CompiledCountGD(model, sizes=compile_sizes)
     
-    print(f"Detector model '{args.modelname}' loaded to {device}.")
+    print(f"Detector model '{args.modelname}' ({precision}) loaded to {device}.")
     return model, data_transform, device
 
 
+def set_fusion_memory(model, max_memory_mb=None):
+    """Working-memory budget (MB) of every BiMultiHeadAttention fusion layer; None = unchunked."""
+    for module in model.modules():
+        if hasattr(module, "max_memory_mb"):
+            module.max_memory_mb = max_memory_mb
+
+
+@contextmanager
+def query_budget(model, num_queries=None):
+    """
+    Runs the decoder on only the top num_queries encoder proposals (None = config default).
+    Sets a model attribute, so callers must hold the model (the inference gate) around it.
+    """
+    transformer = model.transformer
+    previous = transformer.query_budget
+    transformer.query_budget = num_queries
+    try:
+        yield
+    finally:
+        transformer.query_budget = previous
+
+
+@contextmanager
+def bucket_threshold(model, confidence_thresh):
+    """
+    Counts the encoder proposals above confidence_thresh when picking a query bucket, so the
+    decoder is sized for the detections the caller keeps. Same locking caveat as query_budget.
+    """
+    transformer = model.transformer
+    previous = transformer.bucket_threshold
+    transformer.bucket_threshold = confidence_thresh
+    try:
+        yield
+    finally:
+        transformer.bucket_threshold = previous
+
+
+def autocast(model, device):
+    """Autocast context for models loaded with precision="bf16", a no-op otherwise."""
+    dtype = getattr(model, "autocast_dtype", None)
+    if dtype is None:
+        return nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=dtype)
+
+
+def cancellation_stages(model):
+    """Stage modules of the detector: text encoder, backbone (+ Swin stages), encoder and decoder layers."""
+    stages = [getattr(model, "bert", None), model.backbone]
+    for module in model.backbone.modules():
+        layers = getattr(module, "layers", None)
+        if isinstance(layers, torch.nn.ModuleList):
+            stages.extend(layers)
+    encoder = model.transformer.encoder
+    for layers in (encoder.layers, encoder.fusion_layers, encoder.text_layers, model.transformer.decoder.layers):
+        stages.extend(layers)
+    return stages
+
+
+def prepare_detector_input(transform, image_path):
+    """
+    Decode + preprocess half of run_detector_inference, safe to run in a prefetch worker.
+    Returns (input_image, exemplars, (orig_w, orig_h)); the tensor is not a shared buffer.
+    """
+    image_pil, orig_size = preprocess.decode_for_inference(image_path, transform.size, transform.max_size)
+    input_image, target = transform(image_pil, {"exemplars": torch.tensor([])}, reuse_buffer=False)
+    return input_image, target["exemplars"], orig_size
+
+
 # This function is a modified version of your script's run_inference_single_image
-def run_detector_inference(model, transform, image_pil, text_prompt, device, confidence_thresh=0.23):
+def run_detector_inference(model, transform, image_pil, text_prompt, device, confidence_thresh=0.23,
+                           num_queries=None, stats=None):
     """
     Runs inference on a single PIL image using the already-loaded model.
     Returns a list of YOLO-formatted boxes: [[0, xc, yc, w, h, conf], ...]
@@ -62,21 +202,67 @@ def run_detector_inference(model, transform, image_pil, text_prompt, device, con
     
     # 1. Transform the image
     input_image, target = transform(image_pil, {"exemplars": torch.tensor([])})
+    return run_detector_on_tensor(model, input_image, target["exemplars"], text_prompt, device, confidence_thresh,
+                                  num_queries=num_queries, stats=stats)
+
+
+def run_detector_on_tensor(model, input_image, exemplars, text_prompt, device, confidence_thresh=0.23,
+                           num_queries=None, stats=None):
+    """
+    Model + postprocess half of run_detector_inference for an already preprocessed image.
+    Returns a list of YOLO-formatted boxes: [[0, xc, yc, w, h, conf], ...]
+
+    stats, a dict, collects what the forward adapted to the image, one list entry per call
+    (so tiles accumulate): "num_queries" (query budget/buckets) and "decoder_layers" (early
+    exit, eager PyTorch forwards only).
+    """
     input_image = input_image.to(device)
-    input_exemplar = target["exemplars"].to(device)
+    input_exemplar = exemplars.to(device)
     
-    # 2. Run the model
-    with torch.no_grad():
-        output = model(
-            input_image.unsqueeze(0),
-            [input_exemplar],
-            [torch.tensor([0]).to(device)],
-            captions=[text_prompt + " ."],
-        )
+    # 2. Run the model (the compiled graph covers text prompts only, exemplars run eager)
+    if not isinstance(model, torch.nn.Module):
+        # Exported runtimes (onnx_inference.OnnxCountGD) take the image and caption directly
+        if input_exemplar.numel() > 0:
+            raise ValueError("Exemplar prompts need the PyTorch CountGD model")
+        cancellation.check_current()
+        outputs = model(input_image, text_prompt + " .")
+        if stats is not None:
+            stats.setdefault("num_queries", []).append(outputs[0].shape[1])
+        return detections_to_yolo(outputs[0][0], outputs[1][0], input_image.shape[-2:], confidence_thresh)
+
+    compiled = getattr(model, "compiled_inference", None)
+    outputs = None
+    with torch.no_grad(), query_budget(model, num_queries), bucket_threshold(model, confidence_thresh), \
+            autocast(model, device):
+        if compiled is not None and input_exemplar.numel() == 0:
+            # Stage hooks do not fire inside the compiled graph, check around it instead
+            cancellation.check_current()
+            outputs = compiled(input_image, text_prompt + " .")
+            cancellation.check_current()
+        if outputs is None:
+            output = model(
+                input_image.unsqueeze(0),
+                [input_exemplar],
+                [torch.tensor([0]).to(device)],
+                captions=[text_prompt + " ."],
+            )
+            outputs = output["pred_logits"], output["pred_boxes"]
+            if stats is not None:
+                stats.setdefault("decoder_layers", []).append(int(output["exit_layers"][0]))
+    if stats is not None:
+        stats.setdefault("num_queries", []).append(outputs[0].shape[1])
     
-    # 3. Process outputs
-    logits = output["pred_logits"][0].sigmoid()
-    boxes = output["pred_boxes"][0]
+    return detections_to_yolo(outputs[0][0], outputs[1][0], input_image.shape[-2:], confidence_thresh)
+
+
+def detections_to_yolo(pred_logits, pred_boxes, input_hw, confidence_thresh=0.23):
+    """
+    Postprocess of one image: (queries, tokens) logits and (queries, 4) normalized cxcywh boxes
+    -> YOLO-formatted boxes [[0, xc, yc, w, h, conf], ...] above the threshold.
+    """
+    # 3. Process outputs (fp32 even after a bf16 forward, the threshold sits on the sigmoid)
+    logits = pred_logits.float().sigmoid()
+    boxes = pred_boxes.float()
     
     mask = logits.max(dim=-1).values > confidence_thresh
     logits = logits[mask, :]
@@ -87,8 +273,8 @@ def run_detector_inference(model, transform, image_pil, text_prompt, device, con
     if pred_count == 0:
         return []  # Return empty list if no detections
 
-    # 4. Convert boxes to pixel coordinates
-    w, h = image_pil.size
+    # 4. Convert boxes to pixel coordinates (of the model input, boxes are returned normalized)
+    h, w = input_hw
     boxes_px = boxes.clone()
     boxes_px[:, 0] *= w
     boxes_px[:, 1] *= h
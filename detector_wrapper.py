@@ -5,6 +5,15 @@ from PIL import Image
 import uuid
 import cv2
 import numpy as np
+import region_reader
+import preprocess
+import prefetch
+import threading
+import inference_scheduler
+import cancellation
+import speculative
+import onnx_inference
+from inference_scheduler import LANE_INTERACTIVE, LANE_BATCH, LANE_BACKGROUND
 
 # Try imports
 try:
@@ -33,6 +42,33 @@ except ImportError:
 
 from functools import partial
 
+# Tiled inference geometry (shared by CountGD and RF-DETR)
+TILE_SIZE = 640
+TILE_OVERLAP = 0.2
+TILE_NMS_IOU = 0.5
+
+# CountGD numeric mode (detector_logic.PRECISIONS); "int8" trades a little accuracy for CPU speed
+COUNTGD_PRECISION = os.environ.get("COUNTGD_PRECISION", "fp32")
+COUNTGD_QUANTIZE_BACKBONE = os.environ.get("COUNTGD_QUANTIZE_BACKBONE", "0") == "1"
+# Load-time freeze-for-inference pass (precomputed biases, merged projections), on by default
+COUNTGD_FUSE = os.environ.get("COUNTGD_FUSE", "1") == "1"
+# Working memory (MB) per vision-language fusion layer; large inputs are streamed in blocks
+# (e.g. 512 on 16 GB machines; unset = whole image at once)
+COUNTGD_FUSION_MEMORY_MB = float(os.environ.get("COUNTGD_FUSION_MEMORY_MB", 0)) or None
+# Share of image tokens the encoder layers after the first update (e.g. 0.3; unset = all)
+COUNTGD_ENCODER_KEEP_RATIO = float(os.environ.get("COUNTGD_ENCODER_KEEP_RATIO", 0)) or None
+# Decoder early exit: stop when the top boxes/scores move less than this between layers (e.g. 0.01; unset = all layers)
+COUNTGD_DECODER_EXIT_TOL = float(os.environ.get("COUNTGD_DECODER_EXIT_TOL", 0)) or None
+# Adaptive decoder width: query buckets chosen per image from the encoder's count estimate (e.g. "100,300,900"),
+# counting proposals above the request's confidence threshold
+COUNTGD_QUERY_BUCKETS = tuple(int(n) for n in os.environ.get("COUNTGD_QUERY_BUCKETS", "").split(",") if n.strip()) or None
+# torch.compile the text-prompt forward (one graph per input shape bucket, compiled on first use)
+COUNTGD_COMPILE = os.environ.get("COUNTGD_COMPILE", "0") == "1"
+# export_onnx.py output for model_type="countgd_onnx" (default: data/model_cache/countgd_onnx)
+COUNTGD_ONNX_DIR = os.environ.get("COUNTGD_ONNX_DIR")
+# CountGD backends: PyTorch, and the exported graphs on ONNX Runtime (CPU, text prompts only)
+COUNTGD_TYPES = ("countgd", "countgd_onnx")
+
 class DetectorWrapper:
     _instance = None
     
@@ -41,9 +77,23 @@ class DetectorWrapper:
         self.countgd_model = None
         self.countgd_transform = None
         self.countgd_device = None
+        # ONNX Runtime CountGD and its preprocessor (export size)
+        self.countgd_onnx = None
+        self.countgd_onnx_transform = None
         
         # Cache for other models: path -> model_instance
         self.model_cache = {}
+        # Interactive requests and batch jobs now run concurrently, load each model once
+        self.load_lock = threading.RLock()
+        
+        # One forward pass at a time, interactive requests first (see inference_scheduler)
+        self.gate = inference_scheduler.ModelGate()
+        # Lowers resolution/tiles/queries of interactive requests when the queue backs up
+        self.admission = inference_scheduler.AdmissionController(self.gate)
+        # CountGD preprocessors per (size, max_size) for reduced quality levels
+        self.countgd_transforms = {}
+        # Upcoming images annotated ahead of time on idle model capacity
+        self.speculative = speculative.SpeculativeAnnotator(self.run_speculative)
         
         # Robust path finding for PyInstaller
         import sys
@@ -57,6 +107,11 @@ class DetectorWrapper:
         self.config_path = os.path.join(base_path, "config", "cfg_fsc147_vit_b.py")
         self.checkpoint_path = os.path.join(base_path, "checkpoint_fsc147_best.pth")
         
+        # Raw decode cache for windowed reads of huge non-TIFF images
+        self.region_cache_dir = os.path.join(os.getcwd(), "data", "region_cache")
+        # Converted (e.g. int8) model weights, so conversion only happens once per checkpoint
+        self.model_cache_dir = os.path.join(os.getcwd(), "data", "model_cache")
+        
         # Determine optimal device
         if torch.backends.mps.is_available():
             self.device_str = "mps"
@@ -74,6 +129,10 @@ class DetectorWrapper:
         return cls._instance
         
     def load_countgd(self):
+        with self.load_lock:
+            self._load_countgd()
+
+    def _load_countgd(self):
         if self.countgd_model is None:
             if not os.path.exists(self.config_path) or not os.path.exists(self.checkpoint_path):
                 raise FileNotFoundError("CountGD config or checkpoint not found.")
@@ -82,11 +141,57 @@ class DetectorWrapper:
             self.countgd_model, self.countgd_transform, self.countgd_device = detector_logic.load_detector_model(
                 self.config_path, 
                 self.checkpoint_path, 
-                device_str=self.device_str
+                device_str=self.device_str,
+                precision=COUNTGD_PRECISION,
+                cache_dir=self.model_cache_dir,
+                quantize_backbone=COUNTGD_QUANTIZE_BACKBONE,
+                fuse=COUNTGD_FUSE,
+                fusion_memory_mb=COUNTGD_FUSION_MEMORY_MB,
+                encoder_keep_ratio=COUNTGD_ENCODER_KEEP_RATIO,
+                decoder_exit_tol=COUNTGD_DECODER_EXIT_TOL,
+                query_buckets=COUNTGD_QUERY_BUCKETS,
+                # Buckets for every adaptive quality level, so degrading does not fall back to eager
+                compile_sizes=sorted({(q["size"], q["max_size"]) for q in inference_scheduler.QUALITY_LEVELS})
+                if COUNTGD_COMPILE else None
             )
             print(f"CountGD Loaded on {self.countgd_device}")
 
+    def load_countgd_onnx(self):
+        with self.load_lock:
+            if self.countgd_onnx is None:
+                export_dir = COUNTGD_ONNX_DIR or os.path.join(self.model_cache_dir, "countgd_onnx")
+                if not os.path.exists(os.path.join(export_dir, onnx_inference.MANIFEST_NAME)):
+                    raise FileNotFoundError(f"No CountGD ONNX export in {export_dir}, run export_onnx.py first.")
+                print("Loading CountGD ONNX model...")
+                self.countgd_onnx = onnx_inference.OnnxCountGD(export_dir)
+                self.countgd_onnx_transform = preprocess.FusedPreprocessor(
+                    size=self.countgd_onnx.size, max_size=self.countgd_onnx.max_size)
+                print(f"CountGD ONNX loaded ({len(self.countgd_onnx.buckets)} shape buckets, CPU)")
+
+    def countgd_backend(self, model_type: str, quality: dict = None):
+        """(model, transform, device) for a CountGD model type; quality levels apply to PyTorch only."""
+        if model_type.lower() == "countgd_onnx":
+            self.load_countgd_onnx()
+            return self.countgd_onnx, self.countgd_onnx_transform, "cpu"
+        self.load_countgd()
+        return self.countgd_model, self.countgd_transform_for(quality), self.countgd_device
+
+    def countgd_transform_for(self, quality: dict = None):
+        """CountGD preprocessor for a quality level (None = the model's default 800/1333)."""
+        if quality is None:
+            return self.countgd_transform
+        key = (quality["size"], quality["max_size"])
+        if key == (self.countgd_transform.size, self.countgd_transform.max_size):
+            return self.countgd_transform
+        if key not in self.countgd_transforms:
+            self.countgd_transforms[key] = preprocess.FusedPreprocessor(size=key[0], max_size=key[1])
+        return self.countgd_transforms[key]
+
     def load_yolo(self, weights_path):
+        with self.load_lock:
+            return self._load_yolo(weights_path)
+
+    def _load_yolo(self, weights_path):
         if weights_path in self.model_cache:
             return self.model_cache[weights_path]
             
@@ -103,6 +208,10 @@ class DetectorWrapper:
             raise RuntimeError(f"Failed to load YOLO model. If this is a valid YOLO model, PyTorch may be failing to unpickle it (e.g. weights_only=True restriction or corrupted file). Details: {e}")
 
     def load_rfdetr(self, weights_path):
+        with self.load_lock:
+            return self._load_rfdetr(weights_path)
+
+    def _load_rfdetr(self, weights_path):
         if weights_path in self.model_cache:
             return self.model_cache[weights_path]
             
@@ -166,7 +275,7 @@ class DetectorWrapper:
         """Returns list of class names or IDs. 
            (Kept for info purposes, though UI selection is removed)
         """
-        if model_type.lower() == "countgd":
+        if model_type.lower() in COUNTGD_TYPES:
             return [] 
             
         if not model_path or not os.path.exists(model_path):
@@ -194,28 +303,209 @@ class DetectorWrapper:
         
         return []
 
+    def run_tiled(self, image_path: str, predict_tile, tile_size: int = TILE_SIZE) -> "sv.Detections":
+        """
+        Runs predict_tile(PIL tile) -> sv.Detections over overlapping windows and merges with NMS.
+
+        Windows are decoded one at a time through a region reader, so peak memory follows the tile
+        size instead of the image size (tiled TIFFs never get decoded as a whole).
+        """
+        detections = []
+        with region_reader.open_region_reader(image_path, self.region_cache_dir) as reader:
+            for x0, y0, x1, y1 in region_reader.tile_windows(reader.width, reader.height, tile_size, TILE_OVERLAP):
+                cancellation.check_current()
+                tile = Image.fromarray(reader.read_region(x0, y0, x1, y1))
+                tile_detections = predict_tile(tile)
+                if len(tile_detections) == 0:
+                    continue
+                tile_detections.xyxy = tile_detections.xyxy + np.array([x0, y0, x0, y0], dtype=tile_detections.xyxy.dtype)
+                detections.append(tile_detections)
+
+        if not detections:
+            return sv.Detections.empty()
+        return sv.Detections.merge(detections).with_nms(threshold=TILE_NMS_IOU)
+
+    @staticmethod
+    def countgd_boxes_to_results(boxes, w_img, h_img, label):
+        """Normalized [class, xc, yc, w, h, conf] boxes -> annotation dicts in pixels."""
+        results = []
+        for box in boxes:
+            # box = [class, xc, yc, w, h, conf]
+            xc, yc, w, h = box[1], box[2], box[3], box[4]
+            conf = box[5]
+            
+            # Convert normalized to pixels
+            width_px = w * w_img
+            height_px = h * h_img
+            x_px = (xc * w_img) - (width_px / 2)
+            y_px = (yc * h_img) - (height_px / 2)
+
+            results.append({
+                "id": str(uuid.uuid4()),
+                "x": float(x_px),
+                "y": float(y_px),
+                "width": float(width_px),
+                "height": float(height_px),
+                "label": label,
+                "confidence": float(conf)
+            })
+        return results
+
+    def run_inference_batch(self, image_paths, model_type: str = "countgd", model_path: str = None,
+                            text_prompt: str = None, confidence: float = 0.25, selected_classes: list = None,
+                            tiled: bool = False, prefetch_depth: int = 4, lane: str = LANE_BATCH,
+                            cancel_token: cancellation.CancellationToken = None):
+        """
+        Generator over (image_path, boxes, error) for a list of images.
+
+        For plain CountGD the decode + preprocess of the next images runs in a bounded prefetch
+        pool while the model works on the current one; other model types and tiled mode fall
+        back to run_inference per image. The model is taken per image (per tile when tiled) in
+        the given lane, so interactive requests get in between.
+
+        cancel_token stops the batch at the next stage/tile/image boundary by raising
+        cancellation.OperationCancelled (it is not reported as a per-image error).
+        """
+        if model_type.lower() in COUNTGD_TYPES and not tiled:
+            model, transform, device = self.countgd_backend(model_type)
+            load_fn = partial(detector_logic.prepare_detector_input, transform)
+            prefetcher = prefetch.Prefetcher(load_fn, image_paths, depth=prefetch_depth)
+            for image_path, prepared, error in prefetcher:
+                if error is not None:
+                    yield image_path, None, error
+                    continue
+                try:
+                    input_image, exemplars, (w_img, h_img) = prepared
+                    with cancellation.active(cancel_token), self.gate.slot(lane):
+                        boxes = detector_logic.run_detector_on_tensor(
+                            model, input_image, exemplars, text_prompt,
+                            device, confidence_thresh=confidence
+                        )
+                    yield image_path, self.countgd_boxes_to_results(boxes, w_img, h_img, text_prompt), None
+                except cancellation.OperationCancelled:
+                    raise
+                except Exception as e:
+                    yield image_path, None, e
+            print(f"Batch CountGD: {prefetcher.stats['items']} images, "
+                  f"{prefetcher.stats['wait_s']:.1f}s waiting on decode")
+            return
+
+        for image_path in image_paths:
+            try:
+                boxes = self.run_inference(
+                    image_path, model_type=model_type, model_path=model_path, text_prompt=text_prompt,
+                    confidence=confidence, selected_classes=selected_classes, tiled=tiled, lane=lane,
+                    cancel_token=cancel_token
+                )
+                yield image_path, boxes, None
+            except cancellation.OperationCancelled:
+                raise
+            except Exception as e:
+                yield image_path, None, e
+
     def run_inference(self, image_path: str, model_type: str = "countgd", model_path: str = None, 
                       text_prompt: str = None, confidence: float = 0.25, selected_classes: list = None,
-                      tiled: bool = False):
-        
-        img = Image.open(image_path).convert("RGB")
-        w_img, h_img = img.size
+                      tiled: bool = False, lane: str = LANE_INTERACTIVE,
+                      cancel_token: cancellation.CancellationToken = None, quality: dict = None,
+                      stats: dict = None):
+        """
+        quality is one of inference_scheduler.QUALITY_LEVELS (None = full quality). It sets the
+        CountGD input size and query budget, and the tile size; a level without tile_size runs
+        untiled even when tiled was requested. stats collects what CountGD adapted per
+        forward (see detector_logic.run_detector_on_tensor), one entry per tile when tiled.
+        """
+        if quality is not None:
+            tiled = tiled and quality["tile_size"] is not None
+        # Checked while queued for the model, between tiles and between model stages
+        with cancellation.active(cancel_token):
+            return self._run_inference(image_path, model_type, model_path, text_prompt, confidence,
+                                       selected_classes, tiled, lane, quality, stats)
+
+    def run_adaptive(self, image_path: str, model_type: str = "countgd", model_path: str = None,
+                     text_prompt: str = None, confidence: float = 0.25, selected_classes: list = None,
+                     tiled: bool = False, target_latency_s: float = None,
+                     cancel_token: cancellation.CancellationToken = None, min_level: int = 0):
+        """
+        Interactive run_inference at the quality level the admission controller picks for the
+        current load (at least min_level, e.g. PREVIEW_LEVEL). Returns (boxes, quality report);
+        the report's "adapted" holds the run_inference stats.
+        """
+        key = (model_type.lower(), bool(tiled))
+        if key[0] == "countgd":
+            # PyTorch CountGD honours every knob: input size, query budget and tile size
+            max_level = len(self.admission.levels) - 1
+        elif tiled:
+            # countgd_onnx runs at its exported size with a fixed query set and YOLO at its own
+            # resolution, so tiling is all a level changes for them: coarser tiles, then none
+            max_level = next(i for i, q in enumerate(self.admission.levels) if q["tile_size"] is None)
+        else:
+            max_level = 0
+        level, predicted, target = self.admission.choose(key, target_latency_s, max_level=max_level,
+                                                         min_level=min_level)
+        quality = self.admission.levels[level]
+
+        stats = {}
+        with self.gate.track() as usage:
+            results = self.run_inference(
+                image_path, model_type=model_type, model_path=model_path, text_prompt=text_prompt,
+                confidence=confidence, selected_classes=selected_classes, tiled=tiled,
+                lane=LANE_INTERACTIVE, cancel_token=cancel_token, quality=quality, stats=stats
+            )
+        self.admission.observe(key, level, usage["busy_s"])
+
+        report = {
+            "level": level,
+            "name": quality["name"],
+            "predicted_s": round(predicted, 3) if predicted is not None else None,
+            "target_s": round(target, 3) if target is not None else None,
+            "wait_s": round(usage["wait_s"], 3),
+            "busy_s": round(usage["busy_s"], 3),
+            "applied": self.applied_quality(model_type, quality, tiled),
+            "adapted": stats,
+        }
+        return results, report
+
+    def applied_quality(self, model_type: str, quality: dict, tiled: bool) -> dict:
+        """
+        Settings a backend actually ran a quality level with (None = the model's own): PyTorch
+        CountGD takes them all, the ONNX graphs keep their exported size and query set, YOLO its
+        own input size; a level without tile_size runs untiled.
+        """
+        backend = model_type.lower()
+        size = max_size = num_queries = None
+        if backend == "countgd":
+            size, max_size, num_queries = quality["size"], quality["max_size"], quality["num_queries"]
+        elif backend == "countgd_onnx" and self.countgd_onnx is not None:
+            size, max_size = self.countgd_onnx.size, self.countgd_onnx.max_size
+        tiled = tiled and quality["tile_size"] is not None
+        return {"size": size, "max_size": max_size, "num_queries": num_queries,
+                "tile_size": quality["tile_size"] if tiled else None}
+
+    def run_speculative(self, image_path: str, params: dict, cancel_token: cancellation.CancellationToken):
+        """Full-quality run for SpeculativeAnnotator; preemptible, so it only uses idle model time."""
+        return self.run_inference(image_path, lane=LANE_BACKGROUND, cancel_token=cancel_token, **params)
+
+    def _run_inference(self, image_path, model_type, model_path, text_prompt, confidence,
+                       selected_classes, tiled, lane, quality=None, stats=None):
         
         results = []
+        tile_size = quality["tile_size"] if quality is not None and quality["tile_size"] else TILE_SIZE
         
-        if model_type.lower() == "countgd":
-            self.load_countgd()
+        if model_type.lower() in COUNTGD_TYPES:
+            model, transform, device = self.countgd_backend(model_type, quality)
+            num_queries = quality["num_queries"] if quality is not None else None
             
             if tiled and sv is not None:
                 print(f"Running Tiled CountGD Inference on {image_path}...")
                 
-                def countgd_callback(image_slice: np.ndarray, model, transform, device, text_prompt, conf_thresh) -> sv.Detections:
-                    slice_pil = Image.fromarray(cv2.cvtColor(image_slice, cv2.COLOR_BGR2RGB))
+                def countgd_callback(slice_pil: Image.Image, model, transform, device, text_prompt, conf_thresh) -> sv.Detections:
                     w_slice, h_slice = slice_pil.size
                     
-                    boxes_norm = detector_logic.run_detector_inference(
-                        model, transform, slice_pil, text_prompt, device, confidence_thresh=conf_thresh
-                    )
+                    with self.gate.slot(lane):
+                        boxes_norm = detector_logic.run_detector_inference(
+                            model, transform, slice_pil, text_prompt, device, confidence_thresh=conf_thresh,
+                            num_queries=num_queries, stats=stats
+                        )
                     
                     if not boxes_norm:
                         return sv.Detections.empty()
@@ -250,21 +540,14 @@ class DetectorWrapper:
 
                 callback_bound = partial(
                     countgd_callback, 
-                    model=self.countgd_model, 
-                    transform=self.countgd_transform, 
-                    device=self.countgd_device, 
+                    model=model, 
+                    transform=transform, 
+                    device=device, 
                     text_prompt=text_prompt, 
                     conf_thresh=confidence
                 )
                 
-                countgd_slicer = sv.InferenceSlicer(
-                    callback=callback_bound,
-                    slice_wh=(640, 640),
-                    iou_threshold=0.5
-                )
-                
-                image_bgr = cv2.imread(image_path)
-                detections = countgd_slicer(image_bgr)
+                detections = self.run_tiled(image_path, callback_bound, tile_size=tile_size)
                 
                 if hasattr(detections, 'xyxy'):
                     xyxy = detections.xyxy
@@ -287,38 +570,28 @@ class DetectorWrapper:
                             "confidence": conf
                         })
             else:
-                # detector_logic returns: [class, xc, yc, w, h, conf] normalized
-                boxes = detector_logic.run_detector_inference(
-                    self.countgd_model, 
-                    self.countgd_transform, 
-                    img, 
-                    text_prompt, 
-                    self.countgd_device, 
-                    confidence_thresh=confidence
+                # Decoded once, directly at model input size (JPEG draft decode for large frames).
+                # Boxes come back normalized, so they are mapped onto the original size.
+                img, (w_img, h_img) = preprocess.decode_for_inference(
+                    image_path,
+                    size=transform.size,
+                    max_size=transform.max_size
                 )
                 
-                for box in boxes:
-                    # box = [class, xc, yc, w, h, conf]
-                    xc, yc, w, h = box[1], box[2], box[3], box[4]
-                    conf = box[5]
-                    
-                    # Convert normalized to pixels
-                    width_px = w * w_img
-                    height_px = h * h_img
-                    x_px = (xc * w_img) - (width_px / 2)
-                    y_px = (yc * h_img) - (height_px / 2)
-                    
-                    label_to_use = text_prompt
-
-                    results.append({
-                        "id": str(uuid.uuid4()),
-                        "x": float(x_px),
-                        "y": float(y_px),
-                        "width": float(width_px),
-                        "height": float(height_px),
-                        "label": label_to_use,
-                        "confidence": float(conf)
-                    })
+                # detector_logic returns: [class, xc, yc, w, h, conf] normalized
+                with self.gate.slot(lane):
+                    boxes = detector_logic.run_detector_inference(
+                        model, 
+                        transform, 
+                        img, 
+                        text_prompt, 
+                        device, 
+                        confidence_thresh=confidence,
+                        num_queries=num_queries,
+                        stats=stats
+                    )
+                
+                results.extend(self.countgd_boxes_to_results(boxes, w_img, h_img, text_prompt))
 
 
 
@@ -343,14 +616,16 @@ class DetectorWrapper:
                     device=device
                 )
 
-                result = get_sliced_prediction(
-                    image_path,
-                    detection_model,
-                    slice_height=640,
-                    slice_width=640,
-                    overlap_height_ratio=0.2,
-                    overlap_width_ratio=0.2
-                )
+                # SAHI slices internally, so the whole image is one unit of work here
+                with self.gate.slot(lane):
+                    result = get_sliced_prediction(
+                        image_path,
+                        detection_model,
+                        slice_height=tile_size,
+                        slice_width=tile_size,
+                        overlap_height_ratio=0.2,
+                        overlap_width_ratio=0.2
+                    )
 
                 # Convert SAHI results to our format
                 for prediction in result.object_prediction_list:
@@ -380,9 +655,11 @@ class DetectorWrapper:
                     })
             else:
                 # --- Standard YOLO ---
+                img = Image.open(image_path).convert("RGB")
                 model = self.load_yolo(model_path)
                 # YOLO inference
-                res = model(img, device=self.device_str if self.device_str != "mps" else "mps", verbose=False, conf=confidence)[0]
+                with self.gate.slot(lane):
+                    res = model(img, device=self.device_str if self.device_str != "mps" else "mps", verbose=False, conf=confidence)[0]
                 
                 # Parse results
                 names = model.names
@@ -418,22 +695,17 @@ class DetectorWrapper:
              detections = None
              if tiled and sv is not None:
                  print(f"Running Tiled RF-DETR Inference on {image_path}...")
-                 def rf_detr_callback(image_slice: np.ndarray, model) -> sv.Detections:
-                    slice_pil = Image.fromarray(cv2.cvtColor(image_slice, cv2.COLOR_BGR2RGB))
-                    return model.predict(slice_pil, threshold=confidence)
+                 def rf_detr_callback(slice_pil: Image.Image, model) -> sv.Detections:
+                    with self.gate.slot(lane):
+                        return model.predict(slice_pil, threshold=confidence)
 
                  callback_with_model = partial(rf_detr_callback, model=model)
-                 rf_slicer = sv.InferenceSlicer(
-                    callback=callback_with_model,
-                    slice_wh=(640, 640),
-                    iou_threshold=0.5
-                 )
-                 # Slicer expects numpy BGR
-                 image_bgr = cv2.imread(image_path)
-                 detections = rf_slicer(image_bgr)
+                 detections = self.run_tiled(image_path, callback_with_model, tile_size=tile_size)
              else:
+                 img = Image.open(image_path).convert("RGB")
                  # Use a generic threshold or the one provided. eval3.py used 0.01 for mAP, but 0.25 is better for users.
-                 detections = model.predict(img, threshold=confidence)
+                 with self.gate.slot(lane):
+                     detections = model.predict(img, threshold=confidence)
              
              # Map class IDs to names
              class_dict = {}
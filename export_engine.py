@@ -0,0 +1,628 @@
+import io
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import hashlib
+import queue
+import errno
+import shutil
+import datetime
+import posixpath
+import threading
+import zipfile
+
+import prefetch
+
+# Formats whose payload is already entropy coded; deflating them again only burns CPU
+PRECOMPRESSED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+PRECOMPRESSED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+DEFLATE_LEVEL = 6
+
+
+def pack_member(arcname, data, compress=True, mtime=None):
+    """
+    Builds a finished archive member (ZipInfo + raw payload) from uncompressed bytes.
+    CRC and deflate run here, i.e. in whichever worker thread calls it.
+    """
+    zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime(mtime or time.time())[:6])
+    zinfo.external_attr = 0o644 << 16
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data)
+
+    payload = data
+    zinfo.compress_type = zipfile.ZIP_STORED
+    if compress and data:
+        compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush()
+        if len(deflated) < len(data):
+            payload = deflated
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.compress_size = len(payload)
+    return zinfo, payload
+
+
+# ZipFile internals the raw write path uses, and the CPython versions it was checked against
+_RAW_WRITE_ATTRS = ("_lock", "_seekable", "start_dir", "_writecheck", "_didModify", "_writing")
+RAW_WRITE_PYTHON = ((3, 9), (3, 13))
+
+
+def raw_write_supported(zipf: zipfile.ZipFile) -> bool:
+    """Whether write_raw_member can append payloads verbatim to this archive."""
+    low, high = RAW_WRITE_PYTHON
+    return (low <= sys.version_info[:2] <= high and all(hasattr(zipf, name) for name in _RAW_WRITE_ATTRS)
+            and not zipf._writing)
+
+
+def write_raw_member(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, payload: bytes):
+    """
+    Appends a member whose payload is already compressed (or stored) with CRC and sizes set.
+
+    On the CPython versions in RAW_WRITE_PYTHON this mirrors what ZipFile.mkdir does for
+    directory entries, plus the payload, so compression can run in a thread pool and previous
+    archives can donate members verbatim. Works for seekable files and for unseekable streams
+    (sizes are known up front, so no data descriptor is needed). Anywhere else the member goes
+    through the public ZipFile.open(zinfo, "w"): stored payloads as they are, deflated ones
+    inflated and compressed again.
+    """
+    if not raw_write_supported(zipf):
+        if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+            payload = zlib.decompress(payload, -15)
+        elif zinfo.compress_type != zipfile.ZIP_STORED:
+            raise ValueError(f"Cannot rewrite {zinfo.filename}: unsupported compression {zinfo.compress_type}")
+        with zipf.open(zinfo, "w") as f:
+            f.write(payload)
+        return
+
+    with zipf._lock:
+        if zipf._seekable:
+            zipf.fp.seek(zipf.start_dir)
+        zinfo.header_offset = zipf.fp.tell()
+        zipf._writecheck(zinfo)
+        zipf._didModify = True
+
+        zipf.filelist.append(zinfo)
+        zipf.NameToInfo[zinfo.filename] = zinfo
+        zipf.fp.write(zinfo.FileHeader(None))
+        zipf.fp.write(payload)
+        zipf.start_dir = zipf.fp.tell()
+
+
+class ArchiveDonor:
+    """
+    A previous export archive whose members can be copied verbatim (still compressed) into a
+    new archive, as long as the manifest says their content has not changed since.
+    """
+
+    def __init__(self, path: str, digests: dict):
+        self.path = path
+        self.digests = digests
+        with zipfile.ZipFile(path) as zf:
+            self.infos = {info.filename: info for info in zf.infolist()}
+        self._local = threading.local()
+        self._handles = []
+        self._handles_lock = threading.Lock()
+        self.reused = 0
+
+    def _handle(self):
+        f = getattr(self._local, "f", None)
+        if f is None:
+            f = open(self.path, "rb")
+            self._local.f = f
+            with self._handles_lock:
+                self._handles.append(f)
+        return f
+
+    def take(self, arcname: str, digest: str):
+        """(ZipInfo, raw payload) for an unchanged member, or None if it has to be rebuilt."""
+        src = self.infos.get(arcname)
+        if src is None or self.digests.get(arcname) != digest:
+            return None
+
+        f = self._handle()
+        f.seek(src.header_offset)
+        header = f.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+            return None
+        fields = struct.unpack(zipfile.structFileHeader, header)
+        # Local header is followed by the file name and its own extra field (lengths at 10, 11)
+        f.seek(src.header_offset + zipfile.sizeFileHeader + fields[10] + fields[11])
+        payload = f.read(src.compress_size)
+        if len(payload) != src.compress_size:
+            return None
+
+        zinfo = zipfile.ZipInfo(arcname, date_time=src.date_time)
+        zinfo.external_attr = src.external_attr
+        zinfo.compress_type = src.compress_type
+        zinfo.file_size = src.file_size
+        zinfo.compress_size = src.compress_size
+        zinfo.CRC = src.CRC
+        self.reused += 1
+        return zinfo, payload
+
+    def close(self):
+        with self._handles_lock:
+            for f in self._handles:
+                f.close()
+            self._handles = []
+
+
+class ExportManifest:
+    """
+    Per-format record of the last export: a content digest for every archive member the
+    consumer has (image content hash from the index, sha1 of label files), plus the last full
+    archive on disk that later exports may copy unchanged members from.
+    """
+
+    def __init__(self, manifest_file: str):
+        self.manifest_file = manifest_file
+        self._lock = threading.Lock()
+        self._data = {}
+        if os.path.exists(manifest_file):
+            try:
+                with open(manifest_file, "r") as f:
+                    self._data = json.load(f)
+            except Exception as e:
+                print(f"Warning: Could not read export manifest {manifest_file}: {e}. Starting fresh.")
+
+    def _save(self):
+        tmp_path = self.manifest_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._data, f)
+        os.replace(tmp_path, self.manifest_file)
+
+    def last(self, export_format: str):
+        with self._lock:
+            return self._data.get(export_format)
+
+    def archive_paths(self):
+        """Archives later exports may still copy members from; they must not be cleaned up."""
+        with self._lock:
+            return {r["archive"]["path"] for r in self._data.values() if r.get("archive")}
+
+    def donor(self, export_format: str):
+        """ArchiveDonor for the last full archive of this format, if it is still intact."""
+        record = self.last(export_format)
+        archive = record.get("archive") if record else None
+        if not archive or not os.path.exists(archive["path"]):
+            return None
+        if os.path.getsize(archive["path"]) != archive["size"]:
+            return None
+        try:
+            return ArchiveDonor(archive["path"], archive["members"])
+        except Exception as e:
+            print(f"Warning: Previous export {archive['path']} is unusable: {e}")
+            return None
+
+    def record(self, export_format: str, export_id: str, members: dict, archive_path: str = None):
+        """
+        Stores what the consumer now has. archive_path is given for full archives only, delta
+        and streamed exports keep pointing at the previous full archive.
+        """
+        with self._lock:
+            previous = self._data.get(export_format) or {}
+            archive = previous.get("archive")
+            if archive_path is not None:
+                archive = {"path": archive_path, "size": os.path.getsize(archive_path), "members": members}
+            self._data[export_format] = {
+                "export_id": export_id,
+                "created": time.time(),
+                "members": members,
+                "archive": archive,
+            }
+            self._save()
+
+
+# Linux FICLONE ioctl: copy-on-write clone on btrfs/XFS/bcachefs, no data is copied
+FICLONE = 0x40049409
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+
+def place_file(src, dst, link_mode="auto"):
+    """
+    Puts src at dst without copying data when the filesystem allows it.
+    auto tries a reflink (independent copy-on-write file), then a hardlink (same inode), and only
+    copies when both fail, e.g. across filesystems. Returns the method that was used.
+    """
+    if link_mode in ("auto", "reflink") and os.name == "posix":
+        try:
+            _reflink(src, dst)
+            return "reflink"
+        except (OSError, ImportError):
+            if link_mode == "reflink":
+                raise
+    if link_mode in ("auto", "hardlink"):
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError as e:
+            if link_mode == "hardlink" or e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES):
+                raise
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def build_category_map(image_names, all_annotations):
+    """Category ids in first-seen order, pre-seeded to match the specific model requirements."""
+    # User defined: 0=person, 1=animal
+    category_map = {"person": 0, "animal": 1}
+    next_cat_id = 2
+    for img_name in image_names:
+        for box in all_annotations.get(img_name, []):
+            label = box.get("label", "object")
+            if label not in category_map:
+                category_map[label] = next_cat_id
+                next_cat_id += 1
+    return category_map
+
+
+def yolo_label_text(boxes, category_map, w, h):
+    yolo_lines = []
+    for box in boxes:
+        label = box.get("label", "object")
+        cat_id = category_map[label]
+
+        # Normalize
+        norm_x_center = (box["x"] + box["width"] / 2.0) / w
+        norm_y_center = (box["y"] + box["height"] / 2.0) / h
+        norm_width = box["width"] / w
+        norm_height = box["height"] / h
+
+        yolo_lines.append(f"{cat_id} {norm_x_center:.6f} {norm_y_center:.6f} {norm_width:.6f} {norm_height:.6f}")
+    return "\n".join(yolo_lines)
+
+
+class ExportEngine:
+    """
+    Streams a COCO or YOLO export into a zip file object.
+
+    The COCO JSON is written incrementally into its archive member, image reads (plus CRC and,
+    for formats that benefit, deflate) run in a bounded thread pool ahead of the writer, and
+    already-compressed images are stored as-is. The target can be a file on disk or an
+    unseekable stream (see stream_zip), so a download can start with the first bytes.
+
+    With base_members (arcname -> digest from the last export) only new or changed images and
+    labels are written, plus a _delta.json listing what changed and what was removed. A donor
+    archive supplies unchanged members as raw compressed bytes, skipping read and deflate.
+    """
+
+    def __init__(self, images_dir, index_entries, all_annotations, export_format="coco",
+                 workers=4, depth=16, progress=None, base_members=None, base_export_id=None, donor=None):
+        self.images_dir = images_dir
+        self.export_format = export_format
+        self.all_annotations = all_annotations
+        self.workers = workers
+        self.depth = depth
+        self.progress = progress or (lambda current, total, message: None)
+        self.base_members = base_members
+        self.base_export_id = base_export_id
+        self.donor = donor
+        # arcname -> digest of every member in the current dataset, filled while writing
+        self.members = {}
+        self.changed = []
+
+        # Unreadable images were indexed without dimensions, skip them
+        self.entries = [e for e in index_entries if e["width"] is not None and e["height"] is not None]
+        self.category_map = build_category_map([e["name"] for e in self.entries], all_annotations)
+
+    @property
+    def total(self):
+        return len(self.entries)
+
+    def image_arcname(self, img_name):
+        if self.export_format == "yolo":
+            return posixpath.join("train", "images", img_name)
+        return posixpath.join("images", img_name)
+
+    def label_arcname(self, img_name):
+        return posixpath.join("train", "labels", os.path.splitext(img_name)[0] + ".txt")
+
+    @property
+    def is_delta(self):
+        return self.base_members is not None
+
+    def _member(self, arcname, digest, read_fn, compress, mtime=None):
+        """(arcname, digest, packed member or None when a delta export can skip it)."""
+        if self.is_delta and self.base_members.get(arcname) == digest:
+            return arcname, digest, None
+        packed = self.donor.take(arcname, digest) if self.donor is not None else None
+        if packed is None:
+            packed = pack_member(arcname, read_fn(), compress=compress, mtime=mtime)
+        return arcname, digest, packed
+
+    def _load_image_member(self, entry):
+        """Worker: read an image and turn it into a ready-to-write member (+ its label)."""
+        img_name = entry["name"]
+
+        def read_image():
+            with open(os.path.join(self.images_dir, img_name), "rb") as f:
+                return f.read()
+
+        compress = not (
+            entry.get("format") in PRECOMPRESSED_FORMATS
+            or os.path.splitext(img_name)[1].lower() in PRECOMPRESSED_EXTENSIONS
+        )
+        # The index hash identifies the image content, unchanged images are never read
+        members = [self._member(self.image_arcname(img_name), entry["hash"], read_image, compress, entry["mtime"])]
+        if self.export_format == "yolo":
+            label = self._yolo_label(entry)
+            if label is not None:
+                data = label.encode("utf-8")
+                members.append(self._member(self.label_arcname(img_name), content_digest(data), lambda: data, True))
+        return members
+
+    def _yolo_label(self, entry):
+        img_name = entry["name"]
+        if img_name not in self.all_annotations:
+            # Write empty label file
+            return ""
+        text = yolo_label_text(self.all_annotations[img_name], self.category_map, entry["width"], entry["height"])
+        return text or None
+
+    def iter_image_members(self, entries=None):
+        """(entry, members, error) for every image, loaded ahead in the worker pool."""
+        prefetcher = prefetch.Prefetcher(
+            self._load_image_member, entries if entries is not None else self.entries,
+            depth=self.depth, workers=self.workers
+        )
+        return iter(prefetcher)
+
+    def write(self, fileobj):
+        try:
+            # Sizes are unknown for the streamed JSON member, allowZip64 lets it exceed 4 GB
+            with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+                if self.export_format == "yolo":
+                    self._write_yolo_header(zipf)
+                else:
+                    self._write_coco_json(zipf)
+                self._write_images(zipf)
+                if self.is_delta:
+                    self._write_delta_info(zipf)
+        finally:
+            if self.donor is not None:
+                self.donor.close()
+                print(f"Export: reused {self.donor.reused} unchanged members from {self.donor.path}")
+
+    def _write_images(self, zipf):
+        done = 0
+        for entry, members, error in self.iter_image_members():
+            done += 1
+            if error is not None:
+                print(f"Export: skipping {entry['name']}: {error}")
+                continue
+            for arcname, digest, packed in members:
+                self.members[arcname] = digest
+                if packed is None:
+                    continue
+                self.changed.append(arcname)
+                write_raw_member(zipf, *packed)
+            if done % 10 == 0 or done == self.total:
+                self.progress(done, self.total, f"Processing image {done}/{self.total}")
+
+    def _write_delta_info(self, zipf):
+        removed = sorted(set(self.base_members) - set(self.members))
+        zipf.writestr("_delta.json", json.dumps({
+            "base_export_id": self.base_export_id,
+            "format": self.export_format,
+            "changed": self.changed,
+            "removed": removed,
+        }, indent=4))
+
+    def yolo_header_files(self):
+        # Sort categories by ID to ensure correct order
+        sorted_cats = sorted(self.category_map.items(), key=lambda x: x[1])
+        classes_lines = [name for name, _ in sorted_cats]
+
+        yaml_content = []
+        yaml_content.append("train: train/images")
+        yaml_content.append("val: ''  # No validation set provided")
+        yaml_content.append(f"nc: {len(classes_lines)}")
+        yaml_content.append(f"names: {json.dumps(classes_lines)}")
+        return [("classes.txt", "\n".join(classes_lines)), ("data.yaml", "\n".join(yaml_content))]
+
+    def _write_yolo_header(self, zipf):
+        for name, text in self.yolo_header_files():
+            zipf.writestr(name, text)
+
+    def coco_header(self):
+        now = datetime.datetime.now()
+        return {
+            "info": {
+                "year": str(now.year),
+                "version": "1.0",
+                "description": "Exported Dataset",
+                "contributor": "",
+                "url": "",
+                "date_created": now.isoformat()
+            },
+            "licenses": [
+                {
+                    "id": 1,
+                    "url": "https://creativecommons.org/licenses/by/4.0/",
+                    "name": "CC BY 4.0"
+                }
+            ],
+            "categories": [
+                {"id": cid, "name": name, "supercategory": "Object"}
+                for name, cid in self.category_map.items()
+            ],
+        }
+
+    def iter_coco_json(self):
+        """COCO JSON as a sequence of text chunks (one per image / annotation)."""
+        header = json.dumps(self.coco_header())
+        yield header[:-1] + ', "images": ['
+
+        for image_id, entry in enumerate(self.entries):
+            dt = datetime.datetime.fromtimestamp(entry["mtime"])
+            yield ("," if image_id else "") + "\n" + json.dumps({
+                "id": image_id,
+                "license": 1,
+                "file_name": entry["name"],
+                "height": entry["height"],
+                "width": entry["width"],
+                "date_captured": dt.strftime('%Y-%m-%d %H:%M:%S'),
+                "extra": {
+                    "name": entry["name"]
+                }
+            })
+        yield '\n], "annotations": ['
+
+        ann_id = 0
+        for image_id, entry in enumerate(self.entries):
+            for box in self.all_annotations.get(entry["name"], []):
+                # COCO box format: [x, y, width, height]
+                yield ("," if ann_id else "") + "\n" + json.dumps({
+                    "id": ann_id,
+                    "image_id": image_id,
+                    "category_id": self.category_map[box.get("label", "object")],
+                    "bbox": [box["x"], box["y"], box["width"], box["height"]],
+                    "area": box["width"] * box["height"],
+                    "iscrowd": 0,
+                    "segmentation": []
+                })
+                ann_id += 1
+        yield "\n]}"
+
+    def write_directory(self, out_dir, link_mode="auto"):
+        """
+        Writes the same layout as the zip into out_dir (which must be empty or missing).
+        Images are reflinked/hardlinked from the dataset where possible, so the export costs
+        metadata operations instead of copying image bytes. Returns {method: count}.
+        """
+        if os.path.isdir(out_dir) and os.listdir(out_dir):
+            raise ValueError(f"Export directory {out_dir} is not empty")
+        image_dir = os.path.join(out_dir, posixpath.dirname(self.image_arcname("x")))
+        os.makedirs(image_dir, exist_ok=True)
+
+        if self.export_format == "yolo":
+            os.makedirs(os.path.join(out_dir, "train", "labels"), exist_ok=True)
+            for name, text in self.yolo_header_files():
+                with open(os.path.join(out_dir, name), "w") as f:
+                    f.write(text)
+        else:
+            self.progress(0, self.total, "Writing annotations...")
+            with open(os.path.join(out_dir, "_annotations.coco.json"), "w", encoding="utf-8") as f:
+                for chunk in self.iter_coco_json():
+                    f.write(chunk)
+
+        def place(entry):
+            img_name = entry["name"]
+            method = place_file(os.path.join(self.images_dir, img_name), os.path.join(image_dir, img_name), link_mode)
+            members = {self.image_arcname(img_name): entry["hash"]}
+            if self.export_format == "yolo":
+                label = self._yolo_label(entry)
+                if label is not None:
+                    arcname = self.label_arcname(img_name)
+                    data = label.encode("utf-8")
+                    with open(os.path.join(out_dir, arcname), "wb") as f:
+                        f.write(data)
+                    members[arcname] = content_digest(data)
+            return method, members
+
+        methods = {}
+        done = 0
+        # Linking is pure metadata work, the pool mostly hides filesystem latency
+        for entry, result, error in prefetch.Prefetcher(place, self.entries, depth=self.depth, workers=self.workers):
+            done += 1
+            if error is not None:
+                print(f"Export: skipping {entry['name']}: {error}")
+            else:
+                method, members = result
+                methods[method] = methods.get(method, 0) + 1
+                self.members.update(members)
+            if done % 10 == 0 or done == self.total:
+                self.progress(done, self.total, f"Placing image {done}/{self.total}")
+        return methods
+
+    def _write_coco_json(self, zipf):
+        self.progress(0, self.total, "Writing annotations...")
+        with zipf.open("_annotations.coco.json", "w", force_zip64=True) as dest:
+            buffer = io.BufferedWriter(dest, buffer_size=1 << 20)
+            for chunk in self.iter_coco_json():
+                buffer.write(chunk.encode("utf-8"))
+            buffer.flush()
+            buffer.detach()
+
+
+class _QueueWriter(io.RawIOBase):
+    """Unseekable file object that hands written bytes to a consumer through a bounded queue."""
+
+    def __init__(self, chunks: queue.Queue, closed: threading.Event):
+        self.chunks = chunks
+        self.closed_by_reader = closed
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if b:
+            data = bytes(b)
+            while True:
+                try:
+                    self.chunks.put(data, timeout=0.5)
+                    break
+                except queue.Full:
+                    # Nobody will ever drain the queue once the client went away
+                    if self.closed_by_reader.is_set():
+                        raise BrokenPipeError("Export stream closed by the reader")
+        return len(b)
+
+
+_STREAM_DONE = object()
+
+
+def stream_zip(engine: ExportEngine, chunk_size: int = 1 << 20, max_chunks: int = 32):
+    """
+    Runs the engine in a producer thread and yields the zip as it is produced.
+    Backpressure: the producer blocks once max_chunks buffers are waiting for the client.
+    """
+    chunks = queue.Queue(maxsize=max_chunks)
+    closed = threading.Event()
+    failure = []
+
+    def produce():
+        try:
+            writer = io.BufferedWriter(_QueueWriter(chunks, closed), buffer_size=chunk_size)
+            engine.write(writer)
+            writer.flush()
+        except Exception as e:
+            failure.append(e)
+        finally:
+            if not closed.is_set():
+                chunks.put(_STREAM_DONE)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _STREAM_DONE:
+                break
+            yield chunk
+    finally:
+        # Also reached when the consumer stops early (client disconnect): unblock the producer
+        closed.set()
+        while not chunks.empty():
+            chunks.get_nowait()
+    producer.join()
+    if failure:
+        raise failure[0]
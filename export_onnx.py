@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import torch
+
+# Ensure we can import the project modules
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import detector_logic
+import compiled_inference
+import onnx_inference
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OPSET = 18
+
+
+def export_graph(module, args, path, input_names, output_names, dynamic_shapes):
+    start = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(module, args, path, input_names=list(input_names), output_names=output_names,
+                          dynamic_shapes=dynamic_shapes, opset_version=OPSET, dynamo=True, external_data=True)
+    print(f"Exported {os.path.basename(path)} in {time.perf_counter() - start:.0f}s")
+
+
+def export(args):
+    """
+    Writes text_encoder.onnx (token length dynamic), one detector_<h>x<w>.onnx per shape bucket
+    (token length dynamic, image shape fixed), the tokenizer and the manifest OnnxCountGD reads.
+    Exported on CPU, so deformable attention is the pure-PyTorch grid_sample path.
+    """
+    model, _, _ = detector_logic.load_detector_model(args.config, args.checkpoint, "cpu",
+                                                     text_encoder_type=args.text_encoder)
+    os.makedirs(args.out_dir, exist_ok=True)
+    tokens = torch.export.Dim("tokens", min=2, max=model.max_text_len)
+
+    text = compiled_inference.tokenize(model.tokenizer, model.specical_tokens, model.max_text_len, "object .")
+    text_encoder = compiled_inference.CountGDTextEncoder(model).eval()
+    export_graph(text_encoder, text, os.path.join(args.out_dir, "text_encoder.onnx"),
+                 onnx_inference.TEXT_INPUTS, ["encoded_text"],
+                 ({1: tokens}, {1: tokens}, {1: tokens}, {1: tokens}, {1: tokens, 2: tokens}))
+    with torch.no_grad():
+        encoded_text = text_encoder(*text)
+
+    if args.buckets:
+        buckets = [tuple(int(n) for n in b.split("x")) for b in args.buckets]
+    else:
+        buckets = compiled_inference.shape_buckets(args.size, args.max_size)
+    detector = compiled_inference.CountGDDetector(model).eval()
+    detectors = {}
+    for h, w in buckets:
+        images, image_mask = compiled_inference.pad_to_bucket(torch.zeros(3, h, w), (h, w))
+        filename = f"detector_{h}x{w}.onnx"
+        export_graph(detector, (images, image_mask, encoded_text, text[1].bool(), text[3], text[4]),
+                     os.path.join(args.out_dir, filename), onnx_inference.DETECTOR_INPUTS,
+                     ["pred_logits", "pred_boxes"],
+                     (None, None, {1: tokens}, {1: tokens}, {1: tokens}, {1: tokens, 2: tokens}))
+        detectors[f"{h}x{w}"] = filename
+
+    model.tokenizer.save_pretrained(os.path.join(args.out_dir, "tokenizer"))
+    manifest = {
+        "checkpoint": os.path.basename(args.checkpoint),
+        "torch": torch.__version__,
+        "opset": OPSET,
+        "size": args.size,
+        "max_size": args.max_size,
+        "max_text_len": model.max_text_len,
+        "special_tokens": list(model.specical_tokens),
+        "tokenizer": "tokenizer",
+        "text_encoder": "text_encoder.onnx",
+        "detectors": detectors,
+    }
+    with open(os.path.join(args.out_dir, onnx_inference.MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"CountGD ONNX export ({len(detectors)} shape buckets) written to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export CountGD (text-prompt inference path) to ONNX for the countgd_onnx backend")
+    parser.add_argument("--out-dir", default=os.path.join(BASE_DIR, "data", "model_cache", "countgd_onnx"))
+    parser.add_argument("--size", type=int, default=800)
+    parser.add_argument("--max-size", type=int, default=1333)
+    parser.add_argument("--buckets", nargs="*", help="Padded input shapes as HxW (default: every bucket of --size/--max-size)")
+    parser.add_argument("--config", default=os.path.join(BASE_DIR, "config", "cfg_fsc147_vit_b.py"))
+    parser.add_argument("--checkpoint", default=os.path.join(BASE_DIR, "checkpoint_fsc147_best.pth"))
+    parser.add_argument("--text-encoder", default="bert-base-uncased")
+    export(parser.parse_args())
@@ -702,7 +702,8 @@ class color_sys:
 
 
 def inverse_sigmoid(x, eps=1e-3):
-    x = x.clamp(min=0, max=1)
+    # Always fp32: under bf16 autocast the log-odds of boxes near 0/1 would lose most digits
+    x = x.float().clamp(min=0, max=1)
     x1 = x.clamp(min=eps)
     x2 = (1 - x).clamp(min=eps)
     return torch.log(x1 / x2)
@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import video_processor
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def read_image_metadata(image_path: str) -> dict:
+    """
+    Collects everything the server needs to know about an image file in a single pass.
+
+    Only the image header is decoded (PIL opens lazily), the content hash is computed by
+    streaming the raw bytes. Files PIL cannot read are still returned (so they stay listed)
+    but with width/height/format set to None.
+    """
+    st = os.stat(image_path)
+
+    width, height, fmt = None, None, None
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            fmt = img.format
+    except Exception:
+        pass
+
+    hasher = hashlib.sha1()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+
+    return {
+        "name": os.path.basename(image_path),
+        "width": width,
+        "height": height,
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "hash": hasher.hexdigest(),
+        "format": fmt,
+    }
+
+
+class ImageIndex:
+    """
+    Persistent metadata index of the images directory.
+
+    Filled at ingest time (uploads, frame extraction) so listing and export never have to
+    touch the image files again. The index is a JSON file next to annotations.json.
+    """
+
+    def __init__(self, images_dir: str, index_file: str, max_workers: int = None):
+        self.images_dir = images_dir
+        self.index_file = index_file
+        self.max_workers = max_workers or min(8, (os.cpu_count() or 1) + 4)
+
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._sorted_names = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, "r") as f:
+                self._entries = json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read image index {self.index_file}: {e}. Rebuilding.")
+            self._entries = {}
+
+    def _save(self):
+        # Atomic replace so a crash mid-write never leaves a truncated index behind
+        tmp_path = self.index_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.index_file)
+
+    def _read_many(self, names):
+        paths = [os.path.join(self.images_dir, n) for n in names]
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for name, meta in zip(names, pool.map(self._safe_read, paths)):
+                if meta is not None:
+                    results.append((name, meta))
+        return results
+
+    @staticmethod
+    def _safe_read(image_path):
+        try:
+            return read_image_metadata(image_path)
+        except OSError as e:
+            print(f"Warning: Could not index {image_path}: {e}")
+            return None
+
+    def add(self, names):
+        """Indexes (or re-indexes) the given filenames in parallel. Returns the new entries."""
+        names = [n for n in names if video_processor.is_image_file(n)]
+        if not names:
+            return []
+
+        results = self._read_many(names)
+        with self._lock:
+            for name, meta in results:
+                self._entries[name] = meta
+            self._sorted_names = None
+            self._save()
+        return [meta for _, meta in results]
+
+    def remove(self, names):
+        with self._lock:
+            for name in names:
+                self._entries.pop(name, None)
+            self._sorted_names = None
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._sorted_names = None
+            self._save()
+
+    def sync(self):
+        """
+        Reconciles the index with the images directory: new or modified files (size/mtime
+        changed) are indexed, deleted files are dropped. Only stats files, never decodes
+        images that are already up to date. Returns the entries that were (re)indexed.
+        """
+        if not os.path.exists(self.images_dir):
+            self.clear()
+            return []
+
+        on_disk = {}
+        with os.scandir(self.images_dir) as it:
+            for entry in it:
+                if entry.is_file() and video_processor.is_image_file(entry.name):
+                    on_disk[entry.name] = entry.stat()
+
+        with self._lock:
+            stale = [n for n in self._entries if n not in on_disk]
+            changed = []
+            for name, st in on_disk.items():
+                meta = self._entries.get(name)
+                if meta is None or meta["size"] != st.st_size or meta["mtime"] != st.st_mtime:
+                    changed.append(name)
+
+        if stale:
+            self.remove(stale)
+        return self.add(changed)
+
+    def names(self):
+        """Sorted image filenames (same order as video_processor.list_images)."""
+        with self._lock:
+            if self._sorted_names is None:
+                self._sorted_names = sorted(self._entries)
+            return list(self._sorted_names)
+
+    def get(self, name):
+        with self._lock:
+            return self._entries.get(name)
+
+    def entries(self):
+        """All metadata entries in listing order."""
+        with self._lock:
+            return [self._entries[n] for n in self.names()]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._entries
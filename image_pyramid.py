@@ -0,0 +1,207 @@
+import os
+import re
+import json
+import math
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import region_reader
+
+# Images with a longest side above this get a full tile pyramid, smaller ones only a preview
+PYRAMID_MIN_SIDE = 4096
+PREVIEW_MAX_SIDE = 1024
+TILE_SIZE = 512
+TILE_QUALITY = 85
+
+# Formats every browser can draw directly; anything else (e.g. TIFF) is always shown through
+# a JPEG preview, at full size when the image is small
+BROWSER_FORMATS = {"JPEG", "PNG", "BMP", "WEBP", "GIF"}
+
+_HASH_RE = re.compile(r"^[0-9a-f]{40}$")
+
+
+def pyramid_levels(width: int, height: int, tile_size: int = TILE_SIZE):
+    """
+    Level layout of the pyramid. Level 0 is full resolution and every following level halves
+    both sides, until the whole image fits into a single tile.
+    """
+    levels = []
+    level = 0
+    w, h = width, height
+    while True:
+        levels.append({
+            "level": level,
+            "scale": 1.0 / (2 ** level),
+            "width": w,
+            "height": h,
+            "cols": math.ceil(w / tile_size),
+            "rows": math.ceil(h / tile_size),
+        })
+        if w <= tile_size and h <= tile_size:
+            break
+        w, h = max(1, math.ceil(w / 2)), max(1, math.ceil(h / 2))
+        level += 1
+    return levels
+
+
+def build_pyramid(image_path: str, out_dir: str, tile_size: int = TILE_SIZE,
+                  cache_dir: str = None, full_size_preview: bool = False):
+    """
+    Writes preview.jpg, tiles/<level>/<col>_<row>.jpg and descriptor.json into out_dir.
+
+    Level 0 tiles are read window by window through a region reader, every coarser tile is
+    the 2x reduce of its four children, so peak memory is a few tiles rather than the image.
+    """
+    tmp_dir = out_dir + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    with region_reader.open_region_reader(image_path, cache_dir) as reader:
+        width, height = reader.size
+
+        levels = []
+        if max(width, height) > PYRAMID_MIN_SIDE:
+            levels = pyramid_levels(width, height, tile_size)
+            for lvl in levels:
+                level_dir = os.path.join(tmp_dir, "tiles", str(lvl["level"]))
+                os.makedirs(level_dir)
+                for row in range(lvl["rows"]):
+                    for col in range(lvl["cols"]):
+                        if lvl["level"] == 0:
+                            x0, y0 = col * tile_size, row * tile_size
+                            tile = Image.fromarray(reader.read_region(
+                                x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height)
+                            ))
+                        else:
+                            tile = _merge_children(tmp_dir, levels[lvl["level"] - 1], col, row, tile_size)
+                        tile.save(os.path.join(level_dir, f"{col}_{row}.jpg"), "JPEG", quality=TILE_QUALITY)
+            preview = _assemble_level(tmp_dir, levels, tile_size)
+            preview.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE), Image.BILINEAR)
+        elif full_size_preview:
+            preview = Image.fromarray(reader.read_region(0, 0, width, height))
+        else:
+            preview = reader.read_thumbnail(PREVIEW_MAX_SIDE)
+
+    preview.save(os.path.join(tmp_dir, "preview.jpg"), "JPEG", quality=TILE_QUALITY)
+
+    descriptor = {
+        "width": width,
+        "height": height,
+        "tile_size": tile_size,
+        "preview": {"width": preview.width, "height": preview.height},
+        "levels": levels,
+    }
+    with open(os.path.join(tmp_dir, "descriptor.json"), "w") as f:
+        json.dump(descriptor, f)
+
+    # Publish atomically so readers never see a half-written pyramid
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+    return descriptor
+
+
+def _merge_children(tmp_dir, child_level, col, row, tile_size):
+    """Builds a tile from the (up to) 2x2 tiles of the next finer level."""
+    child_dir = os.path.join(tmp_dir, "tiles", str(child_level["level"]))
+    block_w = min(2 * tile_size, child_level["width"] - 2 * col * tile_size)
+    block_h = min(2 * tile_size, child_level["height"] - 2 * row * tile_size)
+    block = Image.new("RGB", (block_w, block_h))
+    for dy in range(2):
+        for dx in range(2):
+            c, r = 2 * col + dx, 2 * row + dy
+            if c >= child_level["cols"] or r >= child_level["rows"]:
+                continue
+            with Image.open(os.path.join(child_dir, f"{c}_{r}.jpg")) as child:
+                block.paste(child, (dx * tile_size, dy * tile_size))
+    return block.reduce(2)
+
+
+def _assemble_level(tmp_dir, levels, tile_size):
+    """Stitches the first level small enough for the preview (at most 2x the preview size)."""
+    lvl = next(l for l in levels if max(l["width"], l["height"]) <= 2 * PREVIEW_MAX_SIDE)
+    level_dir = os.path.join(tmp_dir, "tiles", str(lvl["level"]))
+    img = Image.new("RGB", (lvl["width"], lvl["height"]))
+    for row in range(lvl["rows"]):
+        for col in range(lvl["cols"]):
+            with Image.open(os.path.join(level_dir, f"{col}_{row}.jpg")) as tile:
+                img.paste(tile, (col * tile_size, row * tile_size))
+    return img
+
+
+class PyramidService:
+    """
+    Builds previews/tile pyramids in a background worker at ingest time.
+
+    Pyramids are keyed by the content hash from the image index, so a URL under
+    /api/pyramids/<hash>/... always refers to the same bytes and can be cached forever.
+    """
+
+    def __init__(self, pyramids_dir: str, images_dir: str, max_workers: int = 1, cache_dir: str = None):
+        self.pyramids_dir = pyramids_dir
+        self.images_dir = images_dir
+        self.cache_dir = cache_dir
+        os.makedirs(self.pyramids_dir, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pyramid")
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def pyramid_dir(self, content_hash: str):
+        if not _HASH_RE.match(content_hash or ""):
+            raise ValueError("Invalid content hash")
+        return os.path.join(self.pyramids_dir, content_hash)
+
+    def descriptor(self, content_hash: str):
+        path = os.path.join(self.pyramid_dir(content_hash), "descriptor.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def is_pending(self, content_hash: str):
+        with self._lock:
+            return content_hash in self._pending
+
+    def schedule(self, entries):
+        """Queues preview/pyramid generation for index entries that need one."""
+        for entry in entries:
+            content_hash = entry.get("hash")
+            if not entry.get("width") or not entry.get("height"):
+                continue
+            browser_format = entry.get("format") in BROWSER_FORMATS
+            if browser_format and max(entry["width"], entry["height"]) <= PREVIEW_MAX_SIDE:
+                continue
+            if os.path.exists(os.path.join(self.pyramid_dir(content_hash), "descriptor.json")):
+                continue
+            with self._lock:
+                if content_hash in self._pending:
+                    continue
+                image_path = os.path.join(self.images_dir, entry["name"])
+                self._pending[content_hash] = self._executor.submit(
+                    self._build, image_path, content_hash, not browser_format
+                )
+
+    def _build(self, image_path, content_hash, full_size_preview):
+        try:
+            build_pyramid(
+                image_path, self.pyramid_dir(content_hash),
+                cache_dir=self.cache_dir, full_size_preview=full_size_preview
+            )
+        except Exception as e:
+            print(f"Pyramid generation failed for {image_path}: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(content_hash, None)
+
+    def clear(self):
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending = {}
+        for name in os.listdir(self.pyramids_dir):
+            shutil.rmtree(os.path.join(self.pyramids_dir, name), ignore_errors=True)
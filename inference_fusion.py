@@ -0,0 +1,32 @@
+from collections import Counter
+
+import torch.nn as nn
+
+
+def freeze_for_inference(model: nn.Module) -> Counter:
+    """
+    One-time load-time pass over a CountGD model in eval mode, after its weights are loaded:
+    every submodule with a fuse_for_inference() method precomputes what its forward would
+    otherwise rebuild per call.
+
+    - FrozenBatchNorm2d: per-channel scale/shift from the frozen statistics
+    - WindowAttention (Swin): gathered relative position bias; q scale folded into a copy of qkv
+    - MultiScaleDeformableAttention: sampling_offsets + attention_weights as one GEMM
+    - BiMultiHeadAttention: query/value projections of each modality as one GEMM, q scale folded
+
+    Not folded: input_proj's GroupNorm normalizes with statistics of the data, so it cannot be
+    merged into the Conv before it, and feat_map only saves an elementwise affine on BERT's
+    output. Returns the number of fused modules per type.
+
+    The precomputed tensors are non-persistent buffers derived from the weights, which are
+    never modified, so re-run this after loading new weights into a fused model.
+    """
+    if model.training:
+        raise RuntimeError("freeze_for_inference expects a model in eval mode")
+    fused = Counter()
+    for module in model.modules():
+        fuse = getattr(module, "fuse_for_inference", None)
+        if fuse is not None:
+            fuse()
+            fused[type(module).__name__] += 1
+    return fused
@@ -0,0 +1,230 @@
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+
+import cancellation
+
+# Lanes in priority order: a user waiting on the current image beats bulk work, which beats
+# opportunistic background work
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+LANE_BACKGROUND = "background"
+LANES = (LANE_INTERACTIVE, LANE_BATCH, LANE_BACKGROUND)
+# Cancellation reason of a background unit that gave the model up to a more urgent request
+PREEMPTED = "preempted"
+
+# Degradation ladder for interactive requests under load, best first. size/max_size is the model
+# input resize, tile_size the tiling window (larger windows = fewer tiles, None = no tiling) and
+# num_queries the decoder query budget (None = model default, 900). cost is the rough service time
+# relative to "full" and only seeds the latency prediction.
+QUALITY_LEVELS = (
+    {"name": "full", "size": 800, "max_size": 1333, "tile_size": 640, "num_queries": None, "cost": 1.0},
+    {"name": "reduced", "size": 640, "max_size": 1066, "tile_size": 960, "num_queries": 600, "cost": 0.65},
+    {"name": "fast", "size": 512, "max_size": 853, "tile_size": None, "num_queries": 300, "cost": 0.4},
+    {"name": "minimal", "size": 384, "max_size": 640, "tile_size": None, "num_queries": 100, "cost": 0.25},
+)
+# Progressive auto-annotate answers at this level (or lower under load) before the full pass
+PREVIEW_LEVEL = 2
+
+
+class ModelGate:
+    """
+    Priority lock around the model: one forward pass runs at a time and, whenever the model
+    frees up, the waiter from the highest-priority lane goes next (FIFO within a lane).
+
+    Bulk callers take the gate per image or per tile, never for a whole job, so an interactive
+    request waits for at most one unit of batch work instead of the whole batch. A waiter whose
+    cancellation token (cancellation.current()) fires leaves the queue without running.
+
+    Units in a preemptible lane run on idle capacity only: as soon as a more urgent waiter shows
+    up, the running unit's token is cancelled with reason PREEMPTED and it stops at the next
+    model stage (its owner is expected to retry later).
+    """
+
+    def __init__(self, lanes=LANES, preemptible=(LANE_BACKGROUND,)):
+        self.lanes = tuple(lanes)
+        self.preemptible = tuple(preemptible)
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._active_lane = None
+        self._active_token = None
+        # EWMA of how long one unit (image/tile) holds the model, for queue wait predictions
+        self.unit_s = None
+        # Per-thread usage totals for gate.track()
+        self._local = threading.local()
+        self._metrics = {
+            lane: {"queued": 0, "served": 0, "wait_s": 0.0, "max_wait_s": 0.0, "busy_s": 0.0}
+            for lane in self.lanes
+        }
+
+    @contextmanager
+    def slot(self, lane: str = LANE_INTERACTIVE):
+        if lane not in self._metrics:
+            raise ValueError(f"Unknown inference lane: {lane}")
+        ticket = (self.lanes.index(lane), next(self._seq))
+        metrics = self._metrics[lane]
+        requested = time.perf_counter()
+
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            metrics["queued"] += 1
+            if (self._active_token is not None
+                    and ticket[0] < self.lanes.index(self._active_lane)):
+                self._active_token.cancel(PREEMPTED)
+            try:
+                while self._active_lane is not None or self._waiting[0] != ticket:
+                    cancellation.check_current()
+                    self._cond.wait(timeout=0.1)
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                metrics["queued"] -= 1
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            metrics["queued"] -= 1
+            self._active_lane = lane
+            self._active_token = cancellation.current() if lane in self.preemptible else None
+            waited = time.perf_counter() - requested
+            metrics["served"] += 1
+            metrics["wait_s"] += waited
+            metrics["max_wait_s"] = max(metrics["max_wait_s"], waited)
+
+        usage = getattr(self._local, "usage", None)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            busy = time.perf_counter() - started
+            with self._cond:
+                metrics["busy_s"] += busy
+                self.unit_s = busy if self.unit_s is None else 0.8 * self.unit_s + 0.2 * busy
+                self._active_lane = None
+                self._active_token = None
+                self._cond.notify_all()
+            if usage is not None:
+                usage["units"] += 1
+                usage["wait_s"] += waited
+                usage["busy_s"] += busy
+
+    @contextmanager
+    def track(self):
+        """Sums units, wait_s and busy_s of every slot this thread takes inside the block."""
+        usage = {"units": 0, "wait_s": 0.0, "busy_s": 0.0}
+        previous = getattr(self._local, "usage", None)
+        self._local.usage = usage
+        try:
+            yield usage
+        finally:
+            self._local.usage = previous
+
+    def backlog(self, lane: str = LANE_INTERACTIVE) -> int:
+        """Units a new request in lane would wait for: queued in lanes at least as urgent, plus the active one."""
+        rank = self.lanes.index(lane)
+        with self._cond:
+            queued = sum(self._metrics[l]["queued"] for l in self.lanes[:rank + 1])
+            return queued + (1 if self._active_lane is not None else 0)
+
+    def stats(self):
+        """Per-lane queue depth and wait times, plus the lane currently holding the model."""
+        with self._cond:
+            lanes = {}
+            for lane, m in self._metrics.items():
+                lanes[lane] = {
+                    "queue_depth": m["queued"],
+                    "served": m["served"],
+                    "avg_wait_ms": round(m["wait_s"] / m["served"] * 1000, 1) if m["served"] else 0.0,
+                    "max_wait_ms": round(m["max_wait_s"] * 1000, 1),
+                    "busy_s": round(m["busy_s"], 2),
+                }
+            return {
+                "active_lane": self._active_lane,
+                "unit_ms": round(self.unit_s * 1000, 1) if self.unit_s is not None else None,
+                "lanes": lanes,
+            }
+
+
+class AdmissionController:
+    """
+    Picks a quality level per interactive request so the predicted latency stays under a target.
+
+    predicted latency = backlog units * gate.unit_s + full-quality service time * level cost,
+    with the service time learned per key (model type, tiled) from what requests actually spent
+    holding the model. Without an explicit target the budget is slack x the unloaded service time,
+    i.e. a request may take up to twice as long as on an idle server before quality drops. Going
+    back up a level needs the prediction to fit upgrade_margin x target, so quality does not
+    flap at the boundary; once the queue drains requests are back at "full" by themselves.
+    """
+
+    def __init__(self, gate: ModelGate, levels=QUALITY_LEVELS, target_latency_s: float = None,
+                 slack: float = 2.0, alpha: float = 0.3, upgrade_margin: float = 0.8):
+        self.gate = gate
+        self.levels = tuple(levels)
+        self.target_latency_s = target_latency_s
+        self.slack = slack
+        self.alpha = alpha
+        self.upgrade_margin = upgrade_margin
+        self._lock = threading.Lock()
+        self._service = {}
+        self._level = {}
+        self._served = {level["name"]: 0 for level in self.levels}
+
+    def predict(self, key, level: int, lane: str = LANE_INTERACTIVE):
+        """Predicted seconds until a request at this level finishes, None before the first observation."""
+        service = self._service.get(key)
+        if service is None:
+            return None
+        wait = self.gate.backlog(lane) * (self.gate.unit_s or 0.0)
+        return wait + service * self.levels[level]["cost"]
+
+    def choose(self, key, target_latency_s: float = None, max_level: int = None, lane: str = LANE_INTERACTIVE,
+               min_level: int = 0):
+        """
+        Returns (level index, predicted_s, target_s) for the next request of this key, never
+        better than min_level (previews) nor worse than max_level (what the model supports).
+        """
+        if max_level is None:
+            max_level = len(self.levels) - 1
+        min_level = min(min_level, max_level)
+        with self._lock:
+            service = self._service.get(key)
+            if service is None:
+                # Nothing measured yet: run at the best allowed quality and learn from it
+                self._served[self.levels[min_level]["name"]] += 1
+                return min_level, None, target_latency_s or self.target_latency_s
+            target = target_latency_s or self.target_latency_s or self.slack * service
+            current = min(max(self._level.get(key, 0), min_level), max_level)
+            chosen, predicted = max_level, self.predict(key, max_level, lane)
+            for level in range(min_level, max_level + 1):
+                estimate = self.predict(key, level, lane)
+                limit = target if level >= current else target * self.upgrade_margin
+                if estimate <= limit:
+                    chosen, predicted = level, estimate
+                    break
+            if min_level == 0:
+                # Previews do not say anything about the level full requests are running at
+                self._level[key] = chosen
+            self._served[self.levels[chosen]["name"]] += 1
+            return chosen, predicted, target
+
+    def observe(self, key, level: int, busy_s: float):
+        """Feeds back the model time a request used, normalized to full quality."""
+        if busy_s <= 0:
+            return
+        full = busy_s / self.levels[level]["cost"]
+        with self._lock:
+            previous = self._service.get(key)
+            self._service[key] = full if previous is None else (1 - self.alpha) * previous + self.alpha * full
+
+    def stats(self):
+        with self._lock:
+            return {
+                "target_latency_s": self.target_latency_s,
+                "slack": self.slack,
+                "service_s": {"/".join(map(str, key)): round(s, 3) for key, s in self._service.items()},
+                "current_level": {"/".join(map(str, key)): self.levels[l]["name"] for key, l in self._level.items()},
+                "served": dict(self._served),
+            }
@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cancellation
+
+FINISHED_STATES = ("completed", "failed", "cancelled", "interrupted")
+# Progress-only updates are persisted at most this often, state changes always immediately
+SAVE_INTERVAL_S = 1.0
+
+
+class JobCancelled(cancellation.OperationCancelled):
+    """Raised inside a job (by Job.progress / Job.check_cancelled) once cancel was requested."""
+
+
+class Job:
+    """
+    Handle passed to a job function. Behaves like the job's status dict (job["message"] = ...),
+    and adds progress reporting with cooperative cancellation and artifact registration.
+    """
+
+    def __init__(self, scheduler, job_id):
+        self.scheduler = scheduler
+        self.id = job_id
+        self.cancel_event = threading.Event()
+
+    def __getitem__(self, key):
+        with self.scheduler._lock:
+            return self.scheduler._records[self.id][key]
+
+    def __setitem__(self, key, value):
+        self.update(**{key: value})
+
+    def get(self, key, default=None):
+        with self.scheduler._lock:
+            return self.scheduler._records[self.id].get(key, default)
+
+    def update(self, **fields):
+        self.scheduler._update(self.id, fields)
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def token(self):
+        """Cancellation token sharing this job's cancel event (for model/tile checks)."""
+        return cancellation.CancellationToken(self.cancel_event)
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def progress(self, current=None, total=None, message=None):
+        """Progress callback (current, total, message); also the job's cancellation point."""
+        self.check_cancelled()
+        fields = {}
+        if current is not None:
+            fields["current"] = current
+        if total is not None:
+            fields["total"] = total
+        if message is not None:
+            fields["message"] = message
+        self.update(**fields)
+
+    def add_artifact(self, path):
+        """Files/directories owned by the job, removed on failure or once the job expires."""
+        with self.scheduler._lock:
+            artifacts = self.scheduler._records[self.id]["artifacts"]
+            if path not in artifacts:
+                artifacts.append(path)
+        self.scheduler._save(force=True)
+
+    def start(self):
+        self.scheduler._update(self.id, {"status": "processing", "started": time.time()}, force=True)
+
+    def finish(self, status, error=None):
+        fields = {"status": status, "finished": time.time()}
+        if error is not None:
+            fields["error"] = error
+        if status == "completed":
+            fields["current"] = self.get("total")
+        self.scheduler._update(self.id, fields, force=True)
+        if status in ("failed", "cancelled"):
+            # Partial outputs are useless, drop them right away
+            self.scheduler._remove_artifacts(self.id)
+
+
+class JobScheduler:
+    """
+    One place for every long-running job (export, video extraction, batch annotation).
+
+    Job records live in a JSON file so status survives a restart (jobs that were running are
+    marked "interrupted"). Jobs run on a bounded thread pool and each job type has its own
+    concurrency limit, so e.g. ten export requests queue up instead of fighting over the disk.
+    Artifacts of finished jobs are deleted once the job is older than artifact_ttl_s, and jobs
+    registered with create() that nobody claims within pending_ttl_s are marked "interrupted".
+    """
+
+    def __init__(self, jobs_file: str, limits: dict, max_workers: int = None,
+                 artifact_ttl_s: float = 24 * 3600, keep_artifact=None, pending_ttl_s: float = 3600):
+        self.jobs_file = jobs_file
+        self.limits = dict(limits)
+        self.max_workers = max_workers or max(1, sum(self.limits.values()))
+        self.artifact_ttl_s = artifact_ttl_s
+        # Callable(path) -> True for artifacts that must survive expiry (e.g. a donor archive)
+        self.keep_artifact = keep_artifact or (lambda path: False)
+        self.pending_ttl_s = pending_ttl_s
+
+        self._lock = threading.RLock()
+        self._records = {}
+        self._handles = {}
+        self._queue = deque()
+        # Jobs from create() that are neither queued nor claimed by whoever drives them yet
+        self._unclaimed = {}
+        self._running = {job_type: 0 for job_type in self.limits}
+        # Signalled whenever a running job gives its slot back
+        self._slot_freed = threading.Condition(self._lock)
+        self._last_save = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.jobs_file):
+            return
+        try:
+            with open(self.jobs_file, "r") as f:
+                self._records = json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read job records {self.jobs_file}: {e}. Starting fresh.")
+            self._records = {}
+        # Job functions do not survive a restart, so unfinished jobs cannot be resumed
+        for record in self._records.values():
+            if record["status"] not in FINISHED_STATES:
+                record["status"] = "interrupted"
+                record["error"] = "Server restarted before the job finished"
+                record["finished"] = time.time()
+        self._save(force=True)
+
+    def _save(self, force=False):
+        with self._lock:
+            now = time.time()
+            if not force and now - self._last_save < SAVE_INTERVAL_S:
+                return
+            self._last_save = now
+            tmp_path = self.jobs_file + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._records, f)
+            os.replace(tmp_path, self.jobs_file)
+
+    def _update(self, job_id, fields, force=False):
+        with self._lock:
+            self._records[job_id].update(fields)
+            self._save(force=force)
+
+    def create(self, job_type: str, artifacts=None, **fields) -> Job:
+        """
+        Registers a job record without queueing it (for work driven elsewhere, e.g. a stream,
+        which claims it). Artifacts given here are owned by the job from the start.
+        """
+        if job_type not in self.limits:
+            raise ValueError(f"Unknown job type: {job_type}")
+        self.cleanup_artifacts()
+        job_id = str(uuid.uuid4())
+        record = {
+            "id": job_id,
+            "type": job_type,
+            "status": "pending",
+            "total": 0,
+            "current": 0,
+            "message": "Queued...",
+            "error": None,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "artifacts": list(artifacts or []),
+        }
+        record.update(fields)
+        with self._lock:
+            self._records[job_id] = record
+            self._handles[job_id] = Job(self, job_id)
+            self._unclaimed[job_id] = record["created"]
+            self._save(force=True)
+        return self._handles[job_id]
+
+    def submit(self, job_type: str, fn, artifacts=None, **fields) -> Job:
+        """Queues fn(job); it starts once the pool and the job type's limit allow."""
+        job = self.create(job_type, artifacts=artifacts, **fields)
+        with self._lock:
+            self._unclaimed.pop(job.id, None)
+            self._queue.append((job, fn))
+        self._dispatch()
+        return job
+
+    def _dispatch(self):
+        with self._lock:
+            for item in list(self._queue):
+                job, fn = item
+                job_type = self._records[job.id]["type"]
+                if self._running[job_type] >= self.limits[job_type]:
+                    continue
+                self._queue.remove(item)
+                self._running[job_type] += 1
+                self._executor.submit(self._run, job, fn)
+
+    def _run(self, job: Job, fn):
+        try:
+            if job.cancelled:
+                raise JobCancelled()
+            job.start()
+            fn(job)
+            job.finish("completed")
+        except cancellation.OperationCancelled:
+            job.update(message="Cancelled")
+            job.finish("cancelled")
+        except Exception as e:
+            print(f"Job {job.id} ({job.get('type')}) failed: {e}")
+            job.finish("failed", error=str(e))
+        finally:
+            self.release_slot(job)
+
+    def claim(self, job_id: str):
+        """
+        Hands a job registered with create() to the one caller that drives it. Returns None if
+        it was already claimed, has finished, or is not a create() job.
+        """
+        with self._lock:
+            if self._unclaimed.pop(job_id, None) is None:
+                return None
+            return self._handles[job_id]
+
+    def acquire_slot(self, job: Job, poll_s: float = 0.5):
+        """
+        Takes a slot of the job's type for work driven outside the pool (e.g. a streamed
+        export), waiting while the type is at its limit. Raises JobCancelled if the job is
+        cancelled first. Pair with release_slot.
+        """
+        with self._slot_freed:
+            job_type = self._records[job.id]["type"]
+            while self._running[job_type] >= self.limits[job_type]:
+                job.check_cancelled()
+                self._slot_freed.wait(poll_s)
+            job.check_cancelled()
+            self._running[job_type] += 1
+
+    def release_slot(self, job: Job):
+        with self._slot_freed:
+            self._running[self._records[job.id]["type"]] -= 1
+            self._slot_freed.notify_all()
+        self._dispatch()
+
+    def get(self, job_id: str):
+        with self._lock:
+            record = self._records.get(job_id)
+            return dict(record) if record is not None else None
+
+    def handle(self, job_id: str):
+        with self._lock:
+            return self._handles.get(job_id)
+
+    def list(self, job_type: str = None):
+        self.cleanup_artifacts()
+        with self._lock:
+            records = [dict(r) for r in self._records.values() if job_type is None or r["type"] == job_type]
+        return sorted(records, key=lambda r: r["created"], reverse=True)
+
+    def stats(self):
+        with self._lock:
+            queued = {}
+            for job, _ in self._queue:
+                job_type = self._records[job.id]["type"]
+                queued[job_type] = queued.get(job_type, 0) + 1
+            return {"running": dict(self._running), "queued": queued, "limits": dict(self.limits)}
+
+    def cancel(self, job_id: str) -> bool:
+        """Queued jobs are dropped, running ones stop at their next progress/cancellation check."""
+        with self._lock:
+            record = self._records.get(job_id)
+            if record is None or record["status"] in FINISHED_STATES:
+                return False
+            job = self._handles[job_id]
+            job.cancel_event.set()
+            self._unclaimed.pop(job_id, None)
+            queued = [item for item in self._queue if item[0] is job]
+            for item in queued:
+                self._queue.remove(item)
+        if queued or record["status"] == "pending":
+            job.update(message="Cancelled")
+            job.finish("cancelled")
+        return True
+
+    def _remove_artifacts(self, job_id):
+        with self._lock:
+            artifacts = list(self._records[job_id]["artifacts"])
+        for path in artifacts:
+            if self.keep_artifact(path):
+                continue
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                print(f"Error removing job artifact {path}: {e}")
+
+    def cleanup_artifacts(self, now: float = None):
+        """
+        Deletes records and artifacts of jobs that finished more than artifact_ttl_s ago, and
+        marks create() jobs still unclaimed after pending_ttl_s as interrupted.
+        """
+        now = now or time.time()
+        with self._lock:
+            orphaned = [job_id for job_id, created in self._unclaimed.items() if now - created > self.pending_ttl_s]
+            for job_id in orphaned:
+                del self._unclaimed[job_id]
+                self._handles[job_id].cancel_event.set()
+        for job_id in orphaned:
+            self._update(job_id, {"status": "interrupted", "error": "Nothing picked the job up",
+                                  "message": "Interrupted", "finished": now}, force=True)
+        with self._lock:
+            expired = [
+                job_id for job_id, r in self._records.items()
+                if r["status"] in FINISHED_STATES and now - (r["finished"] or r["created"]) > self.artifact_ttl_s
+            ]
+        for job_id in expired:
+            self._remove_artifacts(job_id)
+            with self._lock:
+                self._records.pop(job_id, None)
+                self._handles.pop(job_id, None)
+        if expired:
+            self._save(force=True)
+        return len(expired)
+
+    def shutdown(self):
+        with self._lock:
+            for job, _ in self._queue:
+                job.cancel_event.set()
+            for job in self._handles.values():
+                job.cancel_event.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._save(force=True)
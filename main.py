@@ -6,14 +6,24 @@ from typing import List, Dict, Optional
 from contextlib import asynccontextmanager
 import time
 import threading
+import asyncio
 
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import uvicorn
 import video_processor
 import detector_wrapper
+import image_index
+import image_pyramid
+import region_reader
+import export_engine
+import shard_export
+import job_scheduler
+import cancellation
+import inference_scheduler
 
 import zipfile
 import io
@@ -27,10 +37,49 @@ import webbrowser
 DATA_DIR = os.path.join(os.getcwd(), "data")
 IMAGES_DIR = os.path.join(DATA_DIR, "images")
 ANNOTATIONS_FILE = os.path.join(DATA_DIR, "annotations.json")
+IMAGE_INDEX_FILE = os.path.join(DATA_DIR, "image_index.json")
+PYRAMIDS_DIR = os.path.join(DATA_DIR, "pyramids")
+EXPORT_MANIFEST_FILE = os.path.join(DATA_DIR, "export_manifest.json")
+JOBS_FILE = os.path.join(DATA_DIR, "jobs.json")
+REGION_CACHE_DIR = os.path.join(DATA_DIR, "region_cache")
+# Threads reading/compressing archive members ahead of the zip writer
+EXPORT_WORKERS = min(8, os.cpu_count() or 1)
+# Concurrent jobs per type; anything beyond waits in the scheduler queue
+JOB_LIMITS = {"export": 1, "extract": 1, "annotate": 1}
+# Finished jobs (and their export zips / shard directories) are dropped after a day
+JOB_ARTIFACT_TTL_S = 24 * 3600
+# A streamed export whose download never starts is marked interrupted after this long
+JOB_PENDING_TTL_S = 15 * 60
+# Streamed exports also write the archive to data/export_{id}.zip while sending it, so a
+# delivered stream that cleared the dataset can be recovered (off: nothing is staged on disk)
+EXPORT_STREAM_COPY = os.environ.get("EXPORT_STREAM_COPY", "0") == "1"
+# Directory and shard exports are only written below this directory (symlinks resolved)
+EXPORT_ROOT = os.path.realpath(os.environ.get("EXPORT_ROOT", os.path.join(DATA_DIR, "exports")))
 
 # Ensure directories exist
 os.makedirs(IMAGES_DIR, exist_ok=True)
 
+# Content digests of the last export per format, for delta exports and member reuse
+export_manifest = export_engine.ExportManifest(EXPORT_MANIFEST_FILE)
+
+# Persistent records + bounded pool for exports, video extraction and batch annotation
+jobs = job_scheduler.JobScheduler(
+    JOBS_FILE, JOB_LIMITS, artifact_ttl_s=JOB_ARTIFACT_TTL_S, pending_ttl_s=JOB_PENDING_TTL_S,
+    keep_artifact=lambda path: path in export_manifest.archive_paths()
+)
+
+# Metadata index (dimensions, size, mtime, hash, format) filled at ingest
+images_index = image_index.ImageIndex(IMAGES_DIR, IMAGE_INDEX_FILE)
+
+# Background previews + tile pyramids for very large images, keyed by content hash
+pyramids = image_pyramid.PyramidService(PYRAMIDS_DIR, IMAGES_DIR, cache_dir=REGION_CACHE_DIR)
+
+def clear_image_caches():
+    """Drops everything derived from the images directory (index, pyramids, raw region cache)."""
+    images_index.clear()
+    pyramids.clear()
+    region_reader.clear_cache(REGION_CACHE_DIR)
+
 # Startup: Clear data
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -44,6 +93,7 @@ async def lifespan(app: FastAPI):
                     os.unlink(file_path)
             except Exception as e:
                 print(f"Error deleting {file_path}: {e}")
+    clear_image_caches()
     
     # Reset annotations
     with open(ANNOTATIONS_FILE, 'w') as f:
@@ -51,6 +101,9 @@ async def lifespan(app: FastAPI):
     print("Session data cleared.")
     
     yield
+    jobs.shutdown()
+    if detector_wrapper.DetectorWrapper._instance is not None:
+        detector_wrapper.DetectorWrapper._instance.speculative.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -85,17 +138,31 @@ class ImageAnnotations(BaseModel):
 MODEL_DIR = os.path.join(DATA_DIR, "models")
 os.makedirs(MODEL_DIR, exist_ok=True)
 
+# Serializes read-modify-write of annotations.json between requests and background jobs
+annotations_lock = threading.Lock()
+
 class AutoAnnotateRequest(BaseModel):
     image_name: str
     text_prompt: Optional[str] = None
     confidence_thresh: float = 0.35
-    model_type: str = "countgd" # countgd, yolo, rfdetr
+    model_type: str = "countgd" # countgd, countgd_onnx, yolo, rfdetr
     model_filename: Optional[str] = None
     selected_classes: Optional[List[int]] = None
     tiled: bool = False # Enable Tiled Inference (sahi/slicer)
+    adaptive_quality: bool = True # Lower resolution/tiles/queries when the model queue backs up
+    target_latency_s: Optional[float] = None # Default: 2x the unloaded latency
+    progressive: bool = False # Stream a fast preview first, then the full-quality boxes (NDJSON)
+
+async def cancel_on_disconnect(request: Request, token: cancellation.CancellationToken, poll_s: float = 0.2):
+    """Fires the token once the client goes away (tab closed, fetch aborted on image switch)."""
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel("client disconnected")
+            return
+        await asyncio.sleep(poll_s)
 
 @app.post("/api/auto_annotate")
-async def auto_annotate(req: AutoAnnotateRequest):
+async def auto_annotate(req: AutoAnnotateRequest, request: Request):
     img_path = os.path.join(IMAGES_DIR, req.image_name)
     if not os.path.exists(img_path):
         raise HTTPException(status_code=404, detail="Image not found")
@@ -104,22 +171,219 @@ async def auto_annotate(req: AutoAnnotateRequest):
     if req.model_filename:
         model_path = os.path.join(MODEL_DIR, req.model_filename)
         
+    detector = detector_wrapper.DetectorWrapper.get_instance()
+    # The last interactive parameters are what upcoming images get annotated with ahead of time
+    params = dict(
+        model_type=req.model_type,
+        model_path=model_path,
+        text_prompt=req.text_prompt,
+        confidence=req.confidence_thresh,
+        selected_classes=req.selected_classes,
+        tiled=req.tiled,
+    )
+    detector.speculative.set_params(params)
+    cached = detector.speculative.take(img_path, params)
+    if cached is not None:
+        result = {"boxes": cached, "count": len(cached), "quality": {"level": 0, "name": "full", "speculative": True}}
+        if req.progressive:
+            return StreamingResponse(iter([json.dumps({"stage": "final", **result}) + "\n"]),
+                                     media_type="application/x-ndjson")
+        return result
+
+    if req.progressive:
+        return StreamingResponse(progressive_annotate(req, img_path, model_path, request),
+                                 media_type="application/x-ndjson")
+
+    token = cancellation.CancellationToken()
+    watcher = asyncio.create_task(cancel_on_disconnect(request, token))
+    try:
+        # Off the event loop: the call may wait for the model behind a batch image/tile
+        if req.adaptive_quality:
+            new_boxes, quality = await run_in_threadpool(
+                detector.run_adaptive,
+                image_path=img_path,
+                model_type=req.model_type,
+                model_path=model_path,
+                text_prompt=req.text_prompt,
+                confidence=req.confidence_thresh,
+                selected_classes=req.selected_classes,
+                tiled=req.tiled,
+                target_latency_s=req.target_latency_s,
+                cancel_token=token
+            )
+        else:
+            adapted = {}
+            new_boxes = await run_in_threadpool(
+                detector.run_inference,
+                image_path=img_path, 
+                model_type=req.model_type,
+                model_path=model_path,
+                text_prompt=req.text_prompt, 
+                confidence=req.confidence_thresh,
+                selected_classes=req.selected_classes,
+                tiled=req.tiled,
+                lane=detector_wrapper.LANE_INTERACTIVE,
+                cancel_token=token,
+                stats=adapted
+            )
+            quality = {"level": 0, "name": "full", "adapted": adapted}
+        
+        return {"boxes": new_boxes, "count": len(new_boxes), "quality": quality}
+    except cancellation.OperationCancelled as e:
+        print(f"Auto-annotation for {req.image_name} cancelled: {e}")
+        # Nobody is listening any more; 499 = client closed request
+        return JSONResponse(status_code=499, content={"detail": str(e)})
+    except Exception as e:
+        print(f"Auto-annotation failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        watcher.cancel()
+
+async def progressive_annotate(req: AutoAnnotateRequest, img_path: str, model_path: str, request: Request):
+    """
+    NDJSON stream for progressive auto-annotate: a "preview" line from a fast low-resolution,
+    untiled pass (interactive lane), then a "final" line from the full-quality pass, which runs
+    in the batch lane so other users' previews go first. Closing the stream (image switch)
+    cancels the refinement; the client keeps the preview boxes then.
+    """
+    token = cancellation.CancellationToken()
+    watcher = asyncio.create_task(cancel_on_disconnect(request, token))
+    detector = detector_wrapper.DetectorWrapper.get_instance()
+    common = dict(
+        image_path=img_path,
+        model_type=req.model_type,
+        model_path=model_path,
+        text_prompt=req.text_prompt,
+        confidence=req.confidence_thresh,
+        selected_classes=req.selected_classes,
+        tiled=req.tiled,
+        cancel_token=token,
+    )
     try:
+        boxes, quality = await run_in_threadpool(
+            detector.run_adaptive,
+            target_latency_s=req.target_latency_s,
+            min_level=inference_scheduler.PREVIEW_LEVEL,
+            **common
+        )
+        # Models without resolution/query knobs may already have run at full quality
+        stage = "final" if quality["level"] == 0 else "preview"
+        yield json.dumps({"stage": stage, "boxes": boxes, "count": len(boxes), "quality": quality}) + "\n"
+        if stage == "final":
+            return
+
+        adapted = {}
+        boxes = await run_in_threadpool(detector.run_inference, lane=detector_wrapper.LANE_BATCH, stats=adapted,
+                                        **common)
+        quality = {"level": 0, "name": "full", "adapted": adapted}
+        yield json.dumps({"stage": "final", "boxes": boxes, "count": len(boxes), "quality": quality}) + "\n"
+    except cancellation.OperationCancelled as e:
+        print(f"Progressive auto-annotation for {req.image_name} cancelled: {e}")
+    except Exception as e:
+        print(f"Progressive auto-annotation failed: {e}")
+        yield json.dumps({"stage": "error", "detail": str(e)}) + "\n"
+    finally:
+        # Also stops the worker thread if the server dropped the stream itself
+        token.cancel("stream closed")
+        watcher.cancel()
+
+class SpeculateRequest(BaseModel):
+    image_names: List[str] # Upcoming images, nearest first; [] stops speculative work
+
+@app.post("/api/speculate")
+async def speculate(req: SpeculateRequest):
+    """Queues upcoming images for background auto-annotation with the last-used model and prompt."""
+    paths = []
+    for name in req.image_names:
+        path = os.path.join(IMAGES_DIR, name)
+        if os.path.exists(path):
+            paths.append(path)
+    queued = detector_wrapper.DetectorWrapper.get_instance().speculative.schedule(paths)
+    return {"queued": queued}
+
+@app.get("/api/inference/stats")
+async def get_inference_stats():
+    """Per-lane queue depth and wait times of the model gate, plus quality levels chosen under load."""
+    detector = detector_wrapper.DetectorWrapper.get_instance()
+    stats = detector.gate.stats()
+    stats["admission"] = detector.admission.stats()
+    stats["speculative"] = detector.speculative.stats()
+    compiled = getattr(detector.countgd_model, "compiled_inference", None)
+    stats["compiled"] = compiled.stats() if compiled is not None else None
+    stats["onnx"] = detector.countgd_onnx.stats() if detector.countgd_onnx is not None else None
+    return stats
+
+class AutoAnnotateAllRequest(BaseModel):
+    text_prompt: Optional[str] = None
+    confidence_thresh: float = 0.35
+    model_type: str = "countgd"
+    model_filename: Optional[str] = None
+    selected_classes: Optional[List[int]] = None
+    tiled: bool = False
+    image_names: Optional[List[str]] = None # Default: every indexed image
+
+# Annotations are flushed to disk every N images instead of rewriting the file per image
+BATCH_FLUSH_EVERY = 20
+
+def append_annotations(new_boxes: Dict[str, list]):
+    """Appends boxes for several images in one read-modify-write of annotations.json."""
+    if not new_boxes:
+        return
+    with annotations_lock:
+        with open(ANNOTATIONS_FILE, 'r') as f:
+            all_data = json.load(f)
+        for image_name, boxes in new_boxes.items():
+            all_data.setdefault(image_name, []).extend(boxes)
+        with open(ANNOTATIONS_FILE, 'w') as f:
+            json.dump(all_data, f)
+
+def run_batch_annotate_task(job: job_scheduler.Job, req: AutoAnnotateAllRequest):
+    """Background task running auto-annotation over many images (decode prefetched)"""
+    pending = {}
+    try:
+        image_names = req.image_names or images_index.names()
+        image_paths = [os.path.join(IMAGES_DIR, n) for n in image_names]
+        job["total"] = len(image_paths)
+        
+        model_path = os.path.join(MODEL_DIR, req.model_filename) if req.model_filename else None
         detector = detector_wrapper.DetectorWrapper.get_instance()
-        new_boxes = detector.run_inference(
-            image_path=img_path, 
+        
+        for image_path, boxes, error in detector.run_inference_batch(
+            image_paths,
             model_type=req.model_type,
             model_path=model_path,
-            text_prompt=req.text_prompt, 
+            text_prompt=req.text_prompt,
             confidence=req.confidence_thresh,
             selected_classes=req.selected_classes,
-            tiled=req.tiled
-        )
+            tiled=req.tiled,
+            cancel_token=job.token
+        ):
+            img_name = os.path.basename(image_path)
+            job.progress(job["current"] + 1, message=f"Processing {job['current'] + 1}/{job['total']}: {img_name}")
+            if error is not None:
+                print(f"Batch annotation failed for {img_name}: {error}")
+                job["errors"] = job["errors"] + [img_name]
+                continue
+            
+            pending[img_name] = boxes
+            job["boxes"] += len(boxes)
+            if len(pending) >= BATCH_FLUSH_EVERY:
+                append_annotations(pending)
+                pending = {}
         
-        return {"boxes": new_boxes, "count": len(new_boxes)}
-    except Exception as e:
-        print(f"Auto-annotation failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        job["message"] = "Done!"
+    finally:
+        # Boxes found before a failure or cancel are kept
+        append_annotations(pending)
+
+@app.post("/api/auto_annotate_all/start")
+async def start_auto_annotate_all(req: AutoAnnotateAllRequest):
+    job = jobs.submit("annotate", lambda job: run_batch_annotate_task(job, req), boxes=0, errors=[])
+    return {"job_id": job.id}
+
+@app.get("/api/auto_annotate_all/status/{job_id}")
+async def get_auto_annotate_all_status(job_id: str):
+    return await get_job(job_id)
 
 @app.post("/api/upload_model")
 async def upload_model(
@@ -184,37 +448,52 @@ async def load_model_classes(req: ModelClassesRequest):
         return {"classes": [], "error": str(e)}
 
 
-@app.post("/api/upload_video")
-async def upload_video(file: UploadFile = File(...), fps: float = Form(1.0)):
-    temp_path = os.path.join(DATA_DIR, "temp_video.mp4")
+def run_extract_task(job: job_scheduler.Job, video_path: str, fps: float, prefix: str):
+    """Background task extracting frames from an uploaded video into the workspace"""
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
         # Clear existing images for a fresh start? 
         # For this simple tool, let's clear previous images when a new video is uploaded
         for f in os.listdir(IMAGES_DIR):
             os.remove(os.path.join(IMAGES_DIR, f))
-            
-        # Use filename as prefix
-        prefix = "frame"
-        if file.filename:
-            # Sanitize: remove extension and weird chars
-            clean_name = os.path.splitext(file.filename)[0]
-            clean_name = "".join([c if c.isalnum() else "_" for c in clean_name])
-            if clean_name:
-                prefix = clean_name
-            
-        count = video_processor.extract_frames(temp_path, IMAGES_DIR, fps, prefix=prefix)
+        clear_image_caches()
+
+        job["message"] = "Extracting frames..."
+        count = video_processor.extract_frames(
+            video_path, IMAGES_DIR, fps, prefix=prefix,
+            progress=lambda current, total: job.progress(current, total, f"Extracted {current}/{total} frames")
+        )
+        pyramids.schedule(images_index.sync())
         
         # Reset annotations
         with open(ANNOTATIONS_FILE, 'w') as f:
             json.dump({}, f)
-            
-        return {"message": f"Extracted {count} frames", "count": count}
+
+        job["count"] = count
+        job["message"] = f"Extracted {count} frames"
     finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        if os.path.exists(video_path):
+            os.remove(video_path)
+
+@app.post("/api/upload_video")
+async def upload_video(file: UploadFile = File(...), fps: float = Form(1.0)):
+    # Unique name per upload, extraction jobs may be queued behind each other
+    temp_path = os.path.join(DATA_DIR, f"temp_video_{uuid.uuid4().hex}{os.path.splitext(file.filename or '')[1] or '.mp4'}")
+    with open(temp_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+    # Use filename as prefix
+    prefix = "frame"
+    if file.filename:
+        # Sanitize: remove extension and weird chars
+        clean_name = os.path.splitext(file.filename)[0]
+        clean_name = "".join([c if c.isalnum() else "_" for c in clean_name])
+        if clean_name:
+            prefix = clean_name
+
+    # Also an artifact (from the start) so a cancelled/queued-then-dropped job does not leave the upload behind
+    job = jobs.submit("extract", lambda job: run_extract_task(job, temp_path, fps, prefix),
+                      artifacts=[temp_path], count=0)
+    return {"job_id": job.id, "message": "Extraction started"}
 
 @app.post("/api/upload_images")
 async def upload_images_folder(files: List[UploadFile] = File(...), clear_existing: bool = True):
@@ -223,8 +502,9 @@ async def upload_images_folder(files: List[UploadFile] = File(...), clear_existi
         print("Clearing existing images...")
         for f in os.listdir(IMAGES_DIR):
             os.remove(os.path.join(IMAGES_DIR, f))
+        clear_image_caches()
         
-    count = 0
+    saved_names = []
     for file in files:
         if file.filename:
             # Flatten path (ignore folder structure)
@@ -236,7 +516,11 @@ async def upload_images_folder(files: List[UploadFile] = File(...), clear_existi
             path = os.path.join(IMAGES_DIR, filename)
             with open(path, "wb") as buffer:
                 shutil.copyfileobj(file.file, buffer)
-            count += 1
+            saved_names.append(filename)
+    
+    # Index the new batch in parallel (header decode + hash)
+    pyramids.schedule(images_index.add(saved_names))
+    count = len(saved_names)
     
     # Reset annotations
     with open(ANNOTATIONS_FILE, 'w') as f:
@@ -246,8 +530,58 @@ async def upload_images_folder(files: List[UploadFile] = File(...), clear_existi
 
 @app.get("/api/images")
 async def get_images():
-    images = video_processor.list_images(IMAGES_DIR)
-    return {"images": images}
+    entries = images_index.entries()
+    images = [e["name"] for e in entries]
+    metadata = {e["name"]: {"width": e["width"], "height": e["height"], "format": e["format"]} for e in entries}
+    return {"images": images, "metadata": metadata}
+
+@app.get("/api/images/{image_name}/pyramid")
+async def get_image_pyramid(image_name: str):
+    """Describes the preview/tiles available for an image (not cached, status may change)."""
+    entry = images_index.get(image_name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    content_hash = entry["hash"]
+    descriptor = pyramids.descriptor(content_hash)
+    return JSONResponse(
+        {
+            "hash": content_hash,
+            "width": entry["width"],
+            "height": entry["height"],
+            "ready": descriptor is not None,
+            "pending": pyramids.is_pending(content_hash),
+            "descriptor": descriptor,
+        },
+        headers={"Cache-Control": "no-cache"},
+    )
+
+# Pyramid files are content addressed, so they never change under the same URL
+PYRAMID_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def serve_pyramid_file(request: Request, content_hash: str, rel_path: str, etag: str):
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": PYRAMID_CACHE_CONTROL})
+    try:
+        path = os.path.join(pyramids.pyramid_dir(content_hash), rel_path)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Pyramid not found")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Pyramid not found")
+    return FileResponse(
+        path,
+        media_type="image/jpeg",
+        headers={"ETag": etag, "Cache-Control": PYRAMID_CACHE_CONTROL},
+    )
+
+@app.get("/api/pyramids/{content_hash}/preview.jpg")
+async def get_pyramid_preview(content_hash: str, request: Request):
+    return serve_pyramid_file(request, content_hash, "preview.jpg", f'"{content_hash}-preview"')
+
+@app.get("/api/pyramids/{content_hash}/{level}/{col}_{row}.jpg")
+async def get_pyramid_tile(content_hash: str, level: int, col: int, row: int, request: Request):
+    rel_path = os.path.join("tiles", str(level), f"{col}_{row}.jpg")
+    return serve_pyramid_file(request, content_hash, rel_path, f'"{content_hash}-{level}-{col}-{row}"')
 
 @app.get("/api/annotations/{image_name}")
 async def get_annotations(image_name: str):
@@ -261,13 +595,14 @@ async def save_annotations(data: ImageAnnotations):
     for b in data.boxes:
         print(f" - Box ID: {b.id}, Label: {b.label}")
 
-    with open(ANNOTATIONS_FILE, 'r') as f:
-        all_data = json.load(f)
-    
-    all_data[data.image_name] = [box.dict() for box in data.boxes]
-    
-    with open(ANNOTATIONS_FILE, 'w') as f:
-        json.dump(all_data, f)
+    with annotations_lock:
+        with open(ANNOTATIONS_FILE, 'r') as f:
+            all_data = json.load(f)
+        
+        all_data[data.image_name] = [box.dict() for box in data.boxes]
+        
+        with open(ANNOTATIONS_FILE, 'w') as f:
+            json.dump(all_data, f)
     return {"status": "success"}
 
 @app.post("/api/reset_dataset")
@@ -279,6 +614,7 @@ async def reset_dataset():
             file_path = os.path.join(IMAGES_DIR, filename)
             if os.path.isfile(file_path):
                 os.remove(file_path)
+        clear_image_caches()
         
         # Reset annotations
         with open(ANNOTATIONS_FILE, 'w') as f:
@@ -288,230 +624,187 @@ async def reset_dataset():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Basic in-memory job store
-export_jobs = {}
-
-def run_export_task(job_id: str, export_format: str = "coco"):
+def make_export_engine(job: job_scheduler.Job, export_format: str):
+    with open(ANNOTATIONS_FILE, 'r') as f:
+        all_annotations = json.load(f)
+
+    base_members, base_export_id = None, None
+    if job.get("delta"):
+        last = export_manifest.last(export_format)
+        # Without a previous export a delta is simply everything
+        base_members = last["members"] if last else {}
+        base_export_id = last["export_id"] if last else None
+
+    # Dimensions and dates come from the ingest-time index, no image is opened here
+    # job.progress is also where a cancelled export stops
+    engine = export_engine.ExportEngine(
+        IMAGES_DIR, images_index.entries(), all_annotations,
+        export_format=export_format, workers=EXPORT_WORKERS, progress=job.progress,
+        base_members=base_members, base_export_id=base_export_id,
+        donor=export_manifest.donor(export_format)
+    )
+    job["total"] = engine.total
+    return engine
+
+def run_export_task(job: job_scheduler.Job):
     """Background task to generate export zip"""
+    export_format = job["format"]
+    engine = make_export_engine(job, export_format)
+
+    if export_format in shard_export.SHARD_FORMATS:
+        # Training-ready shards always go to a directory, never into a zip
+        job["shards"] = shard_export.write_shards(
+            engine, job["output_dir"], shard_format=export_format, shard_size_mb=job["shard_size_mb"],
+            check_cancelled=job.check_cancelled
+        )
+        job["message"] = f"Wrote {len(job['shards'])} shards to {job['output_dir']}"
+        return
+
+    if job["target"] == "directory":
+        # Training on the same machine: no archive, images are linked into place
+        job["link_methods"] = engine.write_directory(job["output_dir"], link_mode=job["link_mode"])
+        export_manifest.record(export_format, job.id, engine.members)
+        job["message"] = f"Exported to {job['output_dir']}"
+        return
+
+    zip_filename = f"export_{job.id}.zip"
+    zip_path = os.path.join(DATA_DIR, zip_filename)
+    job.add_artifact(zip_path)
+    with open(zip_path, 'wb') as f:
+        engine.write(f)
+    # A full archive becomes the donor for the next export, a delta one cannot be
+    export_manifest.record(export_format, job.id, engine.members,
+                           archive_path=None if engine.is_delta else zip_path)
+
+    job["file_path"] = zip_path
+    job["message"] = "Done!"
+
+def stream_export_task(job: job_scheduler.Job):
+    """
+    Builds the export zip while it is being downloaded; nothing is staged on disk unless
+    EXPORT_STREAM_COPY keeps a copy in data/export_{id}.zip (to recover a cleared dataset or
+    download again). Waits for an export slot before the first byte, so streamed and queued
+    exports share JOB_LIMITS["export"].
+    """
+    slot = False
+    recovery = None
     try:
-        job = export_jobs[job_id]
-        job["status"] = "processing"
-        
-        with open(ANNOTATIONS_FILE, 'r') as f:
-            all_annotations = json.load(f)
-        
-        coco = {
-            "info": {
-                "year": str(datetime.datetime.now().year),
-                "version": "1.0",
-                "description": "Exported Dataset",
-                "contributor": "",
-                "url": "",
-                "date_created": datetime.datetime.now().isoformat()
-            },
-            "licenses": [
-                {
-                    "id": 1,
-                    "url": "https://creativecommons.org/licenses/by/4.0/",
-                    "name": "CC BY 4.0"
-                }
-            ],
-            "categories": [],
-            "images": [],
-            "annotations": []
-        }
-        
-        # Pre-seed category map to match specific model requirements
-        # User defined: 0=person, 1=animal
-        category_map = {"person": 0, "animal": 1}
-        next_cat_id = 2
-        
-        image_id = 0 
-        ann_id = 0
-        
-        images_list = video_processor.list_images(IMAGES_DIR)
-        job["total"] = len(images_list)
-        
-        valid_images = []
-        
-        processed_count = 0
-
-        for img_name in images_list:
-            # Update progress periodically
-            processed_count += 1
-            if processed_count % 10 == 0:
-                job["current"] = processed_count
-                job["message"] = f"Processing image {processed_count}/{job['total']}"
-            
-            img_path = os.path.join(IMAGES_DIR, img_name)
-            if not os.path.exists(img_path):
-                continue
-                
-            # Use PIL for lazy loading of dimensions (much faster than cv2.imread)
-            try:
-                with Image.open(img_path) as img:
-                    w, h = img.size
-            except Exception:
-                continue
-
-            # File date
-            mtime = os.path.getmtime(img_path)
-            dt = datetime.datetime.fromtimestamp(mtime)
-            date_captured = dt.strftime('%Y-%m-%d %H:%M:%S')
-
-            valid_images.append(img_path)
-
-            coco["images"].append({
-                "id": image_id,
-                "license": 1,
-                "file_name": img_name,
-                "height": h,
-                "width": w,
-                "date_captured": date_captured,
-                "extra": {
-                    "name": img_name
-                }
-            })
-            
-            # Add annotations
-            if img_name in all_annotations:
-                for box in all_annotations[img_name]:
-                    label = box.get("label", "object")
-                    if label not in category_map:
-                        category_map[label] = next_cat_id
-                        next_cat_id += 1
-                    
-                    cat_id = category_map[label]
-                    
-                    # COCO box format: [x, y, width, height]
-                    coco["annotations"].append({
-                        "id": ann_id,
-                        "image_id": image_id,
-                        "category_id": cat_id,
-                        "bbox": [box["x"], box["y"], box["width"], box["height"]],
-                        "area": box["width"] * box["height"],
-                        "iscrowd": 0,
-                        "segmentation": [] 
-                    })
-                    ann_id += 1
-            
-            image_id += 1
-            
-        # Update categories in mapping if they were only found in YOLO or added default
-        coco_categories = []
-        for name, cid in category_map.items():
-            coco_categories.append({
-                "id": cid, 
-                "name": name, 
-                "supercategory": "Object"
-            })
-        
-        # If empty
-        if not coco_categories:
-             pass 
-            
-        coco["categories"] = coco_categories
-        
-        # Create Zip
-        job["message"] = "Compressing archive..."
-        zip_filename = f"export_{job_id}.zip"
-        zip_path = os.path.join(DATA_DIR, zip_filename)
-        
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            if export_format == "yolo":
-                # Write classes.txt and data.yaml at the root
-                classes_lines = []
-                # Sort categories by ID to ensure correct order
-                sorted_cats = sorted(category_map.items(), key=lambda x: x[1])
-                for name, _ in sorted_cats:
-                    classes_lines.append(name)
-                zipf.writestr("classes.txt", "\n".join(classes_lines))
-                
-                yaml_content = []
-                yaml_content.append("train: train/images")
-                yaml_content.append("val: ''  # No validation set provided")
-                yaml_content.append(f"nc: {len(classes_lines)}")
-                yaml_content.append(f"names: {json.dumps(classes_lines)}")
-                zipf.writestr("data.yaml", "\n".join(yaml_content))
-                
-                # Write images and labels inside train/ folder
-                for img_path in valid_images:
-                    img_name = os.path.basename(img_path)
-                    zipf.write(img_path, arcname=posixpath.join("train", "images", img_name))
-                    
-                    # Write label file if it exists
-                    label_filename = os.path.splitext(img_name)[0] + ".txt"
-                    if img_name in all_annotations:
-                        # Fetch image dimensions safely, but don't skip the whole item if PIL fails
-                        # We previously cached dimensions or default to fake values to avoid skipping exports
-                        w, h = 1, 1 # default
-                        try:
-                            with Image.open(img_path) as img:
-                                w, h = img.size
-                        except Exception:
-                            pass
-                        
-                        yolo_lines = []
-                        for box in all_annotations[img_name]:
-                            label = box.get("label", "object")
-                            cat_id = category_map[label]
-                            
-                            # Normalize
-                            norm_x_center = (box["x"] + box["width"] / 2.0) / w
-                            norm_y_center = (box["y"] + box["height"] / 2.0) / h
-                            norm_width = box["width"] / w
-                            norm_height = box["height"] / h
-                            
-                            yolo_lines.append(f"{cat_id} {norm_x_center:.6f} {norm_y_center:.6f} {norm_width:.6f} {norm_height:.6f}")
-                            
-                        if yolo_lines:
-                            zipf.writestr(posixpath.join("train", "labels", label_filename), "\n".join(yolo_lines))
-                    else:
-                        # Write empty label file
-                        zipf.writestr(posixpath.join("train", "labels", label_filename), "")
-            else:
-                # COCO format
-                json_str = json.dumps(coco, indent=4)
-                zipf.writestr("_annotations.coco.json", json_str)
-                for img_path in valid_images:
-                    zipf.write(img_path, arcname=os.path.join("images", os.path.basename(img_path)))
-                
+        job["message"] = "Waiting for a running export to finish..."
+        jobs.acquire_slot(job)
+        slot = True
+        job.start()
+        engine = make_export_engine(job, job["format"])
+        zip_path = None
+        if EXPORT_STREAM_COPY:
+            zip_path = os.path.join(DATA_DIR, f"export_{job.id}.zip")
+            job.add_artifact(zip_path)
+            recovery = open(zip_path, 'wb')
+        for chunk in export_engine.stream_zip(engine):
+            if recovery is not None:
+                recovery.write(chunk)
+            yield chunk
+        if recovery is not None:
+            recovery.close()
+        export_manifest.record(job["format"], job.id, engine.members,
+                               archive_path=None if engine.is_delta else zip_path)
         job["file_path"] = zip_path
-        job["status"] = "completed"
-        job["current"] = job["total"]
-        job["message"] = "Done!"
-        
+    except (job_scheduler.JobCancelled, GeneratorExit):
+        # Cancelled via the job API, or the client dropped the download
+        job.finish("cancelled")
+        raise
     except Exception as e:
-        print(f"Export Job {job_id} failed: {e}")
-        job["status"] = "failed"
-        job["error"] = str(e)
+        print(f"Export Job {job.id} failed: {e}")
+        job.finish("failed", error=str(e))
+        raise
+    finally:
+        if recovery is not None:
+            recovery.close()
+        if slot:
+            jobs.release_slot(job)
+
+    # Only a fully delivered archive clears the dataset, an aborted download keeps everything
+    if job["clear_after_download"]:
+        cleanup_after_export(None)
+    job["message"] = "Done!"
+    job.finish("completed")
 
 
 @app.post("/api/export/start")
-async def start_export(format: str = "coco"):
-    job_id = str(uuid.uuid4())
-    export_jobs[job_id] = {
-        "id": job_id,
-        "status": "pending",
-        "total": 0,
-        "current": 0,
-        "message": "Starting...",
+async def start_export(format: str = "coco", stream: bool = False, delta: bool = False,
+                       clear_after_download: bool = True, target: str = "zip",
+                       path: Optional[str] = None, link_mode: str = "auto",
+                       shard_size_mb: int = shard_export.DEFAULT_SHARD_SIZE_MB):
+    shard_dir = None
+    if format in shard_export.SHARD_FORMATS:
+        target = "directory"
+        if not path:
+            shard_dir = path = os.path.join(EXPORT_ROOT, f"shards_{uuid.uuid4()}")
+        if format == "parquet" and shard_export.pq is None:
+            raise HTTPException(status_code=400, detail="Parquet export needs pyarrow")
+        if shard_size_mb <= 0:
+            raise HTTPException(status_code=400, detail="shard_size_mb must be positive")
+        if delta:
+            raise HTTPException(status_code=400, detail="Shard exports are always full, delta is not supported")
+    if target not in ("zip", "directory"):
+        raise HTTPException(status_code=400, detail=f"Unknown export target: {target}")
+    if target == "directory":
+        if not path:
+            raise HTTPException(status_code=400, detail="Directory export needs a path")
+        # Relative paths are taken from EXPORT_ROOT; nothing may resolve outside of it
+        path = os.path.realpath(os.path.join(EXPORT_ROOT, path))
+        if os.path.commonpath([path, EXPORT_ROOT]) != EXPORT_ROOT or path == EXPORT_ROOT:
+            raise HTTPException(status_code=400, detail=f"Export directory must be inside {EXPORT_ROOT}")
+        if link_mode not in export_engine.LINK_MODES:
+            raise HTTPException(status_code=400, detail=f"Unknown link mode: {link_mode}")
+        if os.path.isdir(path) and os.listdir(path):
+            raise HTTPException(status_code=400, detail=f"Export directory {path} is not empty")
+
+    fields = {
         "file_path": None,
-        "error": None
+        "format": format,
+        "stream": stream and target == "zip",
+        # Delta exports only contain images/labels changed since the last export of this format
+        "delta": delta,
+        "clear_after_download": clear_after_download,
+        "target": target,
+        "output_dir": path if target == "directory" else None,
+        "link_mode": link_mode,
+        "shard_size_mb": shard_size_mb
     }
-    
-    thread = threading.Thread(target=run_export_task, args=(job_id, format))
-    thread.start()
-    
-    return {"job_id": job_id}
+
+    if fields["stream"]:
+        # The archive is produced by the download request itself
+        job = jobs.create("export", **fields)
+        return {"job_id": job.id, "stream": True}
+
+    # Generated shard directories belong to the job, a user-chosen directory does not
+    job = jobs.submit("export", run_export_task, artifacts=[shard_dir] if shard_dir else None, **fields)
+    return {"job_id": job.id}
 
 @app.get("/api/export/status/{job_id}")
 async def get_export_status(job_id: str):
-    if job_id not in export_jobs:
+    return await get_job(job_id)
+
+@app.get("/api/jobs")
+async def list_jobs(type: Optional[str] = None):
+    return {"jobs": jobs.list(type), "stats": jobs.stats()}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    record = jobs.get(job_id)
+    if record is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    return export_jobs[job_id]
+    return record
 
-def cleanup_after_export(zip_path: str):
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not jobs.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job already finished")
+    return {"status": "cancelling"}
+
+def cleanup_after_export(zip_path: Optional[str]):
     """Deletes the export zip and clears the dataset."""
     try:
         # 1. Delete the zip file - DISABLED to allow recovery
@@ -523,6 +816,7 @@ def cleanup_after_export(zip_path: str):
             file_path = os.path.join(IMAGES_DIR, filename)
             if os.path.isfile(file_path):
                 os.remove(file_path)
+        clear_image_caches()
                 
         # 3. Reset annotations
         with open(ANNOTATIONS_FILE, 'w') as f:
@@ -534,17 +828,30 @@ def cleanup_after_export(zip_path: str):
 
 @app.get("/api/export/download/{job_id}")
 async def download_export(job_id: str, background_tasks: BackgroundTasks):
-    if job_id not in export_jobs:
+    job = jobs.get(job_id)
+    if job is None or job["type"] != "export":
         raise HTTPException(status_code=404, detail="Job not found")
-        
-    job = export_jobs[job_id]
+
+    if job.get("stream") and job["status"] != "completed":
+        # Only the first download drives the stream (it may still wait for an export slot)
+        job = jobs.claim(job_id)
+        if job is None:
+            raise HTTPException(status_code=409, detail="Export stream already started")
+        job["stream_started"] = True
+        return StreamingResponse(
+            stream_export_task(job),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="dataset_export.zip"'}
+        )
+
     if job["status"] != "completed" or not job["file_path"] or not os.path.exists(job["file_path"]):
         raise HTTPException(status_code=404, detail="Export not ready or file missing")
     
     zip_path = job["file_path"]
     
-    # Schedule cleanup to run AFTER the response is sent
-    background_tasks.add_task(cleanup_after_export, zip_path)
+    # Schedule cleanup to run AFTER the response is sent (a delivered stream already cleared)
+    if job["clear_after_download"] and not job.get("stream"):
+        background_tasks.add_task(cleanup_after_export, zip_path)
     
     return FileResponse(zip_path, filename="dataset_export.zip", media_type="application/zip")
 
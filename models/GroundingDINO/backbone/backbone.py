@@ -45,6 +45,9 @@ class FrozenBatchNorm2d(torch.nn.Module):
         self.register_buffer("bias", torch.zeros(n))
         self.register_buffer("running_mean", torch.zeros(n))
         self.register_buffer("running_var", torch.ones(n))
+        # Set by fuse_for_inference
+        self.register_buffer("fused_scale", None, persistent=False)
+        self.register_buffer("fused_shift", None, persistent=False)
 
     def _load_from_state_dict(
         self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs
@@ -57,7 +60,15 @@ class FrozenBatchNorm2d(torch.nn.Module):
             state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs
         )
 
+    def fuse_for_inference(self):
+        """Precomputes the per-channel scale and shift; re-run after loading new statistics."""
+        scale = self.weight * (self.running_var + 1e-5).rsqrt()
+        self.fused_scale = scale.reshape(1, -1, 1, 1)
+        self.fused_shift = (self.bias - self.running_mean * scale).reshape(1, -1, 1, 1)
+
     def forward(self, x):
+        if self.fused_scale is not None:
+            return x * self.fused_scale + self.fused_shift
         # move reshapes to the beginning
         # to make it fuser-friendly
         w = self.weight.reshape(1, -1, 1, 1)
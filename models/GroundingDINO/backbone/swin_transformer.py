@@ -130,6 +130,44 @@ class WindowAttention(nn.Module):
 
         trunc_normal_(self.relative_position_bias_table, std=0.02)
         self.softmax = nn.Softmax(dim=-1)
+        # Set by fuse_for_inference: gathered bias, qkv with the q scale folded into its q rows
+        self.register_buffer("fused_bias", None, persistent=False)
+        self.register_buffer("fused_qkv_weight", None, persistent=False)
+        self.register_buffer("fused_qkv_bias", None, persistent=False)
+        # F.scaled_dot_product_attention instead of materializing the scores and softmax here
+        self.use_sdpa = True
+
+    def relative_position_bias(self):
+        """(nH, Wh*Ww, Wh*Ww) bias gathered from the table, precomputed once fused."""
+        if self.fused_bias is not None:
+            return self.fused_bias
+        relative_position_bias = self.relative_position_bias_table[
+            self.relative_position_index.view(-1)
+        ].view(
+            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1
+        )  # Wh*Ww,Wh*Ww,nH
+        return relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
+
+    def fuse_for_inference(self):
+        """
+        Inference only: caches the gathered relative position bias and a copy of qkv with the
+        q scale folded into its q rows; qkv itself is left alone. Re-run after loading weights.
+        """
+        with torch.no_grad():
+            self.fused_bias = self.relative_position_bias().detach().clone()
+            # Quantized (int8) qkv layers keep the runtime scale
+            if type(self.qkv) is nn.Linear:
+                q_scale = torch.ones(3 * self.dim, 1, dtype=self.qkv.weight.dtype, device=self.qkv.weight.device)
+                q_scale[: self.dim] = self.scale
+                self.fused_qkv_weight = self.qkv.weight * q_scale
+                if self.qkv.bias is not None:
+                    self.fused_qkv_bias = self.qkv.bias * q_scale[:, 0]
+
+    def _project_qkv(self, x):
+        """qkv(x), with the q rows already scaled once fused."""
+        if self.fused_qkv_weight is not None:
+            return F.linear(x, self.fused_qkv_weight, self.fused_qkv_bias)
+        return self.qkv(x)
 
     def forward(self, x, mask=None):
         """Forward function.
@@ -138,25 +176,35 @@ class WindowAttention(nn.Module):
             mask: (0/-inf) mask with shape of (num_windows, Wh*Ww, Wh*Ww) or None
         """
         B_, N, C = x.shape
+        q_scale_folded = self.fused_qkv_weight is not None
         qkv = (
-            self.qkv(x)
+            self._project_qkv(x)
             .reshape(B_, N, 3, self.num_heads, C // self.num_heads)
             .permute(2, 0, 3, 1, 4)
         )
         q, k, v = qkv[0], qkv[1], qkv[2]  # make torchscript happy (cannot use tensor as tuple)
 
-        q = q * self.scale
-        attn = q @ k.transpose(-2, -1)
+        if self.use_sdpa:
+            # Relative position bias and shift mask as one additive mask, (nW or B_, nH, N, N)
+            bias = self.relative_position_bias().unsqueeze(0)
+            if mask is not None:
+                nW = mask.shape[0]
+                bias = bias + mask.unsqueeze(1)
+                if B_ != nW:
+                    bias = bias.repeat(B_ // nW, 1, 1, 1)
+            x = F.scaled_dot_product_attention(
+                q, k, v, attn_mask=bias.to(q.dtype), dropout_p=self.attn_drop.p if self.training else 0.0,
+                scale=1.0 if q_scale_folded else self.scale,
+            )
+            x = x.transpose(1, 2).reshape(B_, N, C)
+            x = self.proj(x)
+            x = self.proj_drop(x)
+            return x
 
-        relative_position_bias = self.relative_position_bias_table[
-            self.relative_position_index.view(-1)
-        ].view(
-            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1
-        )  # Wh*Ww,Wh*Ww,nH
-        relative_position_bias = relative_position_bias.permute(
-            2, 0, 1
-        ).contiguous()  # nH, Wh*Ww, Wh*Ww
-        attn = attn + relative_position_bias.unsqueeze(0)
+        if not q_scale_folded:
+            q = q * self.scale
+        attn = q @ k.transpose(-2, -1)
+        attn = attn + self.relative_position_bias().unsqueeze(0)
 
         if mask is not None:
             nW = mask.shape[0]
@@ -444,7 +492,7 @@ class BasicLayer(nn.Module):
 
         for blk in self.blocks:
             blk.H, blk.W = H, W
-            if self.use_checkpoint:
+            if self.use_checkpoint and self.training:
                 x = checkpoint.checkpoint(blk, x, attn_mask)
             else:
                 x = blk(x, attn_mask)
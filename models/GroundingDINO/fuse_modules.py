@@ -123,6 +123,16 @@ class BiMultiHeadAttention(nn.Module):
         self.stable_softmax_2d = True
         self.clamp_min_for_underflow = True
         self.clamp_max_for_overflow = True
+        # [v_proj * scale; values_v_proj] and [l_proj; values_l_proj], set by fuse_for_inference
+        self.register_buffer("fused_v_weight", None, persistent=False)
+        self.register_buffer("fused_v_bias", None, persistent=False)
+        self.register_buffer("fused_l_weight", None, persistent=False)
+        self.register_buffer("fused_l_bias", None, persistent=False)
+        # Both directions through F.scaled_dot_product_attention, see _forward_sdpa
+        self.use_sdpa = True
+        # Working-memory budget for inference: image tokens are streamed in blocks that fit it
+        # (see _forward_chunked). None = all image tokens at once
+        self.max_memory_mb = None
 
         self._reset_parameters()
 
@@ -143,6 +153,47 @@ class BiMultiHeadAttention(nn.Module):
         nn.init.xavier_uniform_(self.out_l_proj.weight)
         self.out_l_proj.bias.data.fill_(0)
 
+    def fuse_for_inference(self):
+        """
+        Merges the two projections of each modality into one Linear and folds the query scale
+        into the vision one (skipped for quantized layers).
+        """
+        linears = (self.v_proj, self.values_v_proj, self.l_proj, self.values_l_proj)
+        if any(type(m) is not nn.Linear for m in linears):
+            return
+        with torch.no_grad():
+            self.fused_v_weight = torch.cat([self.v_proj.weight * self.scale, self.values_v_proj.weight])
+            self.fused_v_bias = torch.cat([self.v_proj.bias * self.scale, self.values_v_proj.bias])
+            self.fused_l_weight = torch.cat([self.l_proj.weight, self.values_l_proj.weight])
+            self.fused_l_bias = torch.cat([self.l_proj.bias, self.values_l_proj.bias])
+
+    def _project_v(self, v):
+        """Scaled queries and vision values from v."""
+        if self.fused_v_weight is not None:
+            return F.linear(v, self.fused_v_weight, self.fused_v_bias).chunk(2, dim=-1)
+        return self.v_proj(v) * self.scale, self.values_v_proj(v)
+
+    def _project_l(self, l):
+        """Keys and text values from l."""
+        if self.fused_l_weight is not None:
+            return F.linear(l, self.fused_l_weight, self.fused_l_bias).chunk(2, dim=-1)
+        return self.l_proj(l), self.values_l_proj(l)
+
+    def _project(self, v, l):
+        """Scaled queries and vision values from v, keys and text values from l."""
+        query_states, value_v = self._project_v(v)
+        key_l, value_l = self._project_l(l)
+        return query_states, key_l, value_v, value_l
+
+    def block_size(self, n_text: int):
+        """
+        Image tokens per block for max_memory_mb: fp32 projections (and their per-head copies),
+        scores and probabilities of one block in both directions (the layer's input and output
+        are not counted).
+        """
+        per_token = 4 * (6 * self.embed_dim + self.v_dim + 4 * self.num_heads * n_text)
+        return max(1, int(self.max_memory_mb * 1e6 // per_token))
+
     def forward(self, v, l, attention_mask_v=None, attention_mask_l=None):
         """_summary_
 
@@ -157,12 +208,18 @@ class BiMultiHeadAttention(nn.Module):
         """
         # if os.environ.get('IPDB_SHILONG_DEBUG', None) == 'INFO':
         #     import ipdb; ipdb.set_trace()
+        if self.max_memory_mb is not None and not self.training:
+            block = self.block_size(l.shape[1])
+            if block < v.shape[1]:
+                return self._forward_chunked(v, l, attention_mask_v, attention_mask_l, block)
+        if self.use_sdpa:
+            return self._forward_sdpa(v, l, attention_mask_v, attention_mask_l)
         bsz, tgt_len, _ = v.size()
 
-        query_states = self.v_proj(v) * self.scale
-        key_states = self._shape(self.l_proj(l), -1, bsz)
-        value_v_states = self._shape(self.values_v_proj(v), -1, bsz)
-        value_l_states = self._shape(self.values_l_proj(l), -1, bsz)
+        query_states, key_l, value_v, value_l = self._project(v, l)
+        key_states = self._shape(key_l, -1, bsz)
+        value_v_states = self._shape(value_v, -1, bsz)
+        value_l_states = self._shape(value_l, -1, bsz)
 
         proj_shape = (bsz * self.num_heads, -1, self.head_dim)
         query_states = self._shape(query_states, tgt_len, bsz).view(*proj_shape)
@@ -208,7 +265,8 @@ class BiMultiHeadAttention(nn.Module):
             )
             attn_weights_l.masked_fill_(attention_mask_v, float("-inf"))
 
-        attn_weights_l = attn_weights_l.softmax(dim=-1)
+        # fp32 softmax also under bf16 autocast
+        attn_weights_l = attn_weights_l.softmax(dim=-1, dtype=torch.float32)
 
         # mask language for vision
         if attention_mask_l is not None:
@@ -216,7 +274,7 @@ class BiMultiHeadAttention(nn.Module):
                 attention_mask_l[:, None, None, :].repeat(1, self.num_heads, 1, 1).flatten(0, 1)
             )
             attn_weights.masked_fill_(attention_mask_l, float("-inf"))
-        attn_weights_v = attn_weights.softmax(dim=-1)
+        attn_weights_v = attn_weights.softmax(dim=-1, dtype=torch.float32)
 
         attn_probs_v = F.dropout(attn_weights_v, p=self.dropout, training=self.training)
         attn_probs_l = F.dropout(attn_weights_l, p=self.dropout, training=self.training)
@@ -247,6 +305,86 @@ class BiMultiHeadAttention(nn.Module):
 
         return attn_output_v, attn_output_l
 
+    def _forward_sdpa(self, v, l, attention_mask_v=None, attention_mask_l=None):
+        """
+        forward() without materializing the (heads, n_img, n_text) scores, their transpose and
+        both softmaxes: image->text attention is SDPA(q, k, values_l), text->image attention
+        SDPA(k, q, values_v) over the same scaled dot products. Max subtraction is done by the
+        kernel; the +-50000 clamps only matter for fp16, which inference never runs in.
+        """
+        bsz, tgt_len, _ = v.size()
+        query_states, key_l, value_v, value_l = self._project(v, l)
+        # bs, nhead, len, head_dim
+        query_states = self._shape(query_states, -1, bsz)
+        key_states = self._shape(key_l, -1, bsz)
+        value_v_states = self._shape(value_v, -1, bsz)
+        value_l_states = self._shape(value_l, -1, bsz)
+        dropout_p = self.dropout if self.training else 0.0
+
+        # SDPA boolean masks are True where attention is allowed
+        mask_l = None if attention_mask_l is None else ~attention_mask_l[:, None, None, :]
+        mask_v = None if attention_mask_v is None else ~attention_mask_v[:, None, None, :]
+        attn_output_v = F.scaled_dot_product_attention(
+            query_states, key_states, value_l_states, attn_mask=mask_l, dropout_p=dropout_p, scale=1.0
+        )
+        attn_output_l = F.scaled_dot_product_attention(
+            key_states, query_states, value_v_states, attn_mask=mask_v, dropout_p=dropout_p, scale=1.0
+        )
+
+        attn_output_v = self.out_v_proj(attn_output_v.transpose(1, 2).reshape(bsz, tgt_len, self.embed_dim))
+        attn_output_l = self.out_l_proj(attn_output_l.transpose(1, 2).reshape(bsz, -1, self.embed_dim))
+        return attn_output_v, attn_output_l
+
+    def _forward_chunked(self, v, l, attention_mask_v, attention_mask_l, block):
+        """
+        Inference forward over blocks of `block` image tokens, so the projections and scores of
+        only one block are alive at a time. Image->text attention is independent per image
+        token. Text->image attention normalizes over all image tokens, so it keeps a running
+        max, sum and weighted value sum per text token (online softmax) and divides at the end.
+        """
+        bsz, tgt_len, _ = v.size()
+        key_l, value_l = self._project_l(l)
+        key_states = self._shape(key_l, -1, bsz)
+        value_l_states = self._shape(value_l, -1, bsz)
+        src_len = key_states.size(2)
+        mask_l = None if attention_mask_l is None else ~attention_mask_l[:, None, None, :]
+
+        attn_output_v = None
+        state = (bsz, self.num_heads, src_len, 1)
+        row_max = torch.full(state, float("-inf"), dtype=torch.float32, device=v.device)
+        row_sum = torch.zeros(state, dtype=torch.float32, device=v.device)
+        acc = torch.zeros(state[:3] + (self.head_dim,), dtype=torch.float32, device=v.device)
+        for start in range(0, tgt_len, block):
+            end = min(start + block, tgt_len)
+            query, value_v = self._project_v(v[:, start:end])
+            query_states = self._shape(query, -1, bsz)
+            value_v_states = self._shape(value_v, -1, bsz)
+
+            out_v = F.scaled_dot_product_attention(query_states, key_states, value_l_states, attn_mask=mask_l,
+                                                   scale=1.0)
+            out_v = self.out_v_proj(out_v.transpose(1, 2).reshape(bsz, end - start, self.embed_dim))
+            if attn_output_v is None:
+                attn_output_v = out_v.new_empty(bsz, tgt_len, out_v.size(-1))
+            attn_output_v[:, start:end] = out_v
+
+            # bs, nhead, ntxt, block
+            scores = torch.matmul(key_states, query_states.transpose(-1, -2)).float()
+            if attention_mask_v is not None:
+                scores = scores.masked_fill(attention_mask_v[:, None, None, start:end], float("-inf"))
+            new_max = torch.maximum(row_max, scores.amax(dim=-1, keepdim=True))
+            # Text rows that have only seen padded image tokens stay at -inf, keep exp() finite
+            safe_max = torch.where(torch.isinf(new_max), torch.zeros_like(new_max), new_max)
+            correction = torch.exp(row_max - safe_max)
+            probs = torch.exp(scores - safe_max)
+            row_sum = row_sum * correction + probs.sum(dim=-1, keepdim=True)
+            acc = acc * correction + torch.matmul(probs, value_v_states.float())
+            row_max = new_max
+
+        # Text rows with every image token padded get zeros, like SDPA, instead of 0/0
+        attn_output_l = acc / row_sum.clamp_min(torch.finfo(row_sum.dtype).tiny)
+        attn_output_l = attn_output_l.transpose(1, 2).reshape(bsz, src_len, self.embed_dim)
+        return attn_output_v, self.out_l_proj(attn_output_l)
+
 
 # Bi-Direction MHA (text->image, image->text)
 class BiAttentionBlock(nn.Module):
@@ -418,7 +418,7 @@ class GroundingDINO(nn.Module):
                 poss.append(pos_l)
         
         input_query_bbox = input_query_label = attn_mask = dn_meta = None
-        hs, reference, hs_enc, ref_enc, init_box_proposal = self.transformer(
+        hs, reference, hs_enc, ref_enc, init_box_proposal, exit_layers = self.transformer(
             srcs, masks, input_query_bbox, poss, input_query_label, attn_mask, text_dict
         )
 
@@ -443,6 +443,8 @@ class GroundingDINO(nn.Module):
         )
 
         out = {"pred_logits": outputs_class[-1], "pred_boxes": outputs_coord_list[-1]}
+        # Decoder layers each image needed to converge (see TransformerDecoder.exit_tol)
+        out["exit_layers"] = exit_layers
         
 
         # Used to calculate losses
@@ -450,10 +452,7 @@ class GroundingDINO(nn.Module):
         out['text_mask']=torch.zeros(bs, self.max_text_len, dtype=torch.bool).to(
             samples.device
         )
-        for b in range(bs):
-            for j in range(len_td):
-                if text_dict['text_token_mask'][b][j] == True:
-                    out['text_mask'][b][j] = True
+        out['text_mask'][:, :len_td] = text_dict['text_token_mask']
 
         # for intermediate outputs
         if self.aux_loss:
@@ -16,7 +16,7 @@
 
 import math
 import warnings
-from typing import Optional
+from typing import List, Optional
 
 import torch
 import torch.nn as nn
@@ -134,6 +134,39 @@ def multi_scale_deformable_attn_pytorch(
     return output.transpose(1, 2).contiguous()
 
 
+# Under torch.compile, inductor decomposes grid_sample into gathers that run several times slower
+# than the aten kernel on CPU. As a custom op the sampling stays one opaque call in the graph
+if hasattr(torch.library, "custom_op"):
+
+    @torch.library.custom_op("countgd::ms_deform_attn", mutates_args=())
+    def ms_deform_attn_op(
+        value: torch.Tensor,
+        value_spatial_shapes: List[int],
+        sampling_locations: torch.Tensor,
+        attention_weights: torch.Tensor,
+    ) -> torch.Tensor:
+        # Flattened (h0, w0, h1, w1, ...); sampling in the dtype of the (fp32) attention weights
+        shapes = list(zip(value_spatial_shapes[::2], value_spatial_shapes[1::2]))
+        dtype = attention_weights.dtype
+        return multi_scale_deformable_attn_pytorch(
+            value.to(dtype), shapes, sampling_locations.to(dtype), attention_weights
+        )
+
+    @ms_deform_attn_op.register_fake
+    def _(value, value_spatial_shapes, sampling_locations, attention_weights):
+        bs, _, num_heads, embed_dims = value.shape
+        return attention_weights.new_empty((bs, sampling_locations.shape[1], num_heads * embed_dims))
+
+else:
+    ms_deform_attn_op = None
+
+
+def _is_exporting():
+    # torch.export / the ONNX exporter need the decomposable pure-PyTorch path, not the custom op
+    is_exporting = getattr(torch.compiler, "is_exporting", None)
+    return is_exporting is not None and is_exporting()
+
+
 class MultiScaleDeformableAttention(nn.Module):
     """Multi-Scale Deformable Attention Module used in Deformable-DETR
 
@@ -189,6 +222,9 @@ class MultiScaleDeformableAttention(nn.Module):
         self.attention_weights = nn.Linear(embed_dim, num_heads * num_levels * num_points)
         self.value_proj = nn.Linear(embed_dim, embed_dim)
         self.output_proj = nn.Linear(embed_dim, embed_dim)
+        # sampling_offsets and attention_weights as one GEMM, set by fuse_for_inference
+        self.register_buffer("fused_query_weight", None, persistent=False)
+        self.register_buffer("fused_query_bias", None, persistent=False)
 
         self.init_weights()
 
@@ -220,6 +256,14 @@ class MultiScaleDeformableAttention(nn.Module):
         xavier_uniform_(self.output_proj.weight.data)
         constant_(self.output_proj.bias.data, 0.0)
 
+    def fuse_for_inference(self):
+        """Merges the two projections of the query into one Linear (skipped for quantized layers)."""
+        if type(self.sampling_offsets) is not nn.Linear or type(self.attention_weights) is not nn.Linear:
+            return
+        with torch.no_grad():
+            self.fused_query_weight = torch.cat([self.sampling_offsets.weight, self.attention_weights.weight])
+            self.fused_query_bias = torch.cat([self.sampling_offsets.bias, self.attention_weights.bias])
+
     def freeze_sampling_offsets(self):
         print("Freeze sampling offsets")
         self.sampling_offsets.weight.requires_grad = False
@@ -238,7 +282,7 @@ class MultiScaleDeformableAttention(nn.Module):
         query_pos: Optional[torch.Tensor] = None,
         key_padding_mask: Optional[torch.Tensor] = None,
         reference_points: Optional[torch.Tensor] = None,
-        spatial_shapes: Optional[torch.Tensor] = None,
+        spatial_shapes=None,
         level_start_index: Optional[torch.Tensor] = None,
         **kwargs
     ) -> torch.Tensor:
@@ -261,8 +305,9 @@ class MultiScaleDeformableAttention(nn.Module):
                 bottom-right (1, 1), including padding are.
                 or `(N, Length_{query}, num_levels, 4)`, add additional
                 two dimensions `(h, w)` to form reference boxes.
-            spatial_shapes (torch.Tensor): Spatial shape of features in different levels.
-                With shape `(num_levels, 2)`, last dimension represents `(h, w)`.
+            spatial_shapes (torch.Tensor or list): Spatial shape of features in different levels.
+                With shape `(num_levels, 2)`, last dimension represents `(h, w)`. A list of
+                `(h, w)` ints avoids a device sync per layer and keeps the module traceable.
             level_start_index (torch.Tensor): The start index of each level. A tensor with
                 shape `(num_levels, )` which can be represented as
                 `[0, h_0 * w_0, h_0 * w_0 + h_1 * w_1, ...]`.
@@ -285,19 +330,32 @@ class MultiScaleDeformableAttention(nn.Module):
         bs, num_query, _ = query.shape
         bs, num_value, _ = value.shape
 
-        assert (spatial_shapes[:, 0] * spatial_shapes[:, 1]).sum() == num_value
+        if isinstance(spatial_shapes, torch.Tensor):
+            spatial_shapes_list = [tuple(s) for s in spatial_shapes.tolist()]
+        else:
+            spatial_shapes_list = [(int(h), int(w)) for h, w in spatial_shapes]
+            spatial_shapes = torch.as_tensor(spatial_shapes_list, dtype=torch.long, device=value.device)
+        assert sum(h * w for h, w in spatial_shapes_list) == num_value
 
         value = self.value_proj(value)
         if key_padding_mask is not None:
             value = value.masked_fill(key_padding_mask[..., None], float(0))
         value = value.view(bs, num_value, self.num_heads, -1)
-        sampling_offsets = self.sampling_offsets(query).view(
+        if self.fused_query_weight is not None:
+            sampling_offsets, attention_weights = F.linear(
+                query, self.fused_query_weight, self.fused_query_bias
+            ).split([self.sampling_offsets.out_features, self.attention_weights.out_features], dim=-1)
+        else:
+            sampling_offsets = self.sampling_offsets(query)
+            attention_weights = self.attention_weights(query)
+        sampling_offsets = sampling_offsets.view(
             bs, num_query, self.num_heads, self.num_levels, self.num_points, 2
         )
-        attention_weights = self.attention_weights(query).view(
+        attention_weights = attention_weights.view(
             bs, num_query, self.num_heads, self.num_levels * self.num_points
         )
-        attention_weights = attention_weights.softmax(-1)
+        # fp32 softmax also under bf16 autocast (sampling and weighting then run in fp32 too)
+        attention_weights = attention_weights.softmax(-1, dtype=torch.float32)
         attention_weights = attention_weights.view(
             bs,
             num_query,
@@ -330,7 +388,9 @@ class MultiScaleDeformableAttention(nn.Module):
     
         if torch.cuda.is_available() and value.is_cuda:
             halffloat = False
-            if value.dtype == torch.float16:
+            # The CUDA kernel is fp32 only: fp16 / bf16 (autocast) inputs go through fp32
+            input_dtype = value.dtype
+            if value.dtype in (torch.float16, torch.bfloat16):
                 halffloat = True
                 value = value.float()
                 sampling_locations = sampling_locations.float()
@@ -346,10 +406,14 @@ class MultiScaleDeformableAttention(nn.Module):
             )
 
             if halffloat:
-                output = output.half()
+                output = output.to(input_dtype)
+        elif ms_deform_attn_op is not None and torch.compiler.is_compiling() and not _is_exporting():
+            output = ms_deform_attn_op(
+                value, [n for hw in spatial_shapes_list for n in hw], sampling_locations, attention_weights
+            )
         else:
             output = multi_scale_deformable_attn_pytorch(
-                value, spatial_shapes, sampling_locations, attention_weights
+                value, spatial_shapes_list, sampling_locations, attention_weights
             )
 
         output = self.output_proj(output)
@@ -16,9 +16,11 @@
 # Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
 # ------------------------------------------------------------------------
 
+import itertools
 from typing import Optional
 
 import torch
+import torch.nn.functional as F
 import torch.utils.checkpoint as checkpoint
 from torch import Tensor, nn
 
@@ -147,6 +149,14 @@ class Transformer(nn.Module):
         self.nhead = nhead
         self.dec_layers = num_decoder_layers
         self.num_queries = num_queries  # useful for single stage model only
+        # Inference-only override of how many encoder proposals feed the decoder (<= num_queries)
+        self.query_budget = None
+        # Inference-only adaptive budget: the decoder runs with the smallest of query_buckets
+        # that fits the object count estimated from the encoder proposals scoring above
+        # bucket_threshold (set per call to the detection threshold, see detector_logic)
+        self.query_buckets = None
+        self.bucket_threshold = None
+        self.bucket_margin = 0.5
         self.num_patterns = num_patterns
         if not isinstance(num_patterns, int):
             Warning("num_patterns should be int but {}".format(type(num_patterns)))
@@ -205,6 +215,45 @@ class Transformer(nn.Module):
         valid_ratio = torch.stack([valid_ratio_w, valid_ratio_h], -1)
         return valid_ratio
 
+    def token_scorer(self, mask_flatten, text_dict):
+        """
+        Scores for the sparse encoder: the two-stage proposal head's best text logit per image
+        token, from the features and text of the layer it is called after. Padding scores -inf.
+        """
+        if self.two_stage_type != "standard" or self.encoder.keep_ratio is None:
+            return None
+
+        def score(memory, memory_text):
+            output_memory = self.enc_output_norm(self.enc_output(memory))
+            logits = self.enc_out_class_embed(output_memory, {**text_dict, "encoded_text": memory_text})
+            return logits.max(-1)[0].masked_fill(mask_flatten, float("-inf"))
+
+        return score
+
+    def adaptive_num_queries(self, proposal_logits, spatial_shapes):
+        """
+        Smallest of query_buckets that holds the estimated object count with room to spare
+        (estimate <= bucket_margin * bucket), the largest one otherwise. proposal_logits are the
+        (bs, sum(hw)) best text logits of the encoder proposals. An object lights up a blob of
+        neighbouring tokens, so a level counts its local maxima (3x3) above bucket_threshold,
+        and the estimate is the busiest level: summing levels would count an object once per
+        level. One host sync.
+        """
+        if self.bucket_threshold is None:
+            raise ValueError("query_buckets need bucket_threshold, the score proposals are counted at")
+        scores = proposal_logits.sigmoid()
+        counts, start = [], 0
+        for h, w in spatial_shapes:
+            level = scores[:, start:start + h * w].view(-1, 1, h, w)
+            peaks = (level == F.max_pool2d(level, 3, stride=1, padding=1)) & (level > self.bucket_threshold)
+            counts.append(peaks.flatten(1).sum(1))
+            start += h * w
+        estimate = int(torch.stack(counts).max())
+        for bucket in sorted(self.query_buckets):
+            if estimate <= self.bucket_margin * bucket:
+                return bucket
+        return max(self.query_buckets)
+
     def init_ref_points(self, use_num_queries):
         self.refpoint_embed = nn.Embedding(use_num_queries, 4)
 
@@ -241,11 +290,11 @@ class Transformer(nn.Module):
         src_flatten = torch.cat(src_flatten, 1)  # bs, \sum{hxw}, c
         mask_flatten = torch.cat(mask_flatten, 1)  # bs, \sum{hxw}
         lvl_pos_embed_flatten = torch.cat(lvl_pos_embed_flatten, 1)  # bs, \sum{hxw}, c
-        spatial_shapes = torch.as_tensor(
-            spatial_shapes, dtype=torch.long, device=src_flatten.device
-        )
-        level_start_index = torch.cat(
-            (spatial_shapes.new_zeros((1,)), spatial_shapes.prod(1).cumsum(0)[:-1])
+        # Levels keep travelling as Python (h, w) ints: iterating a shape tensor costs a host sync
+        # per level and layer, and stops torch.compile from capturing the whole graph
+        level_start_index = torch.as_tensor(
+            [0] + list(itertools.accumulate(h * w for h, w in spatial_shapes))[:-1],
+            dtype=torch.long, device=src_flatten.device
         )
         valid_ratios = torch.stack([self.get_valid_ratio(m) for m in masks], 1)
 
@@ -268,6 +317,7 @@ class Transformer(nn.Module):
             # we ~ the mask . False means use the token; True means pad the token
             position_ids=text_dict["position_ids"],
             text_self_attention_masks=text_dict["text_self_attention_masks"],
+            token_scorer=self.token_scorer(mask_flatten, text_dict),
         )
         
         #########################################################
@@ -300,6 +350,12 @@ class Transformer(nn.Module):
                 self.enc_out_bbox_embed(output_memory) + output_proposals
             )  # (bs, \sum{hw}, 4) unsigmoid
             topk = self.num_queries
+            if self.query_buckets is not None and not self.training:
+                topk = self.adaptive_num_queries(topk_logits.masked_fill(mask_flatten, float("-inf")), spatial_shapes)
+            if self.query_budget is not None:
+                topk = min(topk, self.query_budget)
+            if topk != self.num_queries:
+                topk = max(1, min(topk, self.num_queries, topk_logits.shape[1]))
 
             topk_proposals = torch.topk(topk_logits, topk, dim=1)[1]  # bs, nq
 
@@ -317,8 +373,9 @@ class Transformer(nn.Module):
                 output_memory, 1, topk_proposals.unsqueeze(-1).repeat(1, 1, self.d_model)
             )
             if self.embed_init_tgt:
+                # Content queries pair with proposals in score order, a smaller budget keeps the first topk
                 tgt_ = (
-                    self.tgt_embed.weight[:, None, :].repeat(1, bs, 1).transpose(0, 1)
+                    self.tgt_embed.weight[:topk, None, :].repeat(1, bs, 1).transpose(0, 1)
                 )  # nq, bs, d_model
             else:
                 tgt_ = tgt_undetach.detach()
@@ -368,7 +425,7 @@ class Transformer(nn.Module):
         #memory  torch.Size([2, 16320, 256])
 
         # import pdb;pdb.set_trace()
-        hs, references = self.decoder(
+        hs, references, exit_layers = self.decoder(
             tgt=tgt.transpose(0, 1),
             memory=memory.transpose(0, 1),
             memory_key_padding_mask=mask_flatten,
@@ -386,6 +443,7 @@ class Transformer(nn.Module):
         # End Decoder
         # hs: n_dec, bs, nq, d_model
         # references: n_dec+1, bs, nq, query_dim
+        # exit_layers: bs, decoder layers each image needed (early exit)
         #########################################################
 
         #########################################################
@@ -402,12 +460,13 @@ class Transformer(nn.Module):
         # ref_enc: (n_enc+1, bs, nq, query_dim) or (1, bs, nq, query_dim) or (n_enc, bs, nq, d_model) or None
         #########################################################
 
-        return hs, references, hs_enc, ref_enc, init_box_proposal
+        return hs, references, hs_enc, ref_enc, init_box_proposal, exit_layers
         # hs: (n_dec, bs, nq, d_model)
         # references: sigmoid coordinates. (n_dec+1, bs, bq, 4)
         # hs_enc: (n_enc+1, bs, nq, d_model) or (1, bs, nq, d_model) or None
         # ref_enc: sigmoid coordinates. \
         #           (n_enc+1, bs, nq, query_dim) or (1, bs, nq, query_dim) or None
+        # exit_layers: (bs,) decoder layers each image needed, n_dec unless it exited early
 
 
 class TransformerEncoder(nn.Module):
@@ -468,6 +527,10 @@ class TransformerEncoder(nn.Module):
 
         self.use_checkpoint = use_checkpoint
         self.use_transformer_ckpt = use_transformer_ckpt
+        # Inference-only sparse mode: after dense_layers full layers, only the keep_ratio
+        # highest-scoring image tokens go through the remaining fusion and deformable layers
+        self.keep_ratio = None
+        self.dense_layers = 1
 
     @staticmethod
     def get_reference_points(spatial_shapes, valid_ratios, device):
@@ -501,6 +564,7 @@ class TransformerEncoder(nn.Module):
         pos_text: Tensor = None,
         text_self_attention_masks: Tensor = None,
         position_ids: Tensor = None,
+        token_scorer=None,
     ):
         """
         Input:
@@ -517,6 +581,7 @@ class TransformerEncoder(nn.Module):
             - pos_text: bs, n_text, 256
 
             - position_ids: bs, n_text
+            - token_scorer: (output, memory_text) -> [bs, sum(hi*wi)] scores, used with keep_ratio
         Intermedia:
             - reference_points: [bs, sum(hi*wi), num_level, 2]
         Outpus:
@@ -548,13 +613,34 @@ class TransformerEncoder(nn.Module):
                     position_ids[..., None], num_pos_feats=256, exchange_xy=False
                 )
 
+        sparse = self.keep_ratio is not None and token_scorer is not None and not self.training
+        # Tokens updated by the sparse layers: bs, k
+        query_index = None
+
         # main process
         for layer_id, layer in enumerate(self.layers):
             # if output.isnan().any() or memory_text.isnan().any():
             #     if os.environ.get('IPDB_SHILONG_DEBUG', None) == 'INFO':
             #         import ipdb; ipdb.set_trace()
-            if self.fusion_layers:
-                if self.use_checkpoint:
+            if sparse and layer_id == self.dense_layers:
+                scores = token_scorer(output, memory_text)
+                keep = max(1, min(scores.shape[1], int(round(scores.shape[1] * self.keep_ratio))))
+                # Sorted, so gathers and scatters walk memory in order
+                query_index = torch.topk(scores, keep, dim=1)[1].sort(dim=1)[0]
+
+            if self.fusion_layers and query_index is not None:
+                # Only the kept image tokens exchange information with the text
+                index = query_index.unsqueeze(-1).expand(-1, -1, output.shape[-1])
+                kept, memory_text = self.fusion_layers[layer_id](
+                    v=torch.gather(output, 1, index),
+                    l=memory_text,
+                    attention_mask_v=torch.gather(key_padding_mask, 1, query_index),
+                    attention_mask_l=text_attention_mask,
+                )
+                output = output.scatter(1, index, kept)
+            elif self.fusion_layers:
+                # Activation checkpointing only saves memory for a backward pass
+                if self.use_checkpoint and self.training:
                     output, memory_text = checkpoint.checkpoint(
                         self.fusion_layers[layer_id],
                         output,
@@ -579,7 +665,7 @@ class TransformerEncoder(nn.Module):
                 ).transpose(0, 1)
 
             # main process
-            if self.use_transformer_ckpt:
+            if self.use_transformer_ckpt and self.training:
                 output = checkpoint.checkpoint(
                     layer,
                     output,
@@ -597,6 +683,7 @@ class TransformerEncoder(nn.Module):
                     spatial_shapes=spatial_shapes,
                     level_start_index=level_start_index,
                     key_padding_mask=key_padding_mask,
+                    query_index=query_index,
                 )
 
         return output, memory_text
@@ -636,6 +723,12 @@ class TransformerDecoder(nn.Module):
         self.d_model = d_model
 
         self.ref_anchor_head = None
+        self.check_finite = False
+        # Inference-only early exit: stop once the exit_topk highest-scoring queries move by at
+        # most exit_tol (normalized box coordinates and sigmoid score) between two layers
+        self.exit_tol = None
+        self.exit_topk = 100
+        self.min_layers = 2
 
     def forward(
         self,
@@ -669,7 +762,14 @@ class TransformerDecoder(nn.Module):
         reference_points = refpoints_unsigmoid.sigmoid()
         ref_points = [reference_points]
 
-        
+        early_exit = (
+            self.exit_tol is not None and not self.training and self.bbox_embed is not None
+            and self.class_embed is not None and memory_text is not None
+        )
+        if early_exit:
+            text_dict = {"encoded_text": memory_text, "text_token_mask": ~text_attention_mask}
+            exit_layers = torch.full((tgt.shape[1],), self.num_layers, dtype=torch.long)
+            previous = None
 
         for layer_id, layer in enumerate(self.layers):
 
@@ -710,7 +810,8 @@ class TransformerDecoder(nn.Module):
                 self_attn_mask=tgt_mask,
                 cross_attn_mask=memory_mask,
             )
-            if output.isnan().any() | output.isinf().any():
+            # Debug aid only: the check is a host sync per layer (and a graph break when compiled)
+            if self.check_finite and (output.isnan().any() | output.isinf().any()):
                 print(f"output layer_id {layer_id} is nan")
                 try:
                     num_nan = output.isnan().sum().item()
@@ -738,11 +839,37 @@ class TransformerDecoder(nn.Module):
 
             intermediate.append(self.norm(output))
 
+            if early_exit:
+                # The detection head's outputs of this layer, as the model would return them
+                boxes = (
+                    self.bbox_embed[layer_id](intermediate[-1]) + inverse_sigmoid(ref_points[-2])
+                ).sigmoid().transpose(0, 1)  # bs, nq, 4
+                scores = self.class_embed[layer_id](intermediate[-1].transpose(0, 1), text_dict)
+                scores = scores.max(-1)[0].sigmoid()  # bs, nq
+                if previous is not None:
+                    top = scores.topk(min(self.exit_topk, scores.shape[1]), dim=1)[1]
+                    box_index = top.unsqueeze(-1).expand(-1, -1, 4)
+                    drift = torch.maximum(
+                        (torch.gather(boxes, 1, box_index) - torch.gather(previous[0], 1, box_index)).abs().amax((1, 2)),
+                        (torch.gather(scores, 1, top) - torch.gather(previous[1], 1, top)).abs().amax(1),
+                    )
+                    converged = (drift <= self.exit_tol).cpu() & (layer_id + 1 >= self.min_layers)
+                    exit_layers = torch.where(
+                        converged & (exit_layers == self.num_layers), torch.full_like(exit_layers, layer_id + 1), exit_layers
+                    )
+                    if converged.all():
+                        break
+                previous = boxes, scores
+
+        if not early_exit:
+            exit_layers = torch.full((tgt.shape[1],), len(intermediate), dtype=torch.long)
+
         # import pdb;pdb.set_trace()
 
         return [
             [itm_out.transpose(0, 1) for itm_out in intermediate],
             [itm_refpoint.transpose(0, 1) for itm_refpoint in ref_points],
+            exit_layers,
         ]
 
 
@@ -789,8 +916,13 @@ class DeformableTransformerEncoderLayer(nn.Module):
         return src
 
     def forward(
-        self, src, pos, reference_points, spatial_shapes, level_start_index, key_padding_mask=None
+        self, src, pos, reference_points, spatial_shapes, level_start_index, key_padding_mask=None,
+        query_index=None,
     ):
+        if query_index is not None:
+            return self.forward_sparse(
+                src, pos, reference_points, spatial_shapes, level_start_index, key_padding_mask, query_index
+            )
         # self attention
         # import ipdb; ipdb.set_trace()
         src2 = self.self_attn(
@@ -809,6 +941,32 @@ class DeformableTransformerEncoderLayer(nn.Module):
 
         return src
 
+    def forward_sparse(
+        self, src, pos, reference_points, spatial_shapes, level_start_index, key_padding_mask, query_index
+    ):
+        """
+        Updates only the tokens in query_index (bs, k); they still sample from every token of
+        src. Returns src with those rows replaced.
+        """
+        index = query_index.unsqueeze(-1).expand(-1, -1, src.shape[-1])
+        query = torch.gather(src, 1, index)
+        query_pos = torch.gather(pos, 1, index)
+        query_reference_points = torch.gather(
+            reference_points, 1,
+            query_index[:, :, None, None].expand(-1, -1, *reference_points.shape[2:])
+        )
+        src2 = self.self_attn(
+            query=query + query_pos,
+            reference_points=query_reference_points,
+            value=src,
+            spatial_shapes=spatial_shapes,
+            level_start_index=level_start_index,
+            key_padding_mask=key_padding_mask,
+        )
+        query = self.norm1(query + self.dropout1(src2))
+        query = self.forward_ffn(query)
+        return src.scatter(1, index, query)
+
 
 class DeformableTransformerDecoderLayer(nn.Module):
     def __init__(
@@ -907,7 +1065,7 @@ class DeformableTransformerDecoderLayer(nn.Module):
         if self.self_attn is not None:
             # import ipdb; ipdb.set_trace()
             q = k = self.with_pos_embed(tgt, tgt_query_pos)
-            tgt2 = self.self_attn(q, k, tgt, attn_mask=self_attn_mask)[0]
+            tgt2 = self.self_attn(q, k, tgt, attn_mask=self_attn_mask, need_weights=False)[0]
             tgt = tgt + self.dropout2(tgt2)
             tgt = self.norm2(tgt)
 
@@ -917,6 +1075,7 @@ class DeformableTransformerDecoderLayer(nn.Module):
                 memory_text.transpose(0, 1),
                 memory_text.transpose(0, 1),
                 key_padding_mask=text_attention_mask,
+                need_weights=False,
             )[0]
             tgt = tgt + self.catext_dropout(tgt2)
             tgt = self.catext_norm(tgt)
@@ -74,7 +74,8 @@ class TransformerEncoderLayer(nn.Module):
                 key=k,
                 value=src_norm,
                 attn_mask=src_mask,
-                key_padding_mask=src_key_padding_mask
+                key_padding_mask=src_key_padding_mask,
+                need_weights=False
             )[0])
 
             src_norm = self.norm2(src)
@@ -86,7 +87,8 @@ class TransformerEncoderLayer(nn.Module):
                 key=k,
                 value=src,
                 attn_mask=src_mask,
-                key_padding_mask=src_key_padding_mask
+                key_padding_mask=src_key_padding_mask,
+                need_weights=False
             )[0]))
 
             src = self.norm2(src + self.dropout2(self.mlp(src)))
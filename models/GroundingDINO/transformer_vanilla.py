@@ -112,7 +112,8 @@ class TransformerEncoderLayer(nn.Module):
 
         q = k = self.with_pos_embed(src, pos)
 
-        src2 = self.self_attn(q, k, value=src, attn_mask=src_mask)[0]
+        # need_weights=False lets nn.MultiheadAttention use the fused SDPA kernels
+        src2 = self.self_attn(q, k, value=src, attn_mask=src_mask, need_weights=False)[0]
 
         # src2 = self.self_attn(q, k, value=src, attn_mask=src_mask, key_padding_mask=src_key_padding_mask)[0]
         src = src + self.dropout1(src2)
@@ -266,8 +266,8 @@ class ContrastiveEmbed(nn.Module):
         # 接着，对res进行掩码操作，将未使用的文本token（即padding的token）对应的得分置为负无穷float("-inf")。这是为了在计算相似度时，排除padding部分的影响。
 
 
-        # padding to max_text_len
-        new_res = torch.full((*res.shape[:-1], self.max_text_len), float("-inf"), device=res.device)
-        new_res[..., : res.shape[-1]] = res  #torch.Size([2, 16320, 195])
+        # padding to max_text_len (fp32, also after a bf16 forward). One pad instead of fill +
+        # slice-assign keeps the text length symbolic when exported
+        new_res = F.pad(res.float(), (0, self.max_text_len - res.shape[-1]), value=float("-inf"))  #torch.Size([2, 16320, 256])
 
         return new_res
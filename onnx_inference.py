@@ -0,0 +1,114 @@
+import os
+import json
+import threading
+
+import torch
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    print("Warning: onnxruntime not installed. ONNX CountGD backend disabled.")
+    ort = None
+
+import compiled_inference
+from groundingdino.util import get_tokenlizer
+
+# Written by export_onnx.py next to the graphs
+MANIFEST_NAME = "countgd_onnx.json"
+TEXT_INPUTS = ("input_ids", "attention_mask", "token_type_ids", "position_ids", "text_self_attention_masks")
+DETECTOR_INPUTS = ("images", "image_mask", "encoded_text", "text_token_mask", "position_ids",
+                   "text_self_attention_masks")
+
+
+def session_options(num_threads: int = None):
+    """CPU session with every graph optimization (constant folding, fusions, layout) turned on."""
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    return options
+
+
+class OnnxCountGD:
+    """
+    CountGD on ONNX Runtime's CPU execution provider, from an export_onnx.py directory: one
+    text-encoder graph, whose output is cached per caption, and one detector graph per image
+    shape bucket (sessions are created on first use). Same call as CompiledCountGD:
+    (image, caption) -> (pred_logits, pred_boxes). Text prompts only, no exemplars.
+    """
+
+    def __init__(self, export_dir: str, num_threads: int = None):
+        if ort is None:
+            raise RuntimeError("ONNX CountGD needs onnxruntime")
+        with open(os.path.join(export_dir, MANIFEST_NAME), "r") as f:
+            self.manifest = json.load(f)
+        self.export_dir = export_dir
+        self.num_threads = num_threads
+        self.size = self.manifest["size"]
+        self.max_size = self.manifest["max_size"]
+        self.max_text_len = self.manifest["max_text_len"]
+        self.special_tokens = self.manifest["special_tokens"]
+        self.buckets = sorted((tuple(int(n) for n in key.split("x")) for key in self.manifest["detectors"]),
+                              key=lambda hw: (hw[0] * hw[1], hw))
+        self.tokenizer = get_tokenlizer.get_tokenlizer(os.path.join(export_dir, self.manifest["tokenizer"]))
+        self.text_session = self._session(self.manifest["text_encoder"])
+        self._sessions = {}
+        self._text_cache = {}
+        self._lock = threading.Lock()
+
+    def _session(self, filename):
+        return ort.InferenceSession(os.path.join(self.export_dir, filename), session_options(self.num_threads),
+                                    providers=["CPUExecutionProvider"])
+
+    def bucket_for(self, h: int, w: int):
+        for bh, bw in self.buckets:
+            if h <= bh and w <= bw:
+                return bh, bw
+        return None
+
+    def detector_session(self, bucket):
+        with self._lock:
+            if bucket not in self._sessions:
+                self._sessions[bucket] = self._session(self.manifest["detectors"][f"{bucket[0]}x{bucket[1]}"])
+            return self._sessions[bucket]
+
+    def text_features(self, caption: str):
+        """Detector text inputs for a caption: encoded text plus masks, computed once per caption."""
+        if caption not in self._text_cache:
+            tokens = [t.numpy() for t in compiled_inference.tokenize(
+                self.tokenizer, self.special_tokens, self.max_text_len, caption)]
+            text = dict(zip(TEXT_INPUTS, tokens))
+            encoded_text = self.text_session.run(None, {name: text[name] for name in self._input_names(self.text_session)})[0]
+            if len(self._text_cache) >= 64:
+                self._text_cache.clear()
+            self._text_cache[caption] = {
+                "encoded_text": encoded_text,
+                "text_token_mask": text["attention_mask"].astype(bool),
+                "position_ids": text["position_ids"],
+                "text_self_attention_masks": text["text_self_attention_masks"],
+            }
+        return self._text_cache[caption]
+
+    @staticmethod
+    def _input_names(session):
+        # Inputs the exporter found unused are dropped from the graph
+        return [i.name for i in session.get_inputs()]
+
+    def __call__(self, image: torch.Tensor, caption: str):
+        h, w = image.shape[-2:]
+        bucket = self.bucket_for(h, w)
+        if bucket is None:
+            raise ValueError(f"Input {h}x{w} fits none of the exported CountGD shapes "
+                             f"({', '.join(f'{bh}x{bw}' for bh, bw in self.buckets)})")
+        images, image_mask = compiled_inference.pad_to_bucket(image.float().cpu(), bucket)
+        feeds = {"images": images.numpy(), "image_mask": image_mask.numpy(), **self.text_features(caption)}
+        session = self.detector_session(bucket)
+        pred_logits, pred_boxes = session.run(None, {name: feeds[name] for name in self._input_names(session)})
+        return torch.from_numpy(pred_logits), torch.from_numpy(pred_boxes)
+
+    def stats(self):
+        return {
+            "buckets": [f"{h}x{w}" for h, w in self.buckets],
+            "loaded": [f"{h}x{w}" for h, w in self._sessions],
+            "cached_captions": len(self._text_cache),
+        }
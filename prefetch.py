@@ -0,0 +1,63 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class Prefetcher:
+    """
+    Runs load_fn(item) for the next `depth` items in a worker pool while the consumer works on
+    the current one, and yields (item, result, error) in input order.
+
+    At most `depth` results are in flight or buffered at any time, so memory stays bounded no
+    matter how long the item list is. Loader exceptions are yielded, not raised, so one broken
+    image does not end a dataset-wide job.
+
+    Threads are the default: PIL decode/resize and torch ops release the GIL. Use
+    executor="process" for pure-Python loaders (load_fn and results must then be picklable).
+    """
+
+    def __init__(self, load_fn, items, depth: int = 4, workers: int = 2, executor: str = "thread"):
+        self.load_fn = load_fn
+        self.items = items
+        self.depth = max(1, depth)
+        self.workers = max(1, workers)
+        self.executor = executor
+        # Time the consumer spent blocked on a load; ~0 at steady state means the consumer
+        # (the model) is the bottleneck, not decoding
+        self.stats = {"items": 0, "wait_s": 0.0}
+
+    def _make_executor(self):
+        if self.executor == "process":
+            return ProcessPoolExecutor(max_workers=self.workers)
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefetch")
+
+    def __iter__(self):
+        items = iter(self.items)
+        in_flight = deque()
+        pool = self._make_executor()
+
+        def submit_next():
+            for item in items:
+                in_flight.append((item, pool.submit(self.load_fn, item)))
+                return
+
+        try:
+            for _ in range(self.depth):
+                submit_next()
+
+            while in_flight:
+                item, future = in_flight.popleft()
+                start = time.perf_counter()
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, e
+                self.stats["wait_s"] += time.perf_counter() - start
+                self.stats["items"] += 1
+
+                # Refill before handing the result over, so the next load overlaps the consumer
+                submit_next()
+                yield item, result, error
+        finally:
+            # Consumer stopped early (break/cancel): drop whatever is still queued
+            pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,114 @@
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def get_resize_hw(width: int, height: int, size: int = 800, max_size: int = 1333):
+    """
+    Output (h, w) of datasets_inference.transforms.resize for a scalar min size, so the
+    fused pipeline produces exactly the tensor shapes the model was evaluated with.
+    """
+    if max_size is not None:
+        min_original_size = float(min((width, height)))
+        max_original_size = float(max((width, height)))
+        if max_original_size / min_original_size * size > max_size:
+            size = int(round(max_size * min_original_size / max_original_size))
+
+    if (width <= height and width == size) or (height <= width and height == size):
+        return height, width
+
+    if width < height:
+        ow = size
+        oh = int(size * height / width)
+    else:
+        oh = size
+        ow = int(size * width / height)
+    return oh, ow
+
+
+def decode_for_inference(image_path: str, size: int = 800, max_size: int = 1333):
+    """
+    Decodes an image once, already at the model input size.
+
+    For JPEGs that are at least 2x larger than the target, libjpeg's DCT scaling (draft mode)
+    decodes directly at 1/2, 1/4 or 1/8 resolution, so the full-resolution bitmap never exists.
+    Returns (resized RGB PIL image, (orig_w, orig_h)).
+    """
+    with Image.open(image_path) as img:
+        orig_size = img.size
+        out_h, out_w = get_resize_hw(img.width, img.height, size, max_size)
+        if img.format == "JPEG":
+            # draft() picks the smallest DCT scale that is still >= the requested size
+            img.draft("RGB", (out_w, out_h))
+        rgb = img.convert("RGB")
+
+    if rgb.size != (out_w, out_h):
+        rgb = rgb.resize((out_w, out_h), Image.BILINEAR)
+    return rgb, orig_size
+
+
+class FusedPreprocessor:
+    """
+    Drop-in replacement for Compose([RandomResize([size], max_size), ToTensor(), Normalize(mean, std)]).
+
+    The resize runs on uint8 pixels and uint8 -> float, /255 and (x - mean) / std collapse into a
+    single affine step written into a per-thread buffer that is reused while the input shape
+    stays the same (ToTensor + Normalize allocate two new full-size float tensors per call).
+    """
+
+    def __init__(self, size: int = 800, max_size: int = 1333, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        self.size = size
+        self.max_size = max_size
+        std_t = torch.tensor(std, dtype=torch.float32).view(3, 1, 1)
+        mean_t = torch.tensor(mean, dtype=torch.float32).view(3, 1, 1)
+        # (x / 255 - mean) / std == x * scale + bias
+        self.scale = 1.0 / (255.0 * std_t)
+        self.bias = -mean_t / std_t
+        self._local = threading.local()
+
+    def _buffer(self, h: int, w: int):
+        buf = getattr(self._local, "buffer", None)
+        if buf is None or buf.shape[1] != h or buf.shape[2] != w:
+            buf = torch.empty((3, h, w), dtype=torch.float32)
+            self._local.buffer = buf
+        return buf
+
+    def to_tensor(self, image_pil: Image.Image, reuse_buffer: bool = True) -> torch.Tensor:
+        """
+        uint8 RGB PIL -> normalized float CHW tensor. With reuse_buffer the result is the
+        per-thread buffer and is overwritten by the next call from the same thread; prefetching
+        loaders that keep several results alive pass reuse_buffer=False.
+        """
+        # np.array (not asarray): PIL exposes a read-only buffer torch refuses to wrap
+        arr = np.array(image_pil)
+        u8 = torch.from_numpy(arr).permute(2, 0, 1)
+        if reuse_buffer:
+            buf = self._buffer(arr.shape[0], arr.shape[1])
+        else:
+            buf = torch.empty((3, arr.shape[0], arr.shape[1]), dtype=torch.float32)
+        buf.copy_(u8)
+        buf.mul_(self.scale).add_(self.bias)
+        return buf
+
+    def __call__(self, image_pil, target=None, reuse_buffer: bool = True):
+        if image_pil.mode != "RGB":
+            image_pil = image_pil.convert("RGB")
+        w, h = image_pil.size
+        out_h, out_w = get_resize_hw(w, h, self.size, self.max_size)
+        if (out_w, out_h) != (w, h):
+            image_pil = image_pil.resize((out_w, out_h), Image.BILINEAR)
+
+        if target is not None:
+            target = target.copy()
+            exemplars = target.get("exemplars")
+            if exemplars is not None and exemplars.shape[-1] == 4:
+                ratio_w, ratio_h = out_w / w, out_h / h
+                target["exemplars"] = exemplars * torch.as_tensor([ratio_w, ratio_h, ratio_w, ratio_h])
+            target["size"] = torch.tensor([out_h, out_w])
+
+        return self.to_tensor(image_pil, reuse_buffer=reuse_buffer), target
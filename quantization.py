@@ -0,0 +1,84 @@
+import os
+import hashlib
+
+import torch
+import torch.nn as nn
+
+try:
+    from torch.ao.quantization import quantize_dynamic
+except ImportError:
+    print("Warning: torch.ao.quantization not available. int8 CountGD disabled.")
+    quantize_dynamic = None
+
+# Linear layers that feed box coordinates (sigmoid refinement, deformable sampling positions)
+# stay fp32: int8 error there moves boxes, everywhere else it only nudges scores
+FP32_LINEARS = ("bbox_embed", "sampling_offsets")
+
+
+def int8_linear_names(model: nn.Module, quantize_backbone: bool = False):
+    """
+    Module paths of the nn.Linear layers to quantize: BERT, feat_map, the encoder/decoder FFNs
+    and the MSDeformAttn / BiMultiHeadAttention projections, plus the Swin blocks if asked.
+    Shared modules are listed under every path so each parent gets the swap.
+    """
+    names = set()
+    for name, module in model.named_modules(remove_duplicate=False):
+        # Exact type: nn.MultiheadAttention's out_proj subclass is read as a raw weight
+        if type(module) is not nn.Linear:
+            continue
+        if any(part in name for part in FP32_LINEARS):
+            continue
+        if not quantize_backbone and name.startswith("backbone."):
+            continue
+        names.add(name)
+    return names
+
+
+def quantize_int8(model: nn.Module, quantize_backbone: bool = False) -> nn.Module:
+    """Dynamic int8 (weights int8, activations quantized per call) for the selected Linear layers, in place."""
+    if quantize_dynamic is None:
+        raise RuntimeError("int8 inference needs torch.ao.quantization")
+    return quantize_dynamic(model, int8_linear_names(model, quantize_backbone), dtype=torch.qint8, inplace=True)
+
+
+def int8_cache_path(cache_dir: str, checkpoint_path: str, quantize_backbone: bool = False) -> str:
+    """Cache file for one checkpoint (path, size, mtime) and option set; a new checkpoint gets a new file."""
+    st = os.stat(checkpoint_path)
+    key = "|".join([
+        os.path.abspath(checkpoint_path), str(st.st_size), str(st.st_mtime_ns),
+        str(quantize_backbone), torch.__version__, torch.backends.quantized.engine,
+    ])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"countgd_int8_{digest}.pt")
+
+
+def load_int8(build_model, checkpoint_path: str, load_fp32_weights, cache_dir: str = None,
+              quantize_backbone: bool = False) -> nn.Module:
+    """
+    Builds the int8 variant: build_model() -> fresh fp32 model, load_fp32_weights(model) fills it.
+
+    First run: load the fp32 checkpoint, quantize, then save the quantized state dict to
+    cache_dir. Later runs only quantize the structure and load the cached weights, skipping the
+    fp32 checkpoint read.
+    """
+    cache_path = int8_cache_path(cache_dir, checkpoint_path, quantize_backbone) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            model = quantize_int8(build_model(), quantize_backbone)
+            model.load_state_dict(torch.load(cache_path, map_location="cpu", weights_only=False))
+            print(f"Loaded int8 CountGD from cache {cache_path}")
+            return model
+        except Exception as e:
+            # Stale or corrupt cache (e.g. torch upgrade), rebuild it below
+            print(f"Warning: Could not load int8 cache {cache_path}: {e}. Re-quantizing.")
+
+    model = build_model()
+    load_fp32_weights(model)
+    quantize_int8(model, quantize_backbone)
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        torch.save(model.state_dict(), tmp_path)
+        os.replace(tmp_path, cache_path)
+        print(f"Saved int8 CountGD to cache {cache_path}")
+    return model
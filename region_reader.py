@@ -0,0 +1,286 @@
+import os
+import math
+import hashlib
+import shutil
+import threading
+
+import numpy as np
+from PIL import Image
+
+# Try imports
+try:
+    import tifffile
+    import zarr
+except ImportError:
+    print("Warning: tifffile/zarr not installed. Windowed TIFF reading disabled.")
+    tifffile = None
+    zarr = None
+
+# Gigapixel orthophotos are the whole point here, but PIL's decompression bomb guard
+# (Image.MAX_IMAGE_PIXELS, ~89 Mpx) would refuse to even read their headers. The readers open
+# files with this explicit cap instead; every other decode in the process keeps PIL's guard.
+READER_MAX_PIXELS = 4_000_000_000
+_open_lock = threading.Lock()
+
+# Bytes per pixel of PIL's in-memory layout, for the modes _decode_to_disk can map onto a file
+_MAPPED_MODE_BYTES = {"L": 1, "P": 1, "I;16": 2, "LA": 4, "RGB": 4, "RGBA": 4, "CMYK": 4}
+
+# Above this many pixels an image is never decoded into memory per request
+IN_MEMORY_MAX_PIXELS = 40_000_000
+
+TIFF_EXTENSIONS = {'.tif', '.tiff'}
+
+
+def tile_windows(width: int, height: int, tile_size: int = 640, overlap: float = 0.2):
+    """
+    Yields (x0, y0, x1, y1) windows covering the image with the given overlap ratio.
+    The last row/column is shifted back so every window is full size when the image allows it.
+    """
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+
+    for y0 in starts(height):
+        for x0 in starts(width):
+            yield x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height)
+
+
+def _to_rgb(arr: np.ndarray) -> np.ndarray:
+    if arr.ndim == 2:
+        return np.repeat(arr[:, :, None], 3, axis=2)
+    if arr.shape[2] == 1:
+        return np.repeat(arr, 3, axis=2)
+    if arr.shape[2] > 3:
+        return arr[:, :, :3]
+    return arr
+
+
+class RegionReader:
+    """
+    Reads rectangular windows of an image as RGB uint8 arrays.
+
+    Subclasses decide how much of the file has to be decoded for a window; callers only see
+    width/height and read_region().
+    """
+
+    def __init__(self, image_path: str, width: int, height: int):
+        self.image_path = image_path
+        self.width = width
+        self.height = height
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def read_region(self, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def read_thumbnail(self, max_side: int) -> Image.Image:
+        """Downscaled copy of the whole image with the longest side <= max_side."""
+        step = max(1, max(self.width, self.height) // max_side)
+        strided = self._read_strided(step)
+        img = Image.fromarray(strided)
+        img.thumbnail((max_side, max_side), Image.BILINEAR)
+        return img
+
+    def _read_strided(self, step: int) -> np.ndarray:
+        # Row bands keep the peak at one band of full-resolution pixels
+        band = max(step, (4096 // step) * step)
+        rows = []
+        for y0 in range(0, self.height, band):
+            region = self.read_region(0, y0, self.width, min(y0 + band, self.height))
+            rows.append(region[::step, ::step])
+        return np.concatenate(rows, axis=0)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PILRegionReader(RegionReader):
+    """Images small enough to decode once; windows are views into the decoded array."""
+
+    def __init__(self, image_path: str):
+        img = _open_image(image_path)
+        self.format = img.format
+        super().__init__(image_path, *img.size)
+        self._img = img
+        self._array = None
+
+    def read_region(self, x0, y0, x1, y1):
+        if self._array is None:
+            self._array = np.asarray(self._img.convert("RGB"))
+            self._img.close()
+        return self._array[y0:y1, x0:x1]
+
+    def read_thumbnail(self, max_side):
+        if self._array is None and self.format == "JPEG":
+            return jpeg_draft_thumbnail(self.image_path, max_side)
+        return super().read_thumbnail(max_side)
+
+    def close(self):
+        self._img.close()
+        self._array = None
+
+
+class TiffRegionReader(RegionReader):
+    """Tiled/striped (Big)TIFF: only the TIFF tiles or strips that overlap a window are decoded."""
+
+    def __init__(self, image_path: str):
+        self._tif = tifffile.TiffFile(image_path)
+        series = self._tif.series[0]
+        self._axes = series.axes
+        self._array = zarr.open(series.aszarr(level=0), mode="r")
+        super().__init__(image_path, series.shape[self._axes.index("X")], series.shape[self._axes.index("Y")])
+
+    def read_region(self, x0, y0, x1, y1):
+        if self._axes.startswith("S"):
+            # Planar configuration: (S, Y, X)
+            region = np.moveaxis(self._array[:, y0:y1, x0:x1], 0, -1)
+        else:
+            region = self._array[y0:y1, x0:x1]
+        if region.dtype != np.uint8:
+            region = _scale_to_uint8(region)
+        return _to_rgb(region)
+
+    def close(self):
+        self._tif.close()
+
+
+def _scale_to_uint8(region: np.ndarray) -> np.ndarray:
+    if np.issubdtype(region.dtype, np.integer):
+        shift = max(0, np.iinfo(region.dtype).bits - 8)
+        return (region >> shift).astype(np.uint8)
+    return np.clip(region * 255.0, 0, 255).astype(np.uint8)
+
+
+class MemmapRegionReader(RegionReader):
+    """
+    Formats without random access (JPEG, PNG, WebP...): decoded once into a raw .npy cache and
+    memory mapped afterwards, so every later window only touches the pages it covers.
+    """
+
+    def __init__(self, image_path: str, cache_dir: str):
+        cache_path = os.path.join(cache_dir, _cache_key(image_path) + ".npy")
+        if not os.path.exists(cache_path):
+            _write_raw_cache(image_path, cache_path)
+        self._array = np.load(cache_path, mmap_mode="r")
+        super().__init__(image_path, self._array.shape[1], self._array.shape[0])
+
+    def read_region(self, x0, y0, x1, y1):
+        return np.asarray(self._array[y0:y1, x0:x1])
+
+    def close(self):
+        self._array = None
+
+
+def _cache_key(image_path: str) -> str:
+    st = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _open_image(image_path: str) -> Image.Image:
+    """Image.open with READER_MAX_PIXELS instead of PIL's decompression bomb limit."""
+    with _open_lock:
+        # The guard is a module global that Image.open only reads while parsing the header, so
+        # it is lifted for that call alone (the lock keeps concurrent opens from restoring it early)
+        default = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            img = Image.open(image_path)
+        finally:
+            Image.MAX_IMAGE_PIXELS = default
+    if img.width * img.height > READER_MAX_PIXELS:
+        img.close()
+        raise Image.DecompressionBombError(
+            f"{image_path} has {img.width * img.height} pixels, more than READER_MAX_PIXELS ({READER_MAX_PIXELS})")
+    return img
+
+
+def _decode_to_disk(img: Image.Image, scratch_path: str):
+    """
+    Loads img with its pixel buffer mapped onto scratch_path instead of the heap: JPEG, PNG and
+    WebP only decode whole frames, and this way a gigapixel frame lives in the page cache
+    (written back and evicted as needed) rather than in process memory. Returns the mapping,
+    which must outlive img, or None for modes whose PIL layout is not known here.
+    """
+    bytes_per_pixel = _MAPPED_MODE_BYTES.get(img.mode)
+    if bytes_per_pixel is None or not hasattr(Image.core, "map_buffer"):
+        return None
+    width, height = img.size
+    stride = width * bytes_per_pixel
+    scratch = np.memmap(scratch_path, dtype=np.uint8, mode="w+", shape=(height, stride))
+    # load() keeps an image core whose mode and size already match and decodes into it
+    img.im = Image.core.map_buffer(scratch, img.size, "raw", 0, (img.mode, stride, 1))
+    img.load()
+    return scratch
+
+
+def _write_raw_cache(image_path: str, cache_path: str):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + ".tmp.npy"
+    scratch_path = cache_path + ".decode.tmp"
+    try:
+        with _open_image(image_path) as img:
+            width, height = img.size
+            scratch = _decode_to_disk(img, scratch_path)
+            if scratch is None:
+                print(f"Warning: Decoding {image_path} ({img.mode}) in memory for the region cache.")
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=(height, width, 3))
+            # Only one band is converted to RGB in memory at a time
+            band = 1024
+            for y0 in range(0, height, band):
+                y1 = min(y0 + band, height)
+                out[y0:y1] = np.asarray(img.crop((0, y0, width, y1)).convert("RGB"))
+            out.flush()
+            del out
+        del scratch
+    finally:
+        if os.path.exists(scratch_path):
+            os.remove(scratch_path)
+    os.replace(tmp_path, cache_path)
+
+
+def jpeg_draft_thumbnail(image_path: str, max_side: int) -> Image.Image:
+    """
+    Uses libjpeg's DCT scaling (1/2, 1/4, 1/8) so a reduced-size JPEG is never decoded at
+    full resolution first.
+    """
+    with _open_image(image_path) as img:
+        scale = max_side / max(img.size)
+        img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+        out = img.convert("RGB")
+    out.thumbnail((max_side, max_side), Image.BILINEAR)
+    return out
+
+
+def open_region_reader(image_path: str, cache_dir: str = None, max_in_memory_pixels: int = IN_MEMORY_MAX_PIXELS):
+    """Picks the cheapest reader for the file: windowed TIFF, in-memory, or memmapped raw cache."""
+    ext = os.path.splitext(image_path)[1].lower()
+    if ext in TIFF_EXTENSIONS and tifffile is not None:
+        try:
+            return TiffRegionReader(image_path)
+        except Exception as e:
+            print(f"Warning: Windowed TIFF read failed for {image_path} ({e}), falling back to PIL.")
+
+    reader = PILRegionReader(image_path)
+    if reader.width * reader.height <= max_in_memory_pixels or cache_dir is None:
+        return reader
+    reader.close()
+    return MemmapRegionReader(image_path, cache_dir)
+
+
+def clear_cache(cache_dir: str):
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir, ignore_errors=True)
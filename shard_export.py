@@ -0,0 +1,212 @@
+import io
+import os
+import json
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    print("Warning: pyarrow not installed. Parquet shard export disabled.")
+    pa = None
+    pq = None
+
+SHARD_FORMATS = ("webdataset", "parquet")
+DEFAULT_SHARD_SIZE_MB = 256
+# Parquet row groups are flushed at about this many image bytes
+PARQUET_ROW_GROUP_BYTES = 64 * 1024 * 1024
+
+
+def plan_shards(entries, shard_size_bytes):
+    """Splits entries (in dataset order) into consecutive shards of at most shard_size_bytes."""
+    shards, current, current_bytes = [], [], 0
+    for entry in entries:
+        if current and current_bytes + entry["size"] > shard_size_bytes:
+            shards.append(current)
+            current, current_bytes = [], 0
+        current.append(entry)
+        current_bytes += entry["size"]
+    if current:
+        shards.append(current)
+    return shards
+
+
+def sample_record(engine, key, entry):
+    """Per-image annotation record stored next to the image bytes."""
+    boxes = engine.all_annotations.get(entry["name"], [])
+    return {
+        "key": key,
+        "file_name": entry["name"],
+        "width": entry["width"],
+        "height": entry["height"],
+        "annotations": [
+            {
+                "bbox": [box["x"], box["y"], box["width"], box["height"]],
+                "category_id": engine.category_map[box.get("label", "object")],
+                "label": box.get("label", "object"),
+            }
+            for box in boxes
+        ],
+    }
+
+
+def _read(engine, entry):
+    with open(os.path.join(engine.images_dir, entry["name"]), "rb") as f:
+        return f.read()
+
+
+def _discard(tmp_path):
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+
+def write_tar_shard(engine, path, shard, check=None):
+    """
+    WebDataset layout: every sample is <key>.<image ext> + <key>.json, adjacent in the tar.
+    Keys are the global sample index, original file names (which may contain dots) go in the JSON.
+    check() runs before every sample and aborts the shard by raising.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        _write_tar(engine, tmp_path, shard, check)
+    except BaseException:
+        _discard(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return len(shard)
+
+
+def _write_tar(engine, tmp_path, shard, check):
+    with tarfile.open(tmp_path, "w") as tar:
+        for index, entry in shard:
+            if check is not None:
+                check()
+            key = f"{index:09d}"
+            ext = os.path.splitext(entry["name"])[1].lower() or ".bin"
+            record = json.dumps(sample_record(engine, key, entry)).encode("utf-8")
+            for name, data in ((key + ext, _read(engine, entry)), (key + ".json", record)):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(entry["mtime"])
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(data))
+
+
+def _parquet_schema():
+    return pa.schema([
+        ("key", pa.string()),
+        ("file_name", pa.string()),
+        ("width", pa.int32()),
+        ("height", pa.int32()),
+        ("image", pa.binary()),
+        ("bboxes", pa.list_(pa.list_(pa.float32(), 4))),
+        ("category_ids", pa.list_(pa.int32())),
+    ])
+
+
+def write_parquet_shard(engine, path, shard, check=None):
+    """
+    One Parquet file per shard: image bytes plus [N, 4] xywh boxes and category ids per row.
+    check() runs before every sample and aborts the shard by raising.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        _write_parquet(engine, tmp_path, shard, check)
+    except BaseException:
+        _discard(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return len(shard)
+
+
+def _write_parquet(engine, tmp_path, shard, check):
+    schema = _parquet_schema()
+    columns = {name: [] for name in schema.names}
+    pending_bytes = 0
+
+    def flush(writer):
+        writer.write_table(pa.table(columns, schema=schema))
+        for values in columns.values():
+            values.clear()
+
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for index, entry in shard:
+            if check is not None:
+                check()
+            record = sample_record(engine, f"{index:09d}", entry)
+            data = _read(engine, entry)
+            columns["key"].append(record["key"])
+            columns["file_name"].append(entry["name"])
+            columns["width"].append(entry["width"])
+            columns["height"].append(entry["height"])
+            columns["image"].append(data)
+            columns["bboxes"].append([a["bbox"] for a in record["annotations"]])
+            columns["category_ids"].append([a["category_id"] for a in record["annotations"]])
+            pending_bytes += len(data)
+            if pending_bytes >= PARQUET_ROW_GROUP_BYTES:
+                flush(writer)
+                pending_bytes = 0
+        if columns["key"]:
+            flush(writer)
+
+
+def write_shards(engine, out_dir, shard_format="webdataset", shard_size_mb=DEFAULT_SHARD_SIZE_MB,
+                 check_cancelled=None):
+    """
+    Writes the dataset as fixed-size shards, several shards at a time (one per worker), plus a
+    dataset.json with categories and the shard list. Loaders then read each shard sequentially
+    instead of opening one small file per image. Returns the shard file names.
+
+    check_cancelled() (e.g. Job.check_cancelled) is called before every sample in every worker;
+    once it raises, or a shard fails, queued shards are dropped and running ones stop.
+    """
+    if shard_format not in SHARD_FORMATS:
+        raise ValueError(f"Unknown shard format: {shard_format}")
+    if shard_format == "parquet" and pq is None:
+        raise RuntimeError("Parquet export needs pyarrow")
+    if os.path.isdir(out_dir) and os.listdir(out_dir):
+        raise ValueError(f"Export directory {out_dir} is not empty")
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Global sample indices keep keys unique across shards
+    shards, start = [], 0
+    for shard in plan_shards(engine.entries, shard_size_mb * 1024 * 1024):
+        shards.append(list(enumerate(shard, start)))
+        start += len(shard)
+
+    ext = ".tar" if shard_format == "webdataset" else ".parquet"
+    write_fn = write_tar_shard if shard_format == "webdataset" else write_parquet_shard
+    names = [f"shard-{i:06d}{ext}" for i in range(len(shards))]
+
+    stop = threading.Event()
+
+    def check():
+        if stop.is_set():
+            raise RuntimeError("Shard export aborted")
+        if check_cancelled is not None:
+            check_cancelled()
+
+    done = 0
+    engine.progress(0, engine.total, f"Writing {len(shards)} shards...")
+    with ThreadPoolExecutor(max_workers=engine.workers, thread_name_prefix="shard") as pool:
+        futures = [pool.submit(write_fn, engine, os.path.join(out_dir, name), shard, check)
+                   for name, shard in zip(names, shards)]
+        try:
+            for future in futures:
+                done += future.result()
+                engine.progress(done, engine.total, f"Writing shards {done}/{engine.total}")
+        except BaseException:
+            stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+
+    with open(os.path.join(out_dir, "dataset.json"), "w") as f:
+        json.dump({
+            "format": shard_format,
+            "num_samples": engine.total,
+            "shards": names,
+            "categories": [{"id": cid, "name": name} for name, cid in engine.category_map.items()],
+        }, f, indent=4)
+    return names
@@ -0,0 +1,148 @@
+import os
+import threading
+from collections import OrderedDict, deque
+
+import cancellation
+from inference_scheduler import PREEMPTED
+
+
+def file_stamp(path):
+    """(mtime_ns, size) of an image, so a result is never served for a replaced file."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class SpeculativeAnnotator:
+    """
+    Precomputes auto-annotations for the images the user is about to open.
+
+    The client reports the upcoming images (N+1..N+k) and the worker runs them one at a time
+    with the parameters of the last interactive request, in the background lane: the model gate
+    preempts a background unit as soon as anything else wants the model, and the preempted image
+    goes back to the front of the queue. Results are kept per image (LRU, `capacity` entries)
+    and handed out once by take(); changing model, prompt or any other parameter drops them all.
+
+    run_fn(image_path, params, cancel_token) -> boxes does the actual inference.
+    """
+
+    def __init__(self, run_fn, capacity: int = 8):
+        self.run_fn = run_fn
+        self.capacity = capacity
+        self._cond = threading.Condition()
+        self._params = None
+        self._generation = 0
+        self._queue = deque()
+        self._results = OrderedDict()
+        self._current = None
+        self._thread = None
+        self._stopped = False
+        self._stats = {"hits": 0, "misses": 0, "computed": 0, "preempted": 0, "discarded": 0, "failed": 0}
+
+    def set_params(self, params: dict):
+        """Called with every interactive request; other parameters invalidate all speculative work."""
+        with self._cond:
+            if params == self._params:
+                return
+            self._params = dict(params)
+            self._generation += 1
+            self._stats["discarded"] += len(self._results)
+            self._results.clear()
+            self._queue.clear()
+            if self._current is not None:
+                self._current[1].cancel("parameters changed")
+
+    def schedule(self, image_paths):
+        """Replaces the queue with image_paths (nearest first). Returns how many were queued."""
+        with self._cond:
+            if self._params is None or self._stopped:
+                return 0
+            self._queue.clear()
+            for path in image_paths:
+                if path in self._results or (self._current is not None and self._current[0] == path):
+                    continue
+                self._queue.append(path)
+            if self._current is not None and self._current[0] not in image_paths:
+                # User jumped elsewhere, the image being computed is no longer upcoming
+                self._current[1].cancel("no longer upcoming")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="speculative", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return len(self._queue)
+
+    def take(self, image_path: str, params: dict):
+        """Boxes precomputed for image_path with exactly these params, or None (then run it normally)."""
+        with self._cond:
+            if params != self._params:
+                self._stats["misses"] += 1
+                return None
+            entry = self._results.pop(image_path, None)
+            if entry is not None and entry[0] == file_stamp(image_path):
+                self._stats["hits"] += 1
+                return entry[1]
+            self._stats["misses"] += 1
+            # The caller computes it now, do not do the same work in the background
+            if image_path in self._queue:
+                self._queue.remove(image_path)
+            if self._current is not None and self._current[0] == image_path:
+                self._current[1].cancel("requested interactively")
+            return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._stopped and not self._queue:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                path = self._queue.popleft()
+                params, generation = self._params, self._generation
+                token = cancellation.CancellationToken()
+                self._current = (path, token)
+                stamp = file_stamp(path)
+
+            try:
+                boxes = self.run_fn(path, params, token)
+            except cancellation.OperationCancelled:
+                with self._cond:
+                    self._current = None
+                    if token.reason == PREEMPTED:
+                        self._stats["preempted"] += 1
+                        if generation == self._generation and path not in self._queue:
+                            self._queue.appendleft(path)
+                continue
+            except Exception as e:
+                print(f"Speculative annotation of {path} failed: {e}")
+                with self._cond:
+                    self._current = None
+                    self._stats["failed"] += 1
+                continue
+
+            with self._cond:
+                self._current = None
+                if generation != self._generation or token.cancelled:
+                    continue
+                self._results[path] = (stamp, boxes)
+                self._stats["computed"] += 1
+                while len(self._results) > self.capacity:
+                    self._results.popitem(last=False)
+
+    def stats(self):
+        with self._cond:
+            return {
+                **self._stats,
+                "queued": len(self._queue),
+                "cached": len(self._results),
+                "running": self._current[0] if self._current is not None else None,
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._queue.clear()
+            if self._current is not None:
+                self._current[1].cancel("shutdown")
+            self._cond.notify_all()
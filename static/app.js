@@ -1,5 +1,6 @@
 const state = {
     images: [],
+    imageMeta: {}, // Map of image_name -> {width, height} from the server-side index
     currentImageIndex: -1,
     annotations: {}, // Map of image_name -> [boxes]
     isDrawing: false,
@@ -7,6 +8,7 @@ const state = {
     startY: 0,
     currentLabel: 'object',
     imageObj: null, // The current Image object
+    pyramid: null, // {hash, descriptor, preview, tiles} when the current image is rendered from tiles
 
     // The View System (Transform based)
     view: {
@@ -58,6 +60,8 @@ const els = {
     // Auto Annotate
     aaModelType: document.getElementById('aa-model-type'),
     aaTiled: document.getElementById('aa-tiled'), // New
+    aaProgressive: document.getElementById('aa-progressive'),
+    aaSpeculative: document.getElementById('aa-speculative'),
     sectionCountGD: document.getElementById('section-countgd'),
     sectionCustomModel: document.getElementById('section-custom-model'),
 
@@ -101,6 +105,14 @@ const els = {
 
 const ctx = els.canvas.getContext('2d');
 
+// Images larger than this (longest side) are rendered from the server-side tile pyramid
+const PYRAMID_MIN_SIDE = 4096;
+const MAX_CACHED_TILES = 256;
+// Anything else (e.g. TIFF) can only be displayed through the server-side JPEG preview
+const BROWSER_FORMATS = ['JPEG', 'PNG', 'BMP', 'WEBP', 'GIF'];
+// Images ahead of the current one that get auto-annotated in the background
+const SPECULATIVE_LOOKAHEAD = 3;
+
 // --- Initialization ---
 
 function logToDiv(msg) {
@@ -126,6 +138,7 @@ function setupEventListeners() {
 
     // Auto Annotate
     els.aaConf.addEventListener('input', (e) => els.aaConfVal.innerText = e.target.value);
+    els.aaSpeculative.addEventListener('change', () => scheduleSpeculative(state.currentImageIndex));
 
     els.aaModelType.addEventListener('change', handleModelTypeChange);
     els.btnUploadModel.addEventListener('click', () => els.inputModelFile.click());
@@ -173,6 +186,13 @@ function setupEventListeners() {
     // Zoom via Wheel
     els.canvasWrapper.addEventListener('wheel', handleWheel, { passive: false });
 
+    // Tiled rendering uses a viewport-sized canvas, keep it in sync with the wrapper
+    window.addEventListener('resize', () => {
+        if (!state.pyramid) return;
+        resizeViewportCanvas();
+        redraw();
+    });
+
     // Buttons (Keep as accessible alternative)
     els.zoomInBtn.addEventListener('click', () => updateZoomStep(0.2));
     els.zoomOutBtn.addEventListener('click', () => updateZoomStep(-0.2));
@@ -237,6 +257,7 @@ async function fetchImageList() {
         const res = await fetch('/api/images');
         const data = await res.json();
         state.images = data.images;
+        state.imageMeta = data.metadata || {};
         updateImageListUI();
 
         if (state.images.length > 0) {
@@ -463,6 +484,20 @@ function handleVideoSelect(e) {
     // We don't upload yet, we wait for 'Extract' click
 }
 
+const FINISHED_JOB_STATES = ['completed', 'failed', 'cancelled', 'interrupted'];
+
+// Polls the unified job API until the job finishes; onUpdate gets every status record
+async function waitForJob(jobId, onUpdate, intervalMs = 1000) {
+    while (true) {
+        await new Promise(r => setTimeout(r, intervalMs));
+        const res = await fetch(`/api/jobs/${jobId}`);
+        if (!res.ok) continue; // Skip this tick if network blip
+        const job = await res.json();
+        if (onUpdate) onUpdate(job);
+        if (FINISHED_JOB_STATES.includes(job.status)) return job;
+    }
+}
+
 async function handleExtractFrames() {
     const file = els.videoInput.files[0];
     if (!file) return;
@@ -479,8 +514,12 @@ async function handleExtractFrames() {
             method: 'POST',
             body: formData
         });
-        const data = await res.json();
-        console.log("Extracted", data);
+        const { job_id } = await res.json();
+        const job = await waitForJob(job_id, (job) => {
+            els.extractBtn.innerText = job.total > 0 ? `Extracting ${job.current}/${job.total}...` : "Processing...";
+        });
+        if (job.status !== 'completed') throw new Error(job.error || job.status);
+        console.log("Extracted", job.count);
         await fetchImageList();
         els.fpsControl.classList.add('hidden'); // Hide after done
     } catch (err) {
@@ -541,6 +580,84 @@ async function handleImagesUpload(e) {
     }
 }
 
+// Server precomputes boxes for the next images with the last-used model and prompt (idle model time only)
+function scheduleSpeculative(index) {
+    const upcoming = (els.aaSpeculative.checked && index >= 0)
+        ? state.images.slice(index + 1, index + 1 + SPECULATIVE_LOOKAHEAD)
+        : [];
+    fetch('/api/speculate', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ image_names: upcoming })
+    }).catch(err => console.warn("Speculative scheduling failed:", err));
+}
+
+// In-flight single-image annotation; aborting the fetch cancels the inference server-side
+let autoAnnotateController = null;
+
+function cancelAutoAnnotate() {
+    if (autoAnnotateController) {
+        autoAnnotateController.abort();
+        autoAnnotateController = null;
+    }
+}
+
+// Calls onMessage for every JSON line of an NDJSON response as it arrives
+async function readNdjson(res, onMessage) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (line) await onMessage(JSON.parse(line));
+        }
+    }
+}
+
+function autoAnnotateSummary(boxes) {
+    const counts = {};
+    boxes.forEach(b => {
+        counts[b.label] = (counts[b.label] || 0) + 1;
+    });
+    return Object.entries(counts).map(([k, v]) => `${v} ${k}`).join(', ');
+}
+
+// Progressive mode: preview boxes are shown (and saved) right away, the refined boxes replace them
+async function applyProgressiveAnnotations(res, imageName) {
+    let previewIds = new Set();
+    await readNdjson(res, async (msg) => {
+        if (msg.stage === 'error') throw new Error(msg.detail);
+
+        if (!state.annotations[imageName]) state.annotations[imageName] = [];
+        const boxes = state.annotations[imageName];
+        if (msg.stage === 'final') {
+            for (let i = boxes.length - 1; i >= 0; i--) {
+                if (previewIds.has(boxes[i].id)) boxes.splice(i, 1);
+            }
+        }
+        boxes.push(...msg.boxes);
+        if (msg.stage === 'preview') previewIds = new Set(msg.boxes.map(b => b.id));
+
+        await saveAnnotations(imageName);
+        if (state.images[state.currentImageIndex] === imageName) redraw();
+
+        const summary = autoAnnotateSummary(msg.boxes);
+        if (msg.stage === 'preview') {
+            els.aaStatus.innerText = `Preview: ${summary || "no objects"}. Refining...`;
+            els.aaBtn.innerText = "Refining...";
+        } else {
+            els.aaStatus.innerText = summary ? `Found: ${summary}` : "No objects found.";
+            setTimeout(() => els.aaStatus.innerText = "", 5000);
+        }
+    });
+}
+
 async function handleAutoAnnotate() {
     if (state.currentImageIndex < 0) return;
     const imageName = state.images[state.currentImageIndex];
@@ -568,12 +685,14 @@ async function handleAutoAnnotate() {
     els.aaBtn.innerText = "Running...";
     els.aaStatus.innerText = "Loading model & inferencing...";
 
+    let controller = null;
     try {
         const payload = {
             image_name: imageName,
             confidence_thresh: parseFloat(els.aaConf.value),
             model_type: type,
-            tiled: els.aaTiled.checked
+            tiled: els.aaTiled.checked,
+            progressive: els.aaProgressive.checked
         };
 
         if (prompt) payload.text_prompt = prompt;
@@ -581,10 +700,14 @@ async function handleAutoAnnotate() {
 
 
 
+        cancelAutoAnnotate();
+        controller = new AbortController();
+        autoAnnotateController = controller;
         const res = await fetch('/api/auto_annotate', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(payload)
+            body: JSON.stringify(payload),
+            signal: controller.signal
         });
 
         if (!res.ok) {
@@ -592,6 +715,11 @@ async function handleAutoAnnotate() {
             throw new Error(errData.detail || res.statusText);
         }
 
+        if (payload.progressive) {
+            await applyProgressiveAnnotations(res, imageName);
+            return;
+        }
+
         const data = await res.json();
         const newBoxes = data.boxes;
 
@@ -601,20 +729,26 @@ async function handleAutoAnnotate() {
         await saveAnnotations(imageName);
         redraw();
 
-        const counts = {};
-        newBoxes.forEach(b => {
-            counts[b.label] = (counts[b.label] || 0) + 1;
-        });
-        const summary = Object.entries(counts).map(([k, v]) => `${v} ${k}`).join(', ');
+        const summary = autoAnnotateSummary(newBoxes);
 
         els.aaStatus.innerText = summary ? `Found: ${summary}` : "No objects found.";
+        if (data.quality && data.quality.level > 0) {
+            // Server was busy and ran at reduced resolution/queries to keep latency down
+            els.aaStatus.innerText += ` (${data.quality.name} quality, server busy)`;
+        }
         setTimeout(() => els.aaStatus.innerText = "", 5000);
 
     } catch (err) {
+        if (err.name === 'AbortError') {
+            // User moved to another image, the server stops the abandoned inference
+            els.aaStatus.innerText = "Auto-annotation cancelled.";
+            return;
+        }
         console.error(err);
         els.aaStatus.innerText = "Error during annotation.";
         alert("Auto-annotation failed: " + err.message);
     } finally {
+        if (autoAnnotateController === controller) autoAnnotateController = null;
         els.aaBtn.disabled = false;
         els.aaBtn.innerText = "Run Auto-Annotation";
     }
@@ -630,8 +764,10 @@ function showEmptyState() {
 
 async function loadImage(index) {
     if (index < 0 || index >= state.images.length) return;
+    if (index !== state.currentImageIndex) cancelAutoAnnotate();
 
     state.currentImageIndex = index;
+    if (els.aaSpeculative.checked) scheduleSpeculative(index);
     const imageName = state.images[index];
 
     // Update UI highlights
@@ -642,31 +778,81 @@ async function loadImage(index) {
 
     els.emptyState.style.display = 'none';
     els.canvasContainer.style.display = 'block';
-    els.filenameDisplay.innerText = imageName;
+    const meta = state.imageMeta[imageName];
+    els.filenameDisplay.innerText = (meta && meta.width)
+        ? `${imageName} (${meta.width}×${meta.height})`
+        : imageName;
     els.counter.innerText = `${index + 1} / ${state.images.length}`;
 
     // Fetch Annotations
     await fetchAnnotations(imageName);
 
+    // Huge images: render from preview + tiles instead of the full-resolution bitmap
+    const needsPyramid = meta && (
+        Math.max(meta.width || 0, meta.height || 0) > PYRAMID_MIN_SIDE ||
+        (meta.format && !BROWSER_FORMATS.includes(meta.format))
+    );
+    if (needsPyramid) {
+        if (await loadPyramid(imageName, index)) return;
+    }
+    if (state.currentImageIndex !== index) return;
+
     // Load Image onto Canvas
     const img = new Image();
     img.src = `/images/${imageName}`; // Served by FastAPI
     img.onload = () => {
+        if (state.currentImageIndex !== index) return;
+        state.pyramid = null;
         state.imageObj = img;
-        // Set canvas dimensions to natural image size
-        els.canvas.width = img.naturalWidth;
-        els.canvas.height = img.naturalHeight;
+        // Set canvas dimensions to natural image size (indexed size when known)
+        els.canvas.width = (meta && meta.width) || img.naturalWidth;
+        els.canvas.height = (meta && meta.height) || img.naturalHeight;
         fitImageToScreen(); // Adjust view to fit
     };
 }
 
+async function loadPyramid(imageName, index) {
+    try {
+        const res = await fetch(`/api/images/${imageName}/pyramid`);
+        if (!res.ok) return false;
+        const info = await res.json();
+        if (!info.ready) return false;
+
+        const preview = new Image();
+        preview.src = `/api/pyramids/${info.hash}/preview.jpg`;
+        await preview.decode();
+        if (state.currentImageIndex !== index) return true;
+
+        state.pyramid = { hash: info.hash, descriptor: info.descriptor, preview, tiles: new Map() };
+        state.imageObj = preview;
+        resizeViewportCanvas();
+        fitImageToScreen();
+        return true;
+    } catch (err) {
+        console.error("Failed to load tile pyramid, falling back to full image", err);
+        return false;
+    }
+}
+
+function resizeViewportCanvas() {
+    els.canvas.width = els.canvasWrapper.clientWidth;
+    els.canvas.height = els.canvasWrapper.clientHeight;
+}
+
+// Size of the image in image coordinates (the preview is smaller than the real image)
+function getImageSize() {
+    if (state.pyramid) {
+        return { w: state.pyramid.descriptor.width, h: state.pyramid.descriptor.height };
+    }
+    return { w: state.imageObj.naturalWidth, h: state.imageObj.naturalHeight };
+}
+
 function fitImageToScreen() {
     if (!state.imageObj) return;
 
     const wrapperW = els.canvasWrapper.clientWidth;
     const wrapperH = els.canvasWrapper.clientHeight;
-    const imgW = state.imageObj.naturalWidth;
-    const imgH = state.imageObj.naturalHeight;
+    const { w: imgW, h: imgH } = getImageSize();
 
     // Calculate scale to fit image within wrapper, with some padding
     const scale = Math.min((wrapperW - 40) / imgW, (wrapperH - 40) / imgH, 1);
@@ -681,10 +867,26 @@ function fitImageToScreen() {
 }
 
 function updateTransform() {
-    els.canvasContainer.style.transform = `translate(${state.view.x}px, ${state.view.y}px) scale(${state.view.scale})`;
+    if (state.pyramid) {
+        // Viewport canvas: the view transform is applied while drawing
+        els.canvasContainer.style.transform = 'none';
+        scheduleRedraw();
+    } else {
+        els.canvasContainer.style.transform = `translate(${state.view.x}px, ${state.view.y}px) scale(${state.view.scale})`;
+    }
     els.zoomDisplay.innerText = Math.round(state.view.scale * 100) + "%";
 }
 
+let redrawPending = false;
+function scheduleRedraw() {
+    if (redrawPending) return;
+    redrawPending = true;
+    requestAnimationFrame(() => {
+        redrawPending = false;
+        redraw();
+    });
+}
+
 function getMousePos(e) {
     // Convert screen coordinates to image coordinates (canvas drawing coordinates)
     const rect = els.canvasWrapper.getBoundingClientRect();
@@ -1058,11 +1260,17 @@ function handleMouseUp(e) {
 function redraw() {
     if (!state.imageObj) return;
 
-    // Clear canvas (which is now natural image size)
+    ctx.setTransform(1, 0, 0, 1, 0, 0);
     ctx.clearRect(0, 0, els.canvas.width, els.canvas.height);
 
-    // Draw Image (1:1 on canvas, scaling handled by CSS transform)
-    ctx.drawImage(state.imageObj, 0, 0, els.canvas.width, els.canvas.height);
+    if (state.pyramid) {
+        // Viewport-sized canvas, draw in image coordinates through the view transform
+        ctx.setTransform(state.view.scale, 0, 0, state.view.scale, state.view.x, state.view.y);
+        drawTiles();
+    } else {
+        // Canvas is natural image size, scaling handled by CSS transform
+        ctx.drawImage(state.imageObj, 0, 0, els.canvas.width, els.canvas.height);
+    }
 
     // Draw Annotations
     const imageName = state.images[state.currentImageIndex];
@@ -1078,6 +1286,64 @@ function redraw() {
     else els.deleteSelectedBtn.classList.add('disabled-look');
 }
 
+function drawTiles() {
+    const p = state.pyramid;
+    const d = p.descriptor;
+    const scale = state.view.scale;
+
+    // Preview underneath so tiles that are still loading never show as holes
+    ctx.drawImage(p.preview, 0, 0, d.width, d.height);
+    if (!d.levels.length) return; // Small non-browser format: the preview is the image
+
+    // Coarsest level that still has at least one texel per screen pixel
+    let level = d.levels[0];
+    for (const l of d.levels) {
+        if (l.scale >= scale) level = l;
+    }
+    const sx = level.width / d.width;
+    const sy = level.height / d.height;
+    const ts = d.tile_size;
+
+    // Visible region in image coordinates
+    const x0 = Math.max(0, -state.view.x / scale);
+    const y0 = Math.max(0, -state.view.y / scale);
+    const x1 = Math.min(d.width, (els.canvas.width - state.view.x) / scale);
+    const y1 = Math.min(d.height, (els.canvas.height - state.view.y) / scale);
+    if (x1 <= x0 || y1 <= y0) return;
+
+    const c0 = Math.floor(x0 * sx / ts), c1 = Math.min(level.cols - 1, Math.floor(x1 * sx / ts));
+    const r0 = Math.floor(y0 * sy / ts), r1 = Math.min(level.rows - 1, Math.floor(y1 * sy / ts));
+
+    for (let r = r0; r <= r1; r++) {
+        for (let c = c0; c <= c1; c++) {
+            const tile = getTile(level.level, c, r);
+            if (!tile.complete || !tile.naturalWidth) continue;
+            ctx.drawImage(tile, (c * ts) / sx, (r * ts) / sy, tile.naturalWidth / sx, tile.naturalHeight / sy);
+        }
+    }
+}
+
+function getTile(level, col, row) {
+    const p = state.pyramid;
+    const key = `${level}/${col}_${row}`;
+    let tile = p.tiles.get(key);
+    if (tile) {
+        // LRU: move to the most recently used position
+        p.tiles.delete(key);
+        p.tiles.set(key, tile);
+        return tile;
+    }
+
+    tile = new Image();
+    tile.onload = scheduleRedraw;
+    tile.src = `/api/pyramids/${p.hash}/${key}.jpg`;
+    p.tiles.set(key, tile);
+    if (p.tiles.size > MAX_CACHED_TILES) {
+        p.tiles.delete(p.tiles.keys().next().value);
+    }
+    return tile;
+}
+
 function drawBox(box, isSelected) {
     // Line width should be invariant of zoom, so scale it by inverse of view scale
     const lw = (isSelected ? 3 : 2) / state.view.scale;
@@ -1209,64 +1475,45 @@ async function handleAutoAnnotateAll() {
     els.aaBtn.disabled = true;
 
     const total = state.images.length;
-    let processed = 0;
-    const errors = [];
-
     els.aaStatus.innerText = `Starting batch process (0/${total})...`;
 
-    // Base payload
-    const basePayload = {
+    // The server runs the whole batch (prefetching decodes while the model works)
+    const payload = {
         confidence_thresh: parseFloat(els.aaConf.value),
         model_type: type,
         tiled: els.aaTiled.checked
     };
-    if (prompt) basePayload.text_prompt = prompt;
-    if (filename) basePayload.model_filename = filename;
-
-
+    if (prompt) payload.text_prompt = prompt;
+    if (filename) payload.model_filename = filename;
 
-    for (const imageName of state.images) {
-        processed++;
-        els.aaStatus.innerText = `Processing ${processed}/${total}: ${imageName}`;
-
-        try {
-            const payload = { ...basePayload, image_name: imageName };
-
-            const res = await fetch('/api/auto_annotate', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(payload)
-            });
+    try {
+        const startRes = await fetch('/api/auto_annotate_all/start', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(payload)
+        });
+        if (!startRes.ok) throw new Error("Failed to start batch annotation");
+        const { job_id } = await startRes.json();
 
-            if (res.ok) {
-                const data = await res.json();
-                const newBoxes = data.boxes;
-
-                // Append
-                if (!state.annotations[imageName]) state.annotations[imageName] = [];
-                state.annotations[imageName].push(...newBoxes);
-                await saveAnnotations(imageName);
-            } else {
-                errors.push(imageName);
-                console.error(`Failed ${imageName}`);
-            }
-        } catch (err) {
-            console.error(err);
-            errors.push(imageName);
-        }
+        const job = await waitForJob(job_id, (job) => { els.aaStatus.innerText = job.message; });
+        if (job.status !== 'completed') throw new Error(job.error || job.status);
 
-        // Slight delay to allow UI update
-        await new Promise(r => setTimeout(r, 50));
+        let msg = `Batch Complete. Processed ${job.total}.`;
+        if (job.errors.length > 0) msg += ` Errors in ${job.errors.length} images.`;
+        els.aaStatus.innerText = msg;
+    } catch (err) {
+        console.error(err);
+        els.aaStatus.innerText = "Error during batch annotation.";
+        alert("Batch auto-annotation failed: " + err.message);
+    } finally {
+        els.aaBtnAll.disabled = false;
+        els.aaBtn.disabled = false;
     }
 
-    els.aaBtnAll.disabled = false;
-    els.aaBtn.disabled = false;
-
-    let msg = `Batch Complete. Processed ${total}.`;
-    if (errors.length > 0) msg += ` Errors in ${errors.length} images.`;
-    els.aaStatus.innerText = msg;
-
-    // Refresh current view
+    // Boxes were written server-side, refresh the current view
+    state.annotations = {};
+    const current = state.images[state.currentImageIndex];
+    if (current) await fetchAnnotations(current);
     redraw();
 }
 
@@ -1296,14 +1543,18 @@ async function exportData() {
     try {
         const format = document.getElementById('export-format').value;
         // Start Job
-        const startRes = await fetch(`/api/export/start?format=${format}`, { method: 'POST' });
+        // Streamed export: the zip is built while it downloads, so the download starts right away
+        const startRes = await fetch(`/api/export/start?format=${format}&stream=true`, { method: 'POST' });
         if (!startRes.ok) throw new Error(`Failed to start export in ${format} format`);
-        const { job_id } = await startRes.json();
+        const { job_id, stream } = await startRes.json();
+        if (stream) {
+            window.location.href = `/api/export/download/${job_id}`;
+        }
 
         // Poll Status
         const pollInterval = setInterval(async () => {
             try {
-                const statusRes = await fetch(`/api/export/status/${job_id}`);
+                const statusRes = await fetch(`/api/jobs/${job_id}`);
                 if (!statusRes.ok) return; // Skip this tick if network blip
 
                 const job = await statusRes.json();
@@ -1318,8 +1569,10 @@ async function exportData() {
 
                 if (job.status === 'completed') {
                     clearInterval(pollInterval);
-                    // Trigger Download
-                    window.location.href = `/api/export/download/${job_id}`;
+                    // Trigger Download (a streamed export is already downloaded by now)
+                    if (!stream) {
+                        window.location.href = `/api/export/download/${job_id}`;
+                    }
 
                     // Update UI to reflect Auto-Cleanup
                     updateExportProgress(100, "Export Downloaded. Workspace Cleared.");
@@ -1335,9 +1588,9 @@ async function exportData() {
                         els.exportActions.classList.add('hidden');
                     }, 2000);
 
-                } else if (job.status === 'failed') {
+                } else if (FINISHED_JOB_STATES.includes(job.status)) {
                     clearInterval(pollInterval);
-                    alert("Export Failed: " + job.error);
+                    alert("Export Failed: " + (job.error || job.status));
                     els.exportModal.classList.add('hidden');
                 }
 
@@ -0,0 +1,84 @@
+import os
+import sys
+
+import pytest
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Fewer layers/queries than the real model so it builds and runs in seconds on one CPU thread.
+# The Swin-B backbone stays (the exemplar feature projection expects its channel counts)
+TINY_CONFIG = {
+    "enc_layers": 2,
+    "dec_layers": 3,
+    "dim_feedforward": 256,
+    "num_queries": 100,
+    "num_select": 100,
+    "use_checkpoint": False,
+    "use_transformer_ckpt": False,
+}
+TINY_VOCAB = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", ".", ",", "?", "a", "the", "object", "cat", "dog",
+              "apple", "apples", "bird", "person"]
+
+
+@pytest.fixture(scope="session")
+def text_encoder_dir(tmp_path_factory):
+    """A randomly initialised one-layer BERT plus tokenizer, saved like a Hugging Face model dir."""
+    transformers = pytest.importorskip("transformers")
+    path = tmp_path_factory.mktemp("bert")
+    vocab_file = path / "vocab.txt"
+    vocab_file.write_text("\n".join(TINY_VOCAB) + "\n")
+    config = transformers.BertConfig(vocab_size=len(TINY_VOCAB), hidden_size=32, num_hidden_layers=1,
+                                     num_attention_heads=2, intermediate_size=64)
+    torch.manual_seed(0)
+    transformers.BertModel(config).save_pretrained(path)
+    transformers.BertTokenizerFast(vocab_file=str(vocab_file)).save_pretrained(path)
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def tiny_countgd(tmp_path_factory, text_encoder_dir):
+    """
+    (config path, checkpoint path, text encoder dir) of a small randomly initialised CountGD,
+    for detector_logic.load_detector_model(config, checkpoint, "cpu", text_encoder_type=...).
+    """
+    import detector_logic
+
+    path = tmp_path_factory.mktemp("countgd")
+    config_path = path / "cfg_tiny.py"
+    lines = [f"_base_ = {os.path.join(ROOT, 'config', 'cfg_fsc147_vit_b.py')!r}"]
+    lines += [f"{key} = {value!r}" for key, value in TINY_CONFIG.items()]
+    config_path.write_text("\n".join(lines) + "\n")
+
+    # Random weights: the builder seeds itself, an empty checkpoint keeps the initialisation
+    empty = path / "empty.pth"
+    torch.save({"model": {}}, empty)
+    model, _, _ = detector_logic.load_detector_model(str(config_path), str(empty), "cpu", fuse=False,
+                                                     text_encoder_type=text_encoder_dir)
+    checkpoint_path = path / "checkpoint.pth"
+    torch.save({"model": model.state_dict()}, checkpoint_path)
+    return str(config_path), str(checkpoint_path), text_encoder_dir
+
+
+@pytest.fixture(scope="session")
+def sample_image():
+    """A fixed preprocessed-looking input: (3, H, W) normalised noise, smooth enough to have structure."""
+    generator = torch.Generator().manual_seed(0)
+    small = torch.randn(1, 3, 16, 24, generator=generator)
+    return torch.nn.functional.interpolate(small, size=(256, 384), mode="bilinear", align_corners=False)[0]
+
+
+@pytest.fixture
+def load_tiny(tiny_countgd):
+    """load_detector_model(...) for the tiny CountGD on CPU; keyword arguments pass through."""
+    import detector_logic
+
+    config_path, checkpoint_path, text_encoder_dir = tiny_countgd
+
+    def load(**kwargs):
+        model, _, _ = detector_logic.load_detector_model(config_path, checkpoint_path, "cpu",
+                                                         text_encoder_type=text_encoder_dir, **kwargs)
+        return model
+    return load
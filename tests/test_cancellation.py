@@ -0,0 +1,71 @@
+import time
+import threading
+
+import pytest
+import torch
+
+import cancellation
+from inference_scheduler import ModelGate, LANE_BATCH
+
+
+def test_stage_checks_stop_between_modules():
+    torch.manual_seed(0)
+    stages = torch.nn.Sequential(torch.nn.Linear(4, 4), torch.nn.Linear(4, 4), torch.nn.Linear(4, 4))
+    assert cancellation.install_stage_checks(list(stages) + [stages[0], None]) == 3
+    # Hooking again is a no-op
+    assert cancellation.install_stage_checks(stages) == 0
+
+    ran = []
+    for module in stages:
+        module.register_forward_hook(lambda module, args, output: ran.append(module))
+    token = cancellation.CancellationToken()
+    # The first stage gives up on the work; the second stage's pre-hook must stop it
+    stages[0].register_forward_hook(lambda module, args, output: token.cancel("client gone"))
+
+    with cancellation.active(token):
+        with pytest.raises(cancellation.OperationCancelled, match="client gone"):
+            stages(torch.randn(1, 4))
+    assert ran == [stages[0]]
+    assert cancellation.current() is None
+
+    # Outside an active token the hooks are inert
+    ran.clear()
+    stages(torch.randn(1, 4))
+    assert len(ran) == 3
+
+
+def test_cancelled_waiter_leaves_the_gate_queue():
+    gate = ModelGate()
+    release = threading.Event()
+    holding = threading.Event()
+    token = cancellation.CancellationToken()
+    result = {}
+
+    def hold():
+        with gate.slot(LANE_BATCH):
+            holding.set()
+            release.wait(5)
+
+    def wait():
+        with cancellation.active(token):
+            try:
+                with gate.slot():
+                    result["ran"] = True
+            except cancellation.OperationCancelled as e:
+                result["cancelled"] = str(e)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    assert holding.wait(5)
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    deadline = time.time() + 5
+    while gate.stats()["lanes"]["interactive"]["queue_depth"] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+
+    token.cancel()
+    waiter.join(5)
+    assert result == {"cancelled": "cancelled"}
+    assert gate.stats()["lanes"]["interactive"]["queue_depth"] == 0
+    release.set()
+    holder.join(5)
@@ -0,0 +1,47 @@
+import torch
+
+import detector_logic
+from conftest import TINY_CONFIG
+
+
+def forward(model, image, prompt="cat"):
+    with torch.no_grad():
+        return model(image.unsqueeze(0), [torch.tensor([])], [torch.tensor([0])], captions=[prompt + " ."])
+
+
+def detect_stats(model, image, prompt="cat"):
+    stats = {}
+    detector_logic.run_detector_on_tensor(model, image, torch.tensor([]), prompt, "cpu", stats=stats)
+    return stats
+
+
+def test_full_decoder_reports_every_layer(load_tiny, sample_image):
+    model = load_tiny()
+    assert forward(model, sample_image)["exit_layers"].tolist() == [TINY_CONFIG["dec_layers"]]
+    assert detect_stats(model, sample_image)["decoder_layers"] == [TINY_CONFIG["dec_layers"]]
+
+
+def test_early_exit_returns_the_exit_layer_outputs(load_tiny, sample_image):
+    model = load_tiny()
+    full = forward(model, sample_image)
+
+    # Any drift is within this tolerance, so the decoder stops as soon as it may
+    model.transformer.decoder.exit_tol = 1.0
+    min_layers = model.transformer.decoder.min_layers
+    assert min_layers < TINY_CONFIG["dec_layers"]
+    early = forward(model, sample_image)
+
+    assert early["exit_layers"].tolist() == [min_layers]
+    assert detect_stats(model, sample_image)["decoder_layers"] == [min_layers]
+    # The head outputs of the exit layer, i.e. the full decoder's intermediate outputs of that layer
+    at_exit = full["aux_outputs"][min_layers - 1]
+    torch.testing.assert_close(early["pred_boxes"], at_exit["pred_boxes"])
+    torch.testing.assert_close(early["pred_logits"], at_exit["pred_logits"])
+
+
+def test_stats_collect_one_entry_per_call(load_tiny, sample_image):
+    model = load_tiny(decoder_exit_tol=1.0)
+    stats = {}
+    for _ in range(2):
+        detector_logic.run_detector_on_tensor(model, sample_image, torch.tensor([]), "cat", "cpu", stats=stats)
+    assert stats["decoder_layers"] == [model.transformer.decoder.min_layers] * 2
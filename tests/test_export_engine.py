@@ -0,0 +1,74 @@
+import io
+import sys
+import zipfile
+
+import pytest
+
+import export_engine
+
+MEMBERS = {
+    "images/a.txt": b"annotation " * 200,
+    "images/b.jpg": bytes(range(256)) * 4,
+    "empty.txt": b"",
+}
+
+
+class Unseekable(io.RawIOBase):
+    """Write-only sink like a streamed HTTP response."""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+def build(fp):
+    with zipfile.ZipFile(fp, "w") as zipf:
+        for name, data in MEMBERS.items():
+            zinfo, payload = export_engine.pack_member(name, data, compress=not name.endswith(".jpg"))
+            export_engine.write_raw_member(zipf, zinfo, payload)
+
+
+def check(raw):
+    with zipfile.ZipFile(io.BytesIO(raw)) as zipf:
+        assert zipf.testzip() is None
+        assert zipf.namelist() == list(MEMBERS)
+        for name, data in MEMBERS.items():
+            assert zipf.read(name) == data
+        assert zipf.getinfo("images/a.txt").compress_type == zipfile.ZIP_DEFLATED
+
+
+@pytest.fixture(params=["raw", "public"])
+def writer(request, monkeypatch):
+    if request.param == "public":
+        monkeypatch.setattr(export_engine, "raw_write_supported", lambda zipf: False)
+    else:
+        low, high = export_engine.RAW_WRITE_PYTHON
+        if not low <= sys.version_info[:2] <= high:
+            pytest.skip("raw member writes are disabled on this Python")
+    return request.param
+
+
+def test_write_raw_member_seekable(writer):
+    buf = io.BytesIO()
+    build(buf)
+    check(buf.getvalue())
+
+
+def test_write_raw_member_unseekable(writer):
+    sink = Unseekable()
+    build(sink)
+    check(sink.buffer.getvalue())
+
+
+def test_raw_write_supported_on_checked_versions():
+    low, high = export_engine.RAW_WRITE_PYTHON
+    with zipfile.ZipFile(io.BytesIO(), "w") as zipf:
+        assert export_engine.raw_write_supported(zipf) == (low <= sys.version_info[:2] <= high)
+        # Not while another member is open for writing
+        with zipf.open("open.txt", "w"):
+            assert not export_engine.raw_write_supported(zipf)
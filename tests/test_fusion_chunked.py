@@ -0,0 +1,56 @@
+import pytest
+import torch
+
+from models.GroundingDINO.fuse_modules import BiMultiHeadAttention
+
+
+@pytest.fixture
+def attention():
+    torch.manual_seed(0)
+    module = BiMultiHeadAttention(v_dim=16, l_dim=12, embed_dim=32, num_heads=4, dropout=0.0).eval()
+    # Non-zero biases so padded rows cannot pass by accident
+    with torch.no_grad():
+        for param in module.parameters():
+            param.add_(torch.randn_like(param) * 0.1)
+    return module
+
+
+@pytest.fixture
+def inputs():
+    generator = torch.Generator().manual_seed(1)
+    v = torch.randn(3, 37, 16, generator=generator)
+    l = torch.randn(3, 5, 12, generator=generator)
+    # True = padded. Sample 0: padded tail in both, sample 1: every text token padded,
+    # sample 2: every image token padded (its text rows attend to nothing)
+    mask_v = torch.zeros(3, 37, dtype=torch.bool)
+    mask_v[0, 30:] = True
+    mask_v[2] = True
+    mask_l = torch.zeros(3, 5, dtype=torch.bool)
+    mask_l[0, 3:] = True
+    mask_l[1] = True
+    return v, l, mask_v, mask_l
+
+
+@pytest.mark.parametrize("fused", [False, True])
+def test_chunked_matches_sdpa(attention, inputs, fused):
+    if fused:
+        attention.fuse_for_inference()
+    with torch.no_grad():
+        expected = attention._forward_sdpa(*inputs)
+        # 8 does not divide the 37 image tokens, so the last block is short
+        chunked = attention._forward_chunked(*inputs, block=8)
+    for name, want, got in zip(("vision", "text"), expected, chunked):
+        assert torch.isfinite(got).all(), name
+        torch.testing.assert_close(got, want, atol=1e-5, rtol=1e-5, msg=name)
+
+
+def test_memory_budget_selects_chunked_path(attention, inputs):
+    v, l, mask_v, mask_l = inputs
+    attention.max_memory_mb = 0.01
+    assert attention.block_size(l.shape[1]) < v.shape[1]
+    with torch.no_grad():
+        budgeted = attention(v, l, mask_v, mask_l)
+        attention.max_memory_mb = None
+        unbudgeted = attention(v, l, mask_v, mask_l)
+    for want, got in zip(unbudgeted, budgeted):
+        torch.testing.assert_close(got, want, atol=1e-5, rtol=1e-5)
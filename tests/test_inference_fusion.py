@@ -0,0 +1,33 @@
+import torch
+
+import detector_logic
+from models.GroundingDINO.backbone.swin_transformer import WindowAttention
+
+
+def detect(model, image):
+    return detector_logic.run_detector_on_tensor(model, image, torch.tensor([]), "cat", "cpu", 0.23)
+
+
+def window_attentions(model):
+    return [m for m in model.modules() if isinstance(m, WindowAttention)]
+
+
+def test_fusion_leaves_the_weights_alone(load_tiny, sample_image):
+    reference = load_tiny(fuse=False)
+    fused = load_tiny()
+    assert all(m.fused_qkv_weight is not None for m in window_attentions(fused))
+
+    state = fused.state_dict()
+    reference_state = reference.state_dict()
+    assert state.keys() == reference_state.keys()
+    for key, value in reference_state.items():
+        assert torch.equal(state[key], value), key
+
+    # Loading the saved weights back into the fused model must not scale q twice
+    before = detect(fused, sample_image)
+    fused.load_state_dict(state)
+    assert detect(fused, sample_image) == before
+    for fused_attn, reference_attn in zip(window_attentions(fused), window_attentions(reference)):
+        x = torch.randn(2, fused_attn.window_size[0] * fused_attn.window_size[1], fused_attn.dim)
+        with torch.no_grad():
+            assert torch.allclose(fused_attn(x), reference_attn(x), atol=1e-5)
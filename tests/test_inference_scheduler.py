@@ -0,0 +1,98 @@
+import time
+import threading
+
+import cancellation
+from inference_scheduler import ModelGate, LANE_INTERACTIVE, LANE_BATCH, LANE_BACKGROUND, PREEMPTED
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def queued(gate):
+    return sum(lane["queue_depth"] for lane in gate.stats()["lanes"].values())
+
+
+def test_gate_serves_lanes_by_priority_fifo_within_lane():
+    gate = ModelGate()
+    order = []
+    release = threading.Event()
+    holding = threading.Event()
+
+    def hold():
+        with gate.slot(LANE_BATCH):
+            holding.set()
+            release.wait(5)
+
+    def waiter(name, lane):
+        with gate.slot(lane):
+            order.append(name)
+
+    threads = [threading.Thread(target=hold)]
+    threads[0].start()
+    assert holding.wait(5)
+    requests = [("batch-1", LANE_BATCH), ("background", LANE_BACKGROUND), ("interactive-1", LANE_INTERACTIVE),
+                ("batch-2", LANE_BATCH), ("interactive-2", LANE_INTERACTIVE)]
+    for i, (name, lane) in enumerate(requests):
+        thread = threading.Thread(target=waiter, args=(name, lane))
+        thread.start()
+        threads.append(thread)
+        # Queue them one at a time so the arrival order is fixed
+        assert wait_until(lambda: queued(gate) == i + 1)
+
+    assert gate.stats()["active_lane"] == LANE_BATCH
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["interactive-1", "interactive-2", "batch-1", "batch-2", "background"]
+    stats = gate.stats()
+    assert stats["active_lane"] is None
+    assert stats["lanes"][LANE_BATCH]["served"] == 3
+    assert stats["lanes"][LANE_INTERACTIVE]["queue_depth"] == 0
+
+
+def test_urgent_waiter_preempts_background_unit():
+    gate = ModelGate()
+    token = cancellation.CancellationToken()
+    holding = threading.Event()
+    order = []
+
+    def background():
+        with cancellation.active(token):
+            try:
+                with gate.slot(LANE_BACKGROUND):
+                    holding.set()
+                    # Stand-in for the model's stage checks
+                    for _ in range(500):
+                        cancellation.check_current()
+                        time.sleep(0.01)
+                order.append("background finished")
+            except cancellation.OperationCancelled as e:
+                order.append(f"background {e}")
+
+    def waiter(name, lane):
+        with gate.slot(lane):
+            order.append(name)
+
+    running = threading.Thread(target=background)
+    running.start()
+    assert holding.wait(5)
+    # Another background unit queues behind it without preempting
+    queued_background = threading.Thread(target=waiter, args=("background-2", LANE_BACKGROUND))
+    queued_background.start()
+    assert wait_until(lambda: queued(gate) == 1)
+    time.sleep(0.1)
+    assert not token.cancelled
+
+    urgent = threading.Thread(target=waiter, args=("interactive", LANE_INTERACTIVE))
+    urgent.start()
+    for thread in (running, urgent, queued_background):
+        thread.join(5)
+    assert order == [f"background {PREEMPTED}", "interactive", "background-2"]
+    assert gate.stats()["active_lane"] is None
@@ -0,0 +1,161 @@
+import time
+import threading
+
+import pytest
+
+from job_scheduler import JobScheduler
+
+
+def wait_for(scheduler, job_id, statuses, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        record = scheduler.get(job_id)
+        if record["status"] in statuses:
+            return record
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} still {scheduler.get(job_id)['status']}, expected {statuses}")
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    scheduler = JobScheduler(str(tmp_path / "jobs.json"), {"export": 1, "video": 1})
+    yield scheduler
+    scheduler.shutdown()
+
+
+def blocking(started, release):
+    def fn(job):
+        started.set()
+        assert release.wait(5)
+    return fn
+
+
+def test_per_type_limit_queues_same_type_only(scheduler):
+    release = threading.Event()
+    first_started, second_started, video_started = threading.Event(), threading.Event(), threading.Event()
+    first = scheduler.submit("export", blocking(first_started, release))
+    second = scheduler.submit("export", blocking(second_started, release))
+    video = scheduler.submit("video", blocking(video_started, release))
+
+    assert first_started.wait(5) and video_started.wait(5)
+    # The export limit is 1: the second export waits, the video job does not
+    assert not second_started.wait(0.2)
+    assert scheduler.get(second.id)["status"] == "pending"
+    assert scheduler.stats()["running"] == {"export": 1, "video": 1}
+    assert scheduler.stats()["queued"] == {"export": 1}
+
+    release.set()
+    for job in (first, second, video):
+        assert wait_for(scheduler, job.id, ("completed",))["status"] == "completed"
+    assert scheduler.stats()["running"] == {"export": 0, "video": 0}
+
+
+def test_cancel_queued_job_never_runs(scheduler):
+    release = threading.Event()
+    started, queued_ran = threading.Event(), threading.Event()
+    running = scheduler.submit("export", blocking(started, release))
+    queued = scheduler.submit("export", lambda job: queued_ran.set())
+    assert started.wait(5)
+
+    assert scheduler.cancel(queued.id)
+    assert scheduler.get(queued.id)["status"] == "cancelled"
+    release.set()
+    wait_for(scheduler, running.id, ("completed",))
+    assert not queued_ran.wait(0.2)
+    # Finished jobs cannot be cancelled again
+    assert not scheduler.cancel(queued.id)
+
+
+def test_cancel_running_job_stops_at_progress(scheduler, tmp_path):
+    started = threading.Event()
+    artifact = tmp_path / "partial.zip"
+
+    def fn(job):
+        artifact.write_bytes(b"partial")
+        job.add_artifact(str(artifact))
+        started.set()
+        for i in range(500):
+            job.progress(i, 500)
+            time.sleep(0.01)
+
+    job = scheduler.submit("export", fn)
+    assert started.wait(5)
+    assert scheduler.cancel(job.id)
+    record = wait_for(scheduler, job.id, ("cancelled", "completed"))
+    assert record["status"] == "cancelled"
+    assert record["current"] < 500
+    # Partial outputs of a cancelled job are removed (right after the status change)
+    deadline = time.time() + 5
+    while artifact.exists() and time.time() < deadline:
+        time.sleep(0.01)
+    assert not artifact.exists()
+
+
+def test_failed_job_records_error(scheduler):
+    def fn(job):
+        raise RuntimeError("disk full")
+
+    job = scheduler.submit("export", fn)
+    record = wait_for(scheduler, job.id, ("failed",))
+    assert record["error"] == "disk full"
+
+
+def test_restart_marks_unfinished_jobs_interrupted(tmp_path):
+    jobs_file = str(tmp_path / "jobs.json")
+    scheduler = JobScheduler(jobs_file, {"export": 1})
+    done = scheduler.submit("export", lambda job: None)
+    wait_for(scheduler, done.id, ("completed",))
+    pending = scheduler.create("export")
+    running = scheduler.create("export")
+    running.start()
+    # Simulate a crash: the records are on disk, the scheduler is gone without finishing them
+    scheduler._executor.shutdown(wait=True)
+
+    restarted = JobScheduler(jobs_file, {"export": 1})
+    try:
+        assert restarted.get(done.id)["status"] == "completed"
+        for job in (pending, running):
+            record = restarted.get(job.id)
+            assert record["status"] == "interrupted"
+            assert record["finished"] is not None
+        assert restarted.handle(pending.id) is None
+    finally:
+        restarted.shutdown()
+
+
+def test_unclaimed_created_job_is_interrupted_after_ttl(tmp_path):
+    scheduler = JobScheduler(str(tmp_path / "jobs.json"), {"export": 1}, pending_ttl_s=60)
+    try:
+        orphan = scheduler.create("export")
+        claimed = scheduler.create("export")
+        assert scheduler.claim(claimed.id) is claimed
+        # A job is claimed once
+        assert scheduler.claim(claimed.id) is None
+
+        scheduler.cleanup_artifacts(now=time.time() + 30)
+        assert scheduler.get(orphan.id)["status"] == "pending"
+        scheduler.cleanup_artifacts(now=time.time() + 120)
+        record = scheduler.get(orphan.id)
+        assert record["status"] == "interrupted"
+        assert orphan.cancelled
+        assert scheduler.claim(orphan.id) is None
+        # Whoever drives a claimed job decides when it finishes
+        assert scheduler.get(claimed.id)["status"] == "pending"
+    finally:
+        scheduler.shutdown()
+
+
+def test_artifacts_given_at_submit_are_owned_before_dispatch(scheduler, tmp_path):
+    release = threading.Event()
+    started = threading.Event()
+    upload = tmp_path / "upload.mp4"
+    upload.write_bytes(b"video")
+    running = scheduler.submit("video", blocking(started, release))
+    assert started.wait(5)
+    queued = scheduler.submit("video", lambda job: None, artifacts=[str(upload)])
+    assert scheduler.get(queued.id)["artifacts"] == [str(upload)]
+
+    scheduler.cancel(queued.id)
+    assert not upload.exists()
+    release.set()
+    wait_for(scheduler, running.id, ("completed",))
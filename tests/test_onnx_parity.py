@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnxscript")  # torch.onnx.export(dynamo=True)
+
+import export_onnx
+import onnx_inference
+
+PROMPT = "cat"
+
+
+@pytest.fixture(scope="module")
+def onnx_export(tiny_countgd, sample_image, tmp_path_factory):
+    """The tiny CountGD exported with one shape bucket, the size of sample_image."""
+    config_path, checkpoint_path, text_encoder_dir = tiny_countgd
+    h, w = sample_image.shape[-2:]
+    out_dir = tmp_path_factory.mktemp("countgd_onnx")
+    export_onnx.export(SimpleNamespace(out_dir=str(out_dir), config=config_path, checkpoint=checkpoint_path,
+                                       text_encoder=text_encoder_dir, size=h, max_size=w, buckets=[f"{h}x{w}"]))
+    return str(out_dir)
+
+
+def test_onnx_matches_eager(onnx_export, load_tiny, sample_image):
+    model = load_tiny()
+    with torch.no_grad():
+        output = model(sample_image.unsqueeze(0), [torch.tensor([])], [torch.tensor([0])], captions=[PROMPT + " ."])
+    pred_logits, pred_boxes = onnx_inference.OnnxCountGD(onnx_export, num_threads=1)(sample_image, PROMPT + " .")
+
+    torch.testing.assert_close(pred_boxes, output["pred_boxes"], atol=1e-3, rtol=1e-3)
+    torch.testing.assert_close(pred_logits.sigmoid(), output["pred_logits"].sigmoid(), atol=1e-3, rtol=1e-3)
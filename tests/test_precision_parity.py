@@ -0,0 +1,23 @@
+import torch
+
+import detector_logic
+from benchmarks.common import compare
+
+THRESHOLD = 0.23
+
+
+def detect(model, image, prompt="cat"):
+    return detector_logic.run_detector_on_tensor(model, image, torch.tensor([]), prompt, "cpu", THRESHOLD)
+
+
+def test_bf16_matches_fp32(load_tiny, sample_image):
+    reference = detect(load_tiny(precision="fp32"), sample_image)
+    candidate = detect(load_tiny(precision="bf16"), sample_image)
+
+    assert reference, "the fp32 model should detect something to compare against"
+    metrics = compare(reference, candidate)
+    assert abs(len(candidate) - len(reference)) <= 0.05 * len(reference)
+    assert metrics["f1"] >= 0.95
+    assert metrics["mean_iou"] >= 0.95
+    assert metrics["conf_diff"] <= 0.02
+
@@ -0,0 +1,57 @@
+import pytest
+import torch
+
+import detector_logic
+
+BUCKETS = (10, 50, 100)
+
+
+def num_queries(model, image, confidence_thresh, **kwargs):
+    stats = {}
+    detector_logic.run_detector_on_tensor(model, image, torch.tensor([]), "cat", "cpu", confidence_thresh,
+                                          stats=stats, **kwargs)
+    return stats["num_queries"]
+
+
+def test_bucket_follows_the_detection_threshold(load_tiny, sample_image):
+    model = load_tiny(query_buckets=BUCKETS)
+    # No proposal scores above 1, every proposal scores above 0
+    assert num_queries(model, sample_image, 1.0) == [min(BUCKETS)]
+    assert num_queries(model, sample_image, 0.0) == [max(BUCKETS)]
+    # The per-call budget still caps the bucket
+    assert num_queries(model, sample_image, 0.0, num_queries=20) == [20]
+    assert model.transformer.bucket_threshold is None
+
+
+def test_fixed_queries_are_reported(load_tiny, sample_image):
+    model = load_tiny()
+    assert num_queries(model, sample_image, 0.23) == [model.transformer.num_queries]
+
+
+def test_buckets_need_a_threshold(load_tiny, sample_image):
+    model = load_tiny(query_buckets=BUCKETS)
+    with torch.no_grad(), pytest.raises(ValueError):
+        model(sample_image.unsqueeze(0), [torch.tensor([])], [torch.tensor([0])], captions=["cat ."])
+
+
+def blob_logits(num_objects, shapes=((32, 32), (16, 16))):
+    """Proposal logits where each object lights up a 3x3 blob of tokens on every level."""
+    levels = []
+    for h, w in shapes:
+        level = torch.full((h, w), -10.0)
+        for i in range(num_objects):
+            # Objects sit on an 8x8 grid of the image, far enough apart to stay separate blobs
+            y, x = (i // 8) * h // 8 + h // 16, (i % 8) * w // 8 + w // 16
+            level[max(0, y - 1):y + 2, max(0, x - 1):x + 2] = 2.0
+            level[y, x] = 4.0
+        levels.append(level.flatten())
+    return torch.cat(levels)[None], list(shapes)
+
+
+@pytest.mark.parametrize("num_objects, bucket", [(0, 10), (4, 10), (6, 50), (25, 50), (30, 100), (64, 100)])
+def test_bucket_counts_objects_not_tokens(load_tiny, num_objects, bucket):
+    transformer = load_tiny(query_buckets=BUCKETS).transformer
+    transformer.bucket_threshold = 0.5
+    logits, shapes = blob_logits(num_objects)
+    # 9 tokens per object on 2 levels: counting tokens would pick the largest bucket from 6 objects on
+    assert transformer.adaptive_num_queries(logits, shapes) == bucket
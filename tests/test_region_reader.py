@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import region_reader
+
+
+def make_image(path, mode, size=(300, 2100)):
+    rng = np.random.default_rng(0)
+    width, height = size
+    if mode == "RGB":
+        img = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    else:
+        img = Image.fromarray(rng.integers(0, 256, (height, width), dtype=np.uint8), "L")
+        if mode == "P":
+            img = img.convert("P", palette=Image.ADAPTIVE, colors=64)
+    img.save(path)
+    return path
+
+
+@pytest.mark.parametrize("mode", ["RGB", "L", "P"])
+@pytest.mark.parametrize("mapped", [True, False])
+def test_raw_cache_matches_full_decode(tmp_path, monkeypatch, mode, mapped):
+    path = make_image(str(tmp_path / f"ortho_{mode}.png"), mode)
+    if not mapped:
+        monkeypatch.setattr(region_reader, "_decode_to_disk", lambda img, scratch_path: None)
+    cache_dir = tmp_path / "cache"
+
+    reader = region_reader.open_region_reader(path, str(cache_dir), max_in_memory_pixels=1000)
+    assert isinstance(reader, region_reader.MemmapRegionReader)
+    expected = np.asarray(Image.open(path).convert("RGB"))
+    assert np.array_equal(reader.read_region(0, 0, reader.width, reader.height), expected)
+    assert np.array_equal(reader.read_region(17, 1000, 250, 1100), expected[1000:1100, 17:250])
+    reader.close()
+    # Only the finished cache is left behind
+    assert [p.suffix for p in cache_dir.iterdir()] == [".npy"]
+
+
+def test_decode_to_disk_maps_the_frame(tmp_path):
+    path = make_image(str(tmp_path / "ortho.jpg"), "RGB")
+    with Image.open(path) as img:
+        scratch = region_reader._decode_to_disk(img, str(tmp_path / "scratch"))
+        assert scratch is not None
+        # The decoded pixels are the scratch file's bytes (RGB is padded to 4 bytes in PIL)
+        assert np.array_equal(scratch.reshape(img.height, img.width, 4)[..., :3], np.asarray(img))
+
+
+def test_reader_cap_leaves_global_guard_alone(tmp_path, monkeypatch):
+    default = Image.MAX_IMAGE_PIXELS
+    assert default is not None
+    path = make_image(str(tmp_path / "ortho.png"), "L")
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(path)
+    # The readers use their own cap and put PIL's back afterwards
+    reader = region_reader.open_region_reader(path)
+    assert (reader.width, reader.height) == (300, 2100)
+    reader.close()
+    assert Image.MAX_IMAGE_PIXELS == 1000
+
+    monkeypatch.setattr(region_reader, "READER_MAX_PIXELS", 1000)
+    with pytest.raises(Image.DecompressionBombError):
+        region_reader.open_region_reader(path)
@@ -2,7 +2,13 @@ import cv2
 import os
 import glob
 
-def extract_frames(video_path: str, output_dir: str, fps: float = 1.0, prefix: str = "frame") -> int:
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'}
+
+def is_image_file(filename: str) -> bool:
+    """True if the filename has one of the supported image extensions (case-insensitive)."""
+    return os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+def extract_frames(video_path: str, output_dir: str, fps: float = 1.0, prefix: str = "frame", progress=None) -> int:
     """
     Extracts frames from a video at a specified frame rate.
     
@@ -11,6 +17,8 @@ def extract_frames(video_path: str, output_dir: str, fps: float = 1.0, prefix: s
         output_dir: Directory where extracted frames will be saved.
         fps: Frames per second to extract.
         prefix: Prefix for the extracted frame filenames.
+        progress: Optional callback(saved, expected_total) after each saved frame. An exception
+            raised by it (e.g. job cancellation) stops the extraction.
         
     Returns:
         Number of frames extracted.
@@ -34,34 +42,38 @@ def extract_frames(video_path: str, output_dir: str, fps: float = 1.0, prefix: s
     if frame_interval < 1:
         frame_interval = 1
         
+    total_frames = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+    expected = (total_frames + frame_interval - 1) // frame_interval if total_frames > 0 else 0
+        
     count = 0
     saved_count = 0
     success = True
     
-    while success:
-        success, image = vidcap.read()
-        if success:
-            if count % frame_interval == 0:
-                # Save frame as JPEG
-                frame_name = os.path.join(output_dir, f"{prefix}_{saved_count:05d}.jpg")
-                cv2.imwrite(frame_name, image)
-                saved_count += 1
-            count += 1
-            
-    vidcap.release()
+    try:
+        while success:
+            success, image = vidcap.read()
+            if success:
+                if count % frame_interval == 0:
+                    # Save frame as JPEG
+                    frame_name = os.path.join(output_dir, f"{prefix}_{saved_count:05d}.jpg")
+                    cv2.imwrite(frame_name, image)
+                    saved_count += 1
+                    if progress is not None:
+                        progress(saved_count, max(expected, saved_count))
+                count += 1
+    finally:
+        vidcap.release()
     return saved_count
 
 def list_images(directory: str):
     """List all image files in a directory (case-insensitive)."""
-    valid_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
     images = []
     
     if not os.path.exists(directory):
         return []
         
     for filename in os.listdir(directory):
-        ext = os.path.splitext(filename)[1].lower()
-        if ext in valid_extensions:
+        if is_image_file(filename):
             images.append(filename)
             
     # Sort for consistent order